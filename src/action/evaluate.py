@@ -149,7 +149,7 @@ def render_template(template_text, context_dict):
     return Template(new_template_text).render(Context(new_context))
 
 
-def evaluate_action(action, extra_string, column_name):
+def evaluate_action(action, extra_string, column_name, key_range=None):
     """
     Given an action object and an optional string:
     1) Access the attached workflow
@@ -171,6 +171,9 @@ def evaluate_action(action, extra_string, column_name):
            subject line) with the same dictionary as the text in the action.
     :param column_name: Column from where to extract the special value (
            typically the email address) and include it in the result.
+    :param key_range: Optional pair (first, last) to consider only the rows
+           with a value in column_name from first (included) to last
+           (excluded, or no upper bound if last is None).
     :return: list of lists resulting from the evaluation of the action
     """
 
@@ -190,7 +193,12 @@ def evaluate_action(action, extra_string, column_name):
 
     # Step 3: Get the table data
     result = []
-    data_table = pandas_db.get_table_data(workflow.id, cond_filter)
+    if key_range is not None:
+        key_range = (column_name,) + tuple(key_range)
+    data_table = pandas_db.get_table_data(workflow.id,
+                                          cond_filter,
+                                          col_names,
+                                          key_range=key_range)
 
     # Check if the values in the email column are correct emails
     try:
@@ -254,52 +254,79 @@ def clone_actions(actions, new_workflow):
         clone_action(action, new_workflow)
 
 
-def send_messages(user,
-                  action,
-                  subject,
-                  email_column,
-                  from_email,
-                  send_confirmation,
-                  track_read,
-                  add_column):
+def get_track_column_name(workflow):
     """
-    Performs the submission of the emails for the given action and with the
-    given subject. The subject will be evaluated also with respect to the
-    rows, attributes, and conditions.
+    Obtain a name for the column counting the email reads that does not
+    collide with the existing columns in the workflow.
+    :param workflow: Workflow object
+    :return: String with the column name (EmailRead_<n>)
+    """
+    col_names = workflow.get_column_names()
+    i = 0  # Suffix to rename
+    while True:
+        i += 1
+        track_col_name = 'EmailRead_{0}'.format(i)
+        if track_col_name not in col_names:
+            return track_col_name
+
+
+def add_track_column(workflow, track_col_name):
+    """
+    Add to the workflow the column to count the email reads (initialised to
+    zero) and add it to the table.
+    :param workflow: Workflow object
+    :param track_col_name: Name of the new column
+    :return: Nothing. The column is reflected in the workflow and the table.
+    """
+    # Create the new column and store
+    column = Column(
+        name=track_col_name,
+        workflow=workflow,
+        data_type='integer',
+        is_key=False
+    )
+    column.save()
+
+    # Add the column to the table (initial value 0)
+    ops.add_column_to_workflow(workflow, column, 0)
+
+
+def create_messages(user,
+                    action,
+                    subject,
+                    email_column,
+                    from_email,
+                    track_read,
+                    track_col_name,
+                    key_range=None):
+    """
+    Evaluate the action and create the email messages for the rows in the
+    table (or those with the email column within the given key range).
     :param user: User object that executed the action
     :param action: Action from where to take the messages
     :param subject: Email subject
     :param email_column: Name of the column from which to extract emails
     :param from_email: Email of the sender
-    :param send_confirmation: Boolean to send confirmation to sender
     :param track_read: Should read tracking be included?
-    :param add_column: Should a new column be added?
-    :return: Send the emails
+    :param track_col_name: Column to count the reads (or empty)
+    :param key_range: Optional pair (first, last) of values of the email
+           column to restrict the rows to consider (half-open range, see
+           evaluate_action)
+    :return: List of EmailMultiAlternatives or a string with an error
     """
 
     # Evaluate the action string, evaluate the subject, and get the value of
     # the email colummn.
     result = evaluate_action(action,
                              extra_string=subject,
-                             column_name=email_column)
+                             column_name=email_column,
+                             key_range=key_range)
 
     # Check the type of the result to see if it was successful
     if not isinstance(result, list):
         # Something went wrong. The result contains a message
         return result
 
-    track_col_name = ''
-    data_frame = None
-    if add_column:
-        data_frame = pandas_db.load_from_db(action.workflow.id)
-        # Make sure the column name does not collide with an existing one
-        i = 0  # Suffix to rename
-        while True:
-            i += 1
-            track_col_name = 'EmailRead_{0}'.format(i)
-            if track_col_name not in data_frame.columns:
-                break
-
     # Everything seemed to work to create the messages.
     msgs = []
     for msg_body, msg_subject, msg_to in result:
@@ -316,7 +343,7 @@ def send_messages(user,
             }
 
             track_str = \
-                """<img src="https://{0}/{1}?v={2}" alt="" 
+                """<img src="https://{0}/{1}?v={2}" alt=""
                     style="position:absolute; visibility:hidden"/>""".format(
                     Site.objects.get_current().domain,
                     reverse('trck'),
@@ -336,6 +363,15 @@ def send_messages(user,
         msg.attach_alternative(msg_body + track_str, "text/html")
         msgs.append(msg)
 
+    return msgs
+
+
+def deliver_messages(msgs):
+    """
+    Send the given messages (if there is an email host configured)
+    :param msgs: List of EmailMultiAlternatives
+    :return: None or a string with the error
+    """
     # Mass mail!
     if str(getattr(ontask_settings, 'EMAIL_HOST')):
         try:
@@ -345,26 +381,17 @@ def send_messages(user,
             # Something went wrong, notify above
             return e.message
 
-    # Add the column if needed
-    if add_column:
-        # Create the new column and store
-        column = Column(
-            name=track_col_name,
-            workflow=action.workflow,
-            data_type='integer',
-            is_key=False
-        )
-        column.save()
-
-        # Increase the number of columns in the workflow
-        action.workflow.ncols += 1
-        action.workflow.save()
-
-        # Initial value in the data frame and store the table
-        data_frame[track_col_name] = 0
-        ops.store_dataframe_in_db(data_frame, action.workflow.id)
+    return None
 
-    # Log the events (one per email)
+
+def log_messages(user, action, msgs):
+    """
+    Record in the log one event per email sent
+    :param user: User object that executed the action
+    :param action: Action from where the messages were taken
+    :param msgs: List of EmailMultiAlternatives sent
+    :return: Nothing
+    """
     now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
     context = {
         'user': user.id,
@@ -378,14 +405,28 @@ def send_messages(user,
         context['to_email'] = msg.to[0]
         logs.ops.put(user, 'action_email_sent', action.workflow, context)
 
+
+def notify_messages_sent(user, action, subject, num_messages,
+                         send_confirmation):
+    """
+    Record in the log the sending of the messages of an action and send the
+    (optional) confirmation email to the user
+    :param user: User object that executed the action
+    :param action: Action from where the messages were taken
+    :param subject: Email subject
+    :param num_messages: Number of messages sent
+    :param send_confirmation: Boolean to send confirmation to sender
+    :return: None or a string with the error
+    """
     # Log the event
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
     logs.ops.put(
         user,
         'action_email_sent',
         action.workflow,
         {'user': user.id,
          'action': action.name,
-         'num_messages': len(msgs),
+         'num_messages': num_messages,
          'email_sent_datetime': str(now),
          'filter_present': action.n_selected_rows != -1,
          'num_rows': action.workflow.nrows,
@@ -400,7 +441,7 @@ def send_messages(user,
     context = {
         'user': user,
         'action': action,
-        'num_messages': len(msgs),
+        'num_messages': num_messages,
         'email_sent_datetime': now,
         'filter_present': action.n_selected_rows != -1,
         'num_rows': action.workflow.nrows,
@@ -422,7 +463,7 @@ def send_messages(user,
         'action_email_notify', action.workflow,
         {'user': user.id,
          'action': action.id,
-         'num_messages': len(msgs),
+         'num_messages': num_messages,
          'email_sent_datetime': str(now),
          'filter_present': action.n_selected_rows != -1,
          'num_rows': action.workflow.nrows,
@@ -443,3 +484,60 @@ def send_messages(user,
         return 'An error occurred when sending your notification: ' + e.message
 
     return None
+
+
+def send_messages(user,
+                  action,
+                  subject,
+                  email_column,
+                  from_email,
+                  send_confirmation,
+                  track_read,
+                  add_column):
+    """
+    Performs the submission of the emails for the given action and with the
+    given subject. The subject will be evaluated also with respect to the
+    rows, attributes, and conditions.
+    :param user: User object that executed the action
+    :param action: Action from where to take the messages
+    :param subject: Email subject
+    :param email_column: Name of the column from which to extract emails
+    :param from_email: Email of the sender
+    :param send_confirmation: Boolean to send confirmation to sender
+    :param track_read: Should read tracking be included?
+    :param add_column: Should a new column be added?
+    :return: Send the emails
+    """
+
+    # Make sure the column name does not collide with an existing one
+    track_col_name = ''
+    if add_column:
+        track_col_name = get_track_column_name(action.workflow)
+
+    msgs = create_messages(user,
+                           action,
+                           subject,
+                           email_column,
+                           from_email,
+                           track_read,
+                           track_col_name)
+    if not isinstance(msgs, list):
+        # Something went wrong. The result contains a message
+        return msgs
+
+    result = deliver_messages(msgs)
+    if result:
+        return result
+
+    # Add the column if needed
+    if add_column:
+        add_track_column(action.workflow, track_col_name)
+
+    # Log the events (one per email)
+    log_messages(user, action, msgs)
+
+    return notify_messages_sent(user,
+                                action,
+                                subject,
+                                len(msgs),
+                                send_confirmation)
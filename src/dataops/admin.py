@@ -1,2 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+
+from django.contrib import admin
+
+from dataops.models import UploadTable
+
+
+class UploadTableAdmin(admin.ModelAdmin):
+    list_display = ('workflow', 'created')
+
+admin.site.register(UploadTable, UploadTableAdmin)
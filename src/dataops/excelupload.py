@@ -3,12 +3,11 @@ from __future__ import unicode_literals, print_function
 
 from collections import Counter
 
-import pandas as pd
 from django.contrib.auth.decorators import user_passes_test
 from django.shortcuts import redirect, render
 from django.urls import reverse
 
-from dataops import ops, pandas_db
+from dataops import pandas_db, staging
 from ontask.permissions import is_instructor
 from workflow.ops import get_workflow
 from .forms import UploadExcelFileForm
@@ -72,31 +71,16 @@ def excelupload1(request):
                        'dtype_select': 'Excel file',
                        'prev_step': reverse('dataops:list')})
 
-    # Process Excel file using pandas read_excel
+    # Process the sheet by chunks and store them in the upload table
     try:
-        data_frame = pd.read_excel(
-            request.FILES['file'],
-            sheetname=form.cleaned_data['sheet'],
-            index_col=False,
-            infer_datetime_format=True,
-            quotechar='"',
+        frame_info = staging.store_upload_chunks(
+            staging.read_excel_chunks(
+                request.FILES['file'],
+                form.cleaned_data['sheet'],
+                form.cleaned_data['skip_lines_at_top'] or 0,
+                form.cleaned_data['skip_lines_at_bottom'] or 0),
+            workflow.id
         )
-
-        # Strip white space from all string columns and try to convert to
-        # datetime just in case
-        for x in list(data_frame.columns):
-            if data_frame[x].dtype.name == 'object':
-                # Column is a string!
-                data_frame[x] = data_frame[x].str.strip()
-
-                # Try the datetime conversion
-                try:
-                    series = pd.to_datetime(data_frame[x],
-                                            infer_datetime_format=True)
-                    # Datetime conversion worked! Update the data_frame
-                    data_frame[x] = series
-                except ValueError:
-                    pass
     except Exception as e:
         form.add_error('file',
                        'File could not be processed ({0})'.format(e.message))
@@ -108,8 +92,9 @@ def excelupload1(request):
                        'prev_step': reverse('dataops:list')})
 
     # If the frame has repeated column names, it will not be processed.
-    if len(set(data_frame.columns)) != len(data_frame.columns):
-        dup = [x for x, v in Counter(list(data_frame.columns)) if v > 1]
+    if len(set(frame_info[0])) != len(frame_info[0]):
+        pandas_db.delete_upload_table(workflow.id)
+        dup = [x for x, v in Counter(frame_info[0]).items() if v > 1]
         form.add_error(
             'file',
             'The file has duplicated column names (' +
@@ -122,8 +107,8 @@ def excelupload1(request):
 
     # If the data frame does not have any unique key, it is not useful (no
     # way to uniquely identify rows). There must be at least one.
-    src_is_key_column = ops.are_unique_columns(data_frame)
-    if not any(src_is_key_column):
+    if not any(frame_info[2]):
+        pandas_db.delete_upload_table(workflow.id)
         form.add_error(
             'file',
             'The data has no column with unique values per row. '
@@ -134,21 +119,6 @@ def excelupload1(request):
                        'dtype_select': 'Excel file',
                        'prev_step': reverse('dataops:list')})
 
-    # Store the data frame in the DB.
-    try:
-        # Get frame info with three lists: names, types and is_key
-        frame_info = ops.store_upload_dataframe_in_db(data_frame, workflow.id)
-    except Exception as e:
-        form.add_error(
-            'file',
-            'Sorry. This file cannot be processed.'
-        )
-        return render(request, 'dataops/upload1.html',
-                      {'form': form,
-                       'dtype': 'Excel',
-                       'dtype_select': 'Excel file',
-                       'prev_step': reverse('dataops:list')})
-
     # Dictionary to populate gradually throughout the sequence of steps. It
     # is stored in the session.
     request.session['upload_data'] = {
@@ -85,6 +85,42 @@ class UploadExcelFileForm(forms.Form):
                             required=True,
                             initial='Sheet 1')
 
+    skip_lines_at_top = forms.IntegerField(
+        label='Lines to skip at the top',
+        help_text="Number of lines to skip at the top of the sheet",
+        initial=0,
+        required=False
+    )
+
+    skip_lines_at_bottom = forms.IntegerField(
+        label='Lines to skip at the bottom',
+        help_text="Number of lines to skip at the bottom of the sheet",
+        initial=0,
+        required=False
+    )
+
+    def clean(self, *args, **kwargs):
+        """
+        Function to check that the integers are positive.
+        :return: The cleaned data
+        """
+
+        data = super(UploadExcelFileForm, self).clean(*args, **kwargs)
+
+        if (data.get('skip_lines_at_top') or 0) < 0:
+            self.add_error(
+                'skip_lines_at_top',
+                'This number has to be zero or positive'
+            )
+
+        if (data.get('skip_lines_at_bottom') or 0) < 0:
+            self.add_error(
+                'skip_lines_at_bottom',
+                'This number has to be zero or positive'
+            )
+
+        return data
+
 
 # Step 1 of the CSV upload
 class UploadSQLForm(forms.Form):
@@ -201,9 +237,16 @@ class SelectColumnUploadForm(forms.Form):
             raise forms.ValidationError('No unique column specified',
                                         code='invalid')
 
-        # Get list of new names
+        # Get list of new names of the columns to upload (they are the
+        # names of the columns in the table, so they must be different)
         new_names = [cleaned_data.get('new_name_%s' % i)
-                     for i in range(len(self.column_names))]
+                     for i, upload in enumerate(upload_list) if upload]
+        if not all(new_names):
+            raise forms.ValidationError('The column names cannot be empty',
+                                        code='invalid')
+        if len(set(new_names)) != len(new_names):
+            raise forms.ValidationError('The column names must be different',
+                                        code='invalid')
 
 
 # Step 3 of the CSV upload: select unique keys to merge
@@ -213,7 +256,10 @@ class SelectKeysForm(forms.Form):
                          ('outer', 'the union of the table and new keys '
                                    '(outer)'),
                          ('inner', 'the intersection of the table and new'
-                                   ' keys (inner)')]
+                                   ' keys (inner)'),
+                         ('update', 'the union of the table and new keys, '
+                                    'changing only the values that differ '
+                                    '(update)')]
 
     how_dup_columns_choices = [('override', 'override columns with new data'),
                                ('rename', 'be renamed and become new columns.')]
@@ -230,7 +276,10 @@ class SelectKeysForm(forms.Form):
     in the file is removed. 3) If the union of keys is used, no row is 
     removed, but some rows will have empty values. 4) If the intersection of 
     the keys is used, only those rows with keys in both the table and the 
-    file will be updated, the rest will be deleted."""
+    file will be updated, the rest will be deleted. 5) If the table is 
+    updated, the values in the file replace those in the table with the 
+    same key, the rows with new keys are added, and the rest of the table 
+    is not modified."""
 
     how_dup_columns_help = """The new data has columns with names identical 
     to those that are already part of the table. You may choose to override
@@ -364,3 +413,8 @@ class RowForm(forms.Form):
 
             if column.is_key and self.initial_values[idx]:
                 self.fields[field_name].widget.attrs['readonly'] = 'readonly'
+
+            # The values of the formula columns are computed
+            if column.formula:
+                self.fields[field_name].required = False
+                self.fields[field_name].widget.attrs['readonly'] = 'readonly'
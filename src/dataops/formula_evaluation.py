@@ -59,6 +59,28 @@ def rename_variable(formula, old_name, new_name):
     return formula
 
 
+def get_variables(formula):
+    """
+    Function that traverses the formula and collects the variables used in
+    its nodes (the values of the field and type attributes).
+    :param formula: Root node of the formula object
+    :return: List of pairs (variable name, data type) without repetitions
+    """
+
+    # Trivial case of an empty formula
+    if not formula:
+        return []
+
+    if 'condition' in formula:
+        result = []
+        for node in formula['rules']:
+            result.extend([x for x in get_variables(node)
+                           if x not in result])
+        return result
+
+    return [(formula['field'], formula['type'])]
+
+
 def evaluate_top_node(query_obj, given_vars):
     """
     Given a json_string and a dictionary with (varname, varvalue),
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-12 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0013_auto_20171209_0809'),
+        ('dataops', '0005_auto_20171207_1835'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadTable',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('workflow', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='upload_table', to='workflow.Workflow')),
+            ],
+        ),
+    ]
@@ -1,2 +1,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+
+from django.db import models
+
+from workflow.models import Workflow
+
+
+class UploadTable(models.Model):
+    """
+    Registry of the tables used to stage the data uploaded to a workflow
+    before it is stored (one per workflow). The tables are removed when the
+    upload finishes, or by the script cleanup_uploads if the upload is
+    abandoned.
+    """
+
+    workflow = models.OneToOneField(Workflow,
+                                    db_index=True,
+                                    null=False,
+                                    blank=False,
+                                    on_delete=models.CASCADE,
+                                    related_name='upload_table')
+
+    # Time when the table was (last) created
+    created = models.DateTimeField(null=False, blank=False)
+
+    def __str__(self):
+        return 'Upload table of workflow {0}'.format(self.workflow_id)
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
 import pandas as pd
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 
 from action.models import Condition, Action
-from dataops import formula_evaluation
+from dataops import (formula_evaluation,
+                     pandas_db,
+                     sql_expression,
+                     staging,
+                     type_inference)
 from dataops.pandas_db import (
     create_table_name,
     create_upload_table_name,
@@ -19,6 +30,9 @@ from dataops.pandas_db import (
 from table.models import View
 from workflow.models import Workflow, Column
 
+# Prefix of the keys in the cache with the aggregates of the tables
+aggregates_key_prefix = 'ontask_aggregates_'
+
 
 def is_unique_column(df_column):
     """
@@ -103,19 +117,27 @@ def store_table_in_db(data_frame, pk, table_name, temporary=False):
                 data_frame[cname].dtype.name],
             is_key=is_unique_column(data_frame[cname]))
 
-    # Get now the new set of columns with names
-    wf_column_names = Column.objects.filter(
-        workflow__id=pk).values_list('name', flat=True)
+    # Get now the new set of columns stored in the table (the formula
+    # columns computed when the table is read are not stored)
+    wf_column_names = workflow.get_stored_column_names()
 
     # Reorder the columns in the data frame
-    data_frame = data_frame[list(wf_column_names)]
+    data_frame = data_frame[wf_column_names]
+
+    # Store the table in the DB (with an index for each key column)
+    store_table(data_frame,
+                table_name,
+                workflow.columns.filter(is_key=True).values_list('name',
+                                                                 flat=True))
+
+    pandas_db.increase_data_version(pk)
 
-    # Store the table in the DB
-    store_table(data_frame, table_name)
+    # The formula columns stored in the table are computed again
+    refresh_formula_columns(workflow, df_column_names)
 
     # Update workflow fields and save
     workflow.nrows = data_frame.shape[0]
-    workflow.ncols = data_frame.shape[1]
+    workflow.ncols = workflow.columns.count()
     workflow.set_query_builder_ops()
     workflow.data_frame_table_name = table_name
     workflow.save()
@@ -142,17 +164,13 @@ def store_upload_dataframe_in_db(data_frame, pk):
 
     :param data_frame: Pandas data frame containing the data
     :param pk: The unique key for the workflow
-    :return: If temporary = True, then return a list with three lists:
+    :return: A list with three lists:
              - column names
              - column types
              - column is unique
-             If temporary = False, return None. All this infor is stored in
-             the workflow
+             The profile of the columns is stored with the table.
     """
-    return store_table_in_db(data_frame,
-                             pk,
-                             create_upload_table_name(pk),
-                             True)
+    return staging.store_upload_chunks(iter([data_frame]), pk)
 
 
 def get_table_row_by_index(workflow, cond_filter, idx):
@@ -167,13 +185,14 @@ def get_table_row_by_index(workflow, cond_filter, idx):
     """
 
     # Get the data
-    data = get_table_data(workflow.id, cond_filter)
+    column_names = workflow.get_column_names()
+    data = get_table_data(workflow.id, cond_filter, column_names)
 
     # If the data is not there, return None
     if idx > len(data):
         return None
 
-    return dict(zip(workflow.get_column_names(), data[idx - 1]))
+    return dict(zip(column_names, data[idx - 1]))
 
 
 def workflow_has_table(workflow_item):
@@ -255,6 +274,10 @@ def perform_dataframe_upload_merge(pk, dst_df, src_df, merge_info):
             col.delete()
             continue
 
+        # The formula columns computed when the table is read are not stored
+        if col.is_virtual:
+            continue
+
         # New values in this column should be compatible with the current
         # column properties.
         # Condition 1: Data type
@@ -279,6 +302,368 @@ def perform_dataframe_upload_merge(pk, dst_df, src_df, merge_info):
     return None
 
 
+def get_upload_columns(merge_info):
+    """
+    Columns of the upload table selected to be stored in the workflow.
+
+    :param merge_info: Dictionary with the upload/merge options
+    :return: List of quadruplets (name in the upload table, final name,
+    data type, column is unique)
+    """
+    final_names = merge_info.get('autorename_column_names', None) or \
+        merge_info['rename_column_names']
+
+    return [(w, x, y, z)
+            for w, x, y, z, upload in zip(merge_info['initial_column_names'],
+                                          final_names,
+                                          merge_info['column_types'],
+                                          merge_info['src_is_key_column'],
+                                          merge_info['columns_to_upload'])
+            if upload]
+
+
+def perform_upload_merge(pk, merge_info):
+    """
+    Same as perform_dataframe_upload_merge but the data is not loaded in
+    memory. The upload table is either stored as the workflow table, or
+    joined with it (with the type of join requested in how_merge). The
+    result is created in a shadow table with CREATE TABLE ... AS SELECT and
+    swapped with the workflow table in the same transaction that updates the
+    columns. The categories and the unique columns are checked beforehand
+    with a single aggregate query over the join.
+
+    :param pk: Primary key of the Workflow
+    :param merge_info: Dictionary with merge options
+    :return: None or a string with the error message
+    """
+    workflow = Workflow.objects.get(pk=pk)
+    src_columns = get_upload_columns(merge_info)
+
+    if not workflow_id_has_table(pk):
+        # Simple upload, the columns and their properties are those
+        # detected when the file was stored.
+        override_names = []
+        dst_columns = []
+        sources = OrderedDict((y, [('src', x)])
+                              for x, y, _, _ in src_columns)
+        is_unique = dict((y, z) for _, y, _, z in src_columns)
+        from_clause = pandas_db.upload_from_clause(pk)
+    else:
+        override_names = merge_info['override_columns_names']
+        dst_key = merge_info['dst_selected_key']
+        src_key = merge_info['src_selected_key']
+
+        # Name of the key in the upload table
+        src_key_name = next((x for x, y, _, _ in src_columns if y == src_key),
+                            None)
+        if src_key_name is None:
+            return 'The key column ' + src_key + ' must be uploaded'
+
+        # Columns in the result (the key columns are combined if they have
+        # the same name, and the formula columns computed when the table is
+        # read are not stored)
+        dst_columns = [x for x in workflow.columns.all()
+                       if x.name not in override_names]
+        sources = OrderedDict((x.name, [('dst', x.name)])
+                              for x in dst_columns if not x.is_virtual)
+        for x, y, _, _ in src_columns:
+            if y == src_key and y == dst_key:
+                sources[y].append(('src', x))
+                continue
+
+            if y in [z.name for z in dst_columns]:
+                return 'Column ' + y + ' is both in the table and in the ' \
+                                      'uploaded data'
+
+            sources[y] = [('src', x)]
+
+        from_clause = pandas_db.merge_from_clause(pk,
+                                                  dst_key,
+                                                  src_key_name,
+                                                  merge_info['how_merge'])
+
+        # Number of rows, unique columns and values outside the categories
+        # of the columns in the result
+        categories = dict((x.name, x.get_categories())
+                          for x in dst_columns if x.categories)
+        try:
+            with transaction.atomic():
+                nrows, stats = pandas_db.get_select_stats(
+                    list(sources.items()),
+                    from_clause,
+                    categories)
+        except Exception as e:
+            return 'Merge operation failed. Exception: ' + e.message
+
+        # If the merge produces a table with no rows, flag it as an error to
+        # prevent loosing data when there is a mistake in the key column
+        if nrows == 0:
+            return 'Merge operation produced a result with no rows'
+
+        is_unique = {}
+        for cname, (non_empty, distinct, outside) in zip(sources.keys(),
+                                                         stats):
+            if outside:
+                return 'New values in column ' + cname + ' are not within ' \
+                       + 'the categories ' + \
+                       ', '.join(['{0}'.format(x) for x in categories[cname]])
+
+            # At most one empty value (as in pandas unique)
+            is_unique[cname] = nrows - non_empty <= 1 and \
+                distinct == non_empty
+
+    with transaction.atomic():
+        # Remove the overriden columns and update the rest
+        workflow.columns.filter(name__in=override_names).delete()
+        for col in dst_columns:
+            if col.is_virtual:
+                continue
+            col.is_key = is_unique[col.name]
+            col.save()
+
+        # Create the new columns
+        for _, cname, data_type, _ in src_columns:
+            if cname in [x.name for x in dst_columns]:
+                continue
+
+            Column.objects.create(name=cname,
+                                  workflow=workflow,
+                                  data_type=data_type,
+                                  is_key=is_unique[cname])
+
+        # Create the new table with the columns in the workflow order
+        nrows = pandas_db.create_table_from_select(
+            pk,
+            [(x, sources[x]) for x in workflow.get_stored_column_names()],
+            from_clause,
+            workflow.columns.filter(is_key=True).values_list('name',
+                                                             flat=True))
+
+        # The formula columns using the uploaded columns are computed again
+        refresh_formula_columns(workflow, [y for _, y, _, _ in src_columns])
+
+        # Update workflow fields and save
+        workflow.nrows = nrows
+        workflow.ncols = workflow.columns.count()
+        workflow.set_query_builder_ops()
+        workflow.data_frame_table_name = create_table_name(pk)
+        workflow.save()
+
+    return None
+
+
+def perform_upload_update(pk, merge_info):
+    """
+    Apply the uploaded data to the workflow table changing only what is
+    different (merge option update). The rows with a key in both tables
+    receive the values of the uploaded columns that changed, the rows with a
+    new key are inserted, and the rest of the table is left untouched. The
+    table is never rewritten: the new columns are added at the end (the
+    columns are always selected by name, so their order is not relevant).
+
+    :param pk: Primary key of the Workflow
+    :param merge_info: Dictionary with merge options
+    :return: Pair (None or a string with the error message, dictionary with
+    the summary of the changes: number of rows inserted and number of cells
+    updated per column)
+    """
+    workflow = Workflow.objects.get(pk=pk)
+    src_columns = get_upload_columns(merge_info)
+    dst_key = merge_info['dst_selected_key']
+    src_key = merge_info['src_selected_key']
+    dst_columns = dict((x.name, x) for x in workflow.columns.all())
+
+    # Name of the key in the upload table
+    src_key_name = next((x for x, y, _, _ in src_columns if y == src_key),
+                        None)
+    if src_key_name is None:
+        return 'The key column ' + src_key + ' must be uploaded', None
+
+    # Pairs (name in the table, name in the upload table) to update
+    updates = [(y, x) for x, y, _, _ in src_columns if y != src_key]
+
+    # The existing columns must keep their type and cannot be computed when
+    # the table is read
+    for _, cname, data_type, _ in src_columns:
+        col = dst_columns.get(cname)
+        if col and col.is_virtual:
+            return 'Column ' + cname + ' is computed with a formula and ' \
+                                       'cannot be updated', None
+        if cname != src_key and col and col.data_type != data_type:
+            return 'New values in column ' + cname + ' are not of type ' \
+                   + col.data_type, None
+
+    # The new values must be within the categories
+    categories = dict((x, dst_columns[x].get_categories())
+                      for x, _ in updates
+                      if x in dst_columns and dst_columns[x].categories)
+    if categories:
+        columns = [(x, [('src', y)]) for x, y in updates if x in categories]
+        _, stats = pandas_db.get_select_stats(columns,
+                                              pandas_db.upload_from_clause(pk),
+                                              categories)
+        for (cname, _), (_, _, outside) in zip(columns, stats):
+            if outside:
+                return 'New values in column ' + cname + ' are not within ' \
+                       + 'the categories ' + \
+                       ', '.join(['{0}'.format(x)
+                                  for x in categories[cname]]), None
+
+    try:
+        with transaction.atomic():
+            # Create the new columns
+            for _, cname, data_type, _ in src_columns:
+                if cname == src_key or cname in dst_columns:
+                    continue
+
+                pandas_db.add_column_to_db(pk, cname, data_type)
+                Column.objects.create(name=cname,
+                                      workflow=workflow,
+                                      data_type=data_type,
+                                      is_key=False)
+
+            # Apply the changes
+            cells_updated = pandas_db.update_from_upload(pk,
+                                                         dst_key,
+                                                         src_key_name,
+                                                         updates)
+            rows_inserted = pandas_db.insert_from_upload(pk,
+                                                         dst_key,
+                                                         src_key_name,
+                                                         updates)
+
+            # The formula columns using the updated columns are computed
+            # again (only the rows that change are written)
+            refresh_formula_columns(workflow, [x for x, _ in updates])
+
+            # Recheck the unique columns (at most one empty value)
+            columns = [(x, [('dst', x)])
+                       for x in workflow.get_stored_column_names()]
+            nrows, stats = pandas_db.get_select_stats(
+                columns,
+                pandas_db.table_from_clause(pk),
+                {})
+            for (cname, _), (non_empty, distinct, _) in zip(columns, stats):
+                Column.objects.filter(workflow=workflow, name=cname).update(
+                    is_key=nrows - non_empty <= 1 and distinct == non_empty
+                )
+
+            # Update workflow fields and save
+            workflow.nrows = nrows
+            workflow.ncols = workflow.columns.count()
+            workflow.set_query_builder_ops()
+            workflow.save()
+    except Exception as e:
+        return 'Merge operation failed. Exception: ' + e.message, None
+
+    return None, {'rows_inserted': rows_inserted,
+                  'cells_updated': cells_updated}
+
+
+def perform_table_upsert(workflow, data_frame, key_name=None):
+    """
+    Apply a set of rows to the workflow table: the rows with a key already in
+    the table receive the values of the given columns, and the rows with a
+    new key are inserted (the rest of their columns are left empty). The
+    columns must exist in the workflow, and their values are checked against
+    the types and categories of the columns before touching the table.
+
+    :param workflow: Workflow object
+    :param data_frame: Pandas data frame with the rows (and a key column)
+    :param key_name: Key column used to match the rows (if None, the first
+    key column in the data frame)
+    :return: Pair (None or a string with the error message, dictionary with
+    the number of rows updated and inserted)
+    """
+    columns = dict((x.name, x) for x in workflow.columns.all())
+
+    if key_name is None:
+        key_name = next((x for x in data_frame.columns
+                         if x in columns and columns[x].is_key), None)
+        if key_name is None:
+            return 'The data must include a key column', None
+
+    if key_name not in columns or not columns[key_name].is_key:
+        return 'Column ' + key_name + ' is not a key column', None
+
+    if key_name not in data_frame.columns:
+        return 'The data must include the key column ' + key_name, None
+
+    if data_frame[key_name].isnull().any() or \
+            not data_frame[key_name].is_unique:
+        return 'The values in the key column ' + key_name + \
+               ' must be unique and not empty', None
+
+    for cname in data_frame.columns:
+        col = columns.get(cname)
+        if col is None:
+            return 'Column ' + cname + ' is not in the table', None
+
+        if col.is_virtual or col.formula:
+            return 'Column ' + cname + ' is computed with a formula and ' \
+                                       'cannot be updated', None
+
+        # The type is detected without the empty values
+        values = data_frame[cname].dropna()
+        if values.empty:
+            continue
+
+        data_type = pandas_datatype_names.get(
+            pd.Series(values.tolist()).dtype.name
+        )
+        if data_type != col.data_type and \
+                not (data_type == 'integer' and col.data_type == 'double'):
+            return 'New values in column ' + cname + ' are not of type ' \
+                   + col.data_type, None
+
+        categories = col.get_categories()
+        if categories and set(values) - set(categories):
+            return 'New values in column ' + cname + ' are not within ' \
+                   + 'the categories ' + \
+                   ', '.join(['{0}'.format(x) for x in categories]), None
+
+    if data_frame.empty:
+        return None, {'rows_updated': 0, 'rows_inserted': 0}
+
+    try:
+        with transaction.atomic():
+            rows_updated, rows_inserted = pandas_db.upsert_rows(
+                workflow.id,
+                key_name,
+                list(data_frame.columns),
+                data_frame.to_json(orient='records', date_format='iso')
+            )
+
+            if rows_updated or rows_inserted:
+                # The formula columns using the given columns are computed
+                # again (only the rows that change are written)
+                refresh_formula_columns(workflow, list(data_frame.columns))
+
+                # Recheck the rest of the key columns (at most one empty
+                # value)
+                key_columns = [(x, [('dst', x)])
+                               for x, y in columns.items()
+                               if y.is_key and x != key_name]
+                nrows, stats = pandas_db.get_select_stats(
+                    key_columns,
+                    pandas_db.table_from_clause(workflow.id),
+                    {})
+                for (cname, _), (non_empty, distinct, _) in \
+                        zip(key_columns, stats):
+                    if nrows - non_empty > 1 or distinct != non_empty:
+                        Column.objects.filter(workflow=workflow,
+                                              name=cname).update(is_key=False)
+
+                workflow.nrows = nrows
+                workflow.set_query_builder_ops()
+                workflow.save()
+    except Exception as e:
+        return 'Upsert operation failed. Exception: ' + e.message, None
+
+    return None, {'rows_updated': rows_updated,
+                  'rows_inserted': rows_inserted}
+
+
 def data_frame_add_empty_column(df, column_name, column_type, initial_value):
     """
 
@@ -296,18 +681,9 @@ def data_frame_add_empty_column(df, column_name, column_type, initial_value):
 
     if not initial_value:
         # Choose the right numpy type
-        if column_type == 'string':
-            initial_value = ''
-        elif column_type == 'integer':
-            initial_value = 0
-        elif column_type == 'double':
-            initial_value = 0.0
-        elif column_type == 'boolean':
-            initial_value = False
-        elif column_type == 'datetime':
+        initial_value = get_empty_value(column_type)
+        if initial_value is None:
             initial_value = pd.NaT
-        else:
-            raise ValueError('Type ' + column_type + ' not found.')
 
     # Create the empty column
     df[column_name] = initial_value
@@ -315,6 +691,123 @@ def data_frame_add_empty_column(df, column_name, column_type, initial_value):
     return df
 
 
+def get_empty_value(column_type):
+    """
+    Value assigned to the cells of a new column without initial value
+
+    :param column_type: type of the column
+    :return: Value (None for the datetime columns)
+    """
+    if column_type == 'string':
+        return ''
+    elif column_type == 'integer':
+        return 0
+    elif column_type == 'double':
+        return 0.0
+    elif column_type == 'boolean':
+        return False
+    elif column_type == 'datetime':
+        return None
+
+    raise ValueError('Type ' + column_type + ' not found.')
+
+
+def add_column_to_workflow(workflow, column, initial_value=None):
+    """
+    Add the column (already attached to the workflow) to the table in the DB
+    with the given value in all the rows. The table is not rewritten.
+
+    :param workflow: Workflow object
+    :param column: New Column object
+    :param initial_value: Value for all the cells (if not given, the empty
+    value for the type of the column)
+    :return: Nothing. Side effect in the DB and the workflow
+    """
+    if not initial_value:
+        initial_value = get_empty_value(column.data_type)
+
+    pandas_db.add_column_to_db(workflow.id,
+                               column.name,
+                               column.data_type,
+                               initial_value)
+
+    workflow_columns_changed(workflow)
+
+
+def workflow_columns_changed(workflow):
+    """
+    Update the fields of the workflow that depend on its columns after one of
+    the column operations in pandas_db (the number of rows does not change).
+
+    :param workflow: Workflow object
+    :return: Nothing. The workflow is saved
+    """
+    workflow.ncols = workflow.columns.count()
+    workflow.set_query_builder_ops()
+    workflow.save()
+
+
+def get_formula_column_names(workflow, column):
+    """
+    Names of the columns used in the formula of a column
+
+    :param workflow: Workflow object
+    :param column: Formula column
+    :return: List of column names (empty if the formula is not valid)
+    """
+    column_types = dict(workflow.columns.filter(
+        is_virtual=False
+    ).values_list('name', 'data_type'))
+
+    try:
+        return sql_expression.compile_expression(
+            column.formula,
+            column_types)['column_names']
+    except ValueError:
+        return []
+
+
+def refresh_formula_columns(workflow, column_names, kv_pair=None):
+    """
+    Recompute the formula columns stored in the table that use (directly or
+    through other formula columns) the given columns. Only the rows in which
+    the values change are written. The formula columns computed when the
+    table is read need no refresh.
+
+    :param workflow: Workflow object
+    :param column_names: Names of the columns whose values changed
+    :param kv_pair: Optional key=value pair to refresh only one row
+    :return: List with the names of the columns refreshed
+    """
+    columns = workflow.columns.filter(is_virtual=False)
+    column_types = dict((x.name, x.data_type) for x in columns)
+
+    # In the order of creation, so that a formula column is refreshed after
+    # the formula columns it uses
+    changed = set(column_names)
+    refreshed = []
+    for column in columns.exclude(formula='').order_by('id'):
+        try:
+            compiled = sql_expression.compile_expression(column.formula,
+                                                         column_types)
+        except ValueError:
+            # The formula is no longer valid, the column keeps its values
+            continue
+
+        if not changed.intersection(compiled['column_names']):
+            continue
+
+        pandas_db.refresh_column_in_db(workflow.id,
+                                       column.name,
+                                       compiled['sql'],
+                                       compiled['params'],
+                                       kv_pair)
+        changed.add(column.name)
+        refreshed.append(column.name)
+
+    return refreshed
+
+
 def rename_df_column(df, workflow, old_name, new_name):
     """
     Function to change the name of a column in the dataframe.
@@ -325,6 +818,41 @@ def rename_df_column(df, workflow, old_name, new_name):
     :param new_name: new column name
     :return: Workflow object updated
     """
+    rename_column_references(workflow, old_name, new_name)
+
+    return df.rename(columns={old_name: new_name})
+
+
+def rename_column_in_workflow(workflow, old_name, new_name):
+    """
+    Function to change the name of a column in the table in the DB (without
+    rewriting it) and in the conditions, actions and views using it.
+
+    :param workflow: workflow object that is handling the table
+    :param old_name: old column name
+    :param new_name: new column name
+    :return: Nothing. Side effect in the DB
+    """
+    rename_column_references(workflow, old_name, new_name)
+
+    # The formula columns computed when the table is read are not in the DB
+    if workflow.columns.filter(name=old_name, is_virtual=True).exists():
+        pandas_db.increase_data_version(workflow.id)
+        return
+
+    pandas_db.rename_column_in_db(workflow.id, old_name, new_name)
+
+
+def rename_column_references(workflow, old_name, new_name):
+    """
+    Function to change the name of a column in the conditions, actions and
+    views of the workflow.
+
+    :param workflow: workflow object
+    :param old_name: old column name
+    :param new_name: new column name
+    :return: Nothing
+    """
 
     # Rename the appearances of the variable in all conditions/filters
     conditions = Condition.objects.filter(action__workflow=workflow)
@@ -333,6 +861,13 @@ def rename_df_column(df, workflow, old_name, new_name):
             cond.formula, old_name, new_name)
         cond.save()
 
+    # Rename the appearances of the variable in the formula columns
+    for column in workflow.columns.exclude(formula=''):
+        column.formula = sql_expression.rename_column(column.formula,
+                                                      old_name,
+                                                      new_name)
+        column.save()
+
     # Rename the appearances of the variable in all actions
     for action_item in Action.objects.filter(workflow=workflow):
         action_item.rename_variable(old_name, new_name)
@@ -346,29 +881,87 @@ def rename_df_column(df, workflow, old_name, new_name):
         )
         view.save()
 
-    return df.rename(columns={old_name: new_name})
-
 
 def detect_datetime_columns(data_frame):
     """
     Given a data frame traverse the columns and those that have type "string"
     try to see if it is of type datetime. If so, apply the translation.
     :param data_frame: Pandas dataframe to detect datetime columns
-    :return:
+    :return: Data frame with the datetime columns translated
+    """
+    return type_inference.detect_datetime_columns(data_frame)[0]
+
+
+def parse_aggregates(workflow, names):
+    """
+    Translate the aggregates given as strings function:column (or count for
+    the number of rows) and check that the functions can be applied to the
+    columns.
+
+    :param workflow: Workflow object
+    :param names: List of strings (for example, mean:score, p90:score)
+    :return: Pair (None or a string with the error message, list of pairs
+    (function, column name or None) as in pandas_db.get_aggregates)
+    """
+    column_types = dict(workflow.columns.values_list('name', 'data_type'))
+    result = []
+    for name in names:
+        function, _, cname = name.partition(':')
+        cname = cname or None
+        if function.startswith('p'):
+            if not function[1:].isdigit() or int(function[1:]) > 100:
+                return 'Incorrect percentile ' + function, None
+        elif function not in pandas_db.aggregate_functions:
+            return 'Incorrect aggregate function ' + function, None
+
+        if cname is None:
+            if function != 'count':
+                return 'The function ' + function + ' requires a column', \
+                    None
+        elif cname not in column_types:
+            return 'Incorrect column name ' + cname, None
+        elif function not in ['count', 'min', 'max'] and \
+                column_types[cname] not in ['integer', 'double']:
+            return 'The function ' + function + ' requires a numeric ' \
+                                                'column', None
+
+        result.append((function, cname))
+
+    return None, result
+
+
+def get_table_aggregates(workflow, group_by, aggregates, filter_formula=None):
+    """
+    Aggregates of the table of a workflow in groups of rows (see
+    pandas_db.get_aggregates). The result is kept in the cache with the
+    data version of the workflow, so it is computed again only when the
+    table changes.
+
+    :param workflow: Workflow object
+    :param group_by: List of columns to group the rows
+    :param aggregates: List of pairs (function, column name or None)
+    :param filter_formula: Formula of a condition to select the rows or None
+    :return: List of tuples with the values of the group columns followed by
+    the aggregates
     """
-    # Strip white space from all string columns and try to convert to
-    # datetime just in case
-    for x in list(data_frame.columns):
-        if data_frame[x].dtype.name == 'object':
-            # Column is a string!
-            data_frame[x] = data_frame[x].str.strip()
-
-            # Try the datetime conversion
-            try:
-                series = pd.to_datetime(data_frame[x],
-                                        infer_datetime_format=True)
-                # Datetime conversion worked! Update the data_frame
-                data_frame[x] = series
-            except ValueError:
-                pass
-    return data_frame
+    data_version = Workflow.objects.filter(pk=workflow.id).values_list(
+        'data_version',
+        flat=True).first()
+    request_hash = hashlib.md5(json.dumps(
+        [group_by, aggregates, filter_formula],
+        sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    cache_key = '{0}{1}_{2}_{3}'.format(aggregates_key_prefix,
+                                         workflow.id,
+                                         data_version,
+                                         request_hash)
+
+    result = cache.get(cache_key)
+    if result is None:
+        result = pandas_db.get_aggregates(workflow.id,
+                                          group_by,
+                                          aggregates,
+                                          copy.deepcopy(filter_formula))
+        cache.set(cache_key, result)
+
+    return result
@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import json
 import logging
 import os.path
 import subprocess
 from collections import OrderedDict
 
 import pandas as pd
+from django.apps import apps
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import F
 from itertools import izip
 from sqlalchemy import create_engine
 
+from dataops import table_registry
 from dataops.formula_evaluation import evaluate_node_sql
+from dataops.sql_expression import compile_expression
 from ontask import fix_pctg_in_name
 
 SITE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -20,6 +25,7 @@ SITE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 table_prefix = '__ONTASK_WORKFLOW_TABLE_'
 df_table_prefix = table_prefix + '{0}'
 upload_table_prefix = table_prefix + 'UPLOAD_{0}'
+shadow_table_suffix = '_SHADOW'
 
 # Query to count the number of rows in a table
 query_count_rows = 'SELECT count(*) from "{0}"'
@@ -35,6 +41,34 @@ pandas_datatype_names = {
     'datetime64[ns]': 'datetime'
 }
 
+# Translation between the OnTask data types and the SQL column types (the
+# same ones created by pandas to_sql)
+sql_datatype_names = {
+    'string': 'TEXT',
+    'integer': 'BIGINT',
+    'double': 'DOUBLE PRECISION',
+    'boolean': 'BOOLEAN',
+    'datetime': 'TIMESTAMP WITHOUT TIME ZONE'
+}
+
+# Translation between the merge options and the SQL joins
+merge_join_types = {
+    'left': 'LEFT OUTER JOIN',
+    'right': 'RIGHT OUTER JOIN',
+    'outer': 'FULL OUTER JOIN',
+    'inner': 'INNER JOIN'
+}
+
+# Aggregate functions accepted in get_aggregates (besides the percentiles)
+# and their SQL name
+aggregate_functions = {
+    'count': 'count',
+    'sum': 'sum',
+    'mean': 'avg',
+    'min': 'min',
+    'max': 'max'
+}
+
 # DB Engine to use with Pandas (required by to_sql, from_sql
 engine = None
 
@@ -97,6 +131,9 @@ def pg_restore_table(filename):
                                 filename])
     process.wait()
 
+    # Any table may have changed
+    table_registry.all_tables_changed()
+
 
 def delete_all_tables():
     """
@@ -111,16 +148,19 @@ def delete_all_tables():
         if not tinfo.name.startswith(table_prefix):
             continue
         cursor.execute('DROP TABLE "{0}";'.format(tinfo.name))
+        table_registry.table_changed(tinfo.name)
 
     return
 
+
 def is_table_in_db(table_name):
-    cursor = connection.cursor()
-    return next(
-        (True for x in connection.introspection.get_table_list(cursor)
-         if x.name == table_name),
-        False
-    )
+    """
+    Check if a table exists (using the registry of tables instead of the
+    catalog of the DB)
+    :param table_name: Table name
+    :return: Boolean
+    """
+    return table_registry.table_exists(table_name)
 
 
 def create_table_name(pk):
@@ -141,13 +181,80 @@ def create_upload_table_name(pk):
     return upload_table_prefix.format(pk)
 
 
+def create_shadow_table_name(table_name):
+    """
+
+    :param table_name: Table in the DB
+    :return: The table where the new content of the table is created before
+    replacing it
+    """
+    return table_name + shadow_table_suffix
+
+
+def increase_data_version(pk):
+    """
+    Increase the version of the data of a workflow after an operation that
+    modified its table. The field is updated in the DB (not read and saved)
+    so that no increment is lost with concurrent operations.
+    :param pk: Workflow primary key
+    :return: Nothing. Side effect in the DB
+    """
+    apps.get_model('workflow', 'Workflow').objects.filter(pk=pk).update(
+        data_version=F('data_version') + 1
+    )
+
+
+def get_table_source(pk):
+    """
+    Source of the rows of a workflow in the SELECT statements: the table
+    storing the data frame or, if the workflow has formula columns computed
+    when the table is read, a subquery adding them to the stored columns.
+    The subquery has the name of the table, so the rest of the statement
+    (selected columns, WHERE and ORDER BY clauses) is the same in both cases.
+
+    :param pk: Workflow primary key to obtain table name
+    :return: Pair (SQL text, list of values for its parameters)
+    """
+    table_name = create_table_name(pk)
+    columns = apps.get_model('workflow', 'Column').objects.filter(
+        workflow_id=pk
+    ).values_list('name', 'data_type', 'formula', 'is_virtual')
+
+    virtual = [(x, y) for x, _, y, z in columns if z]
+    if not virtual:
+        return '"{0}"'.format(table_name), []
+
+    # The formulas only use stored columns
+    column_types = dict((x, y) for x, y, _, z in columns if not z)
+    expressions = []
+    params = []
+    for cname, formula in virtual:
+        compiled = compile_expression(formula, column_types)
+        expressions.append('{0} AS "{1}"'.format(compiled['sql'],
+                                                 fix_pctg_in_name(cname)))
+        params.extend(compiled['params'])
+
+    return '(SELECT *, {0} FROM "{1}") AS "{1}"'.format(
+        ', '.join(expressions),
+        table_name), params
+
+
 def load_from_db(pk):
     """
-    Load the data frame stored for the workflow with the pk
+    Load the data frame stored for the workflow with the pk (including the
+    formula columns computed when the table is read)
     :param pk:
     :return: data frame
     """
-    return load_table(create_table_name(pk))
+    table_name = create_table_name(pk)
+    source, params = get_table_source(pk)
+    if source == '"{0}"'.format(table_name):
+        return load_table(table_name)
+
+    if not is_table_in_db(table_name):
+        return None
+
+    return pd.read_sql('SELECT * FROM ' + source, engine, params=params)
 
 
 def load_table(table_name):
@@ -170,7 +277,7 @@ def load_table(table_name):
     :param table_name: Table name to read from the db in to data frame
     :return: data_frame or None if it does not exist.
     """
-    if table_name not in connection.introspection.table_names():
+    if not is_table_in_db(table_name):
         return None
 
     if settings.DEBUG:
@@ -179,23 +286,91 @@ def load_table(table_name):
     return pd.read_sql(table_name, engine)
 
 
-def store_table(data_frame, table_name):
+def store_table(data_frame, table_name, index_columns=None):
     """
-    Store a data frame in the DB
+    Store a data frame in the DB. The data and the indexes are written in a
+    shadow table that replaces the existing table in a short transaction, so
+    the queries executed meanwhile never find the table missing or half
+    written.
     :param data_frame: The data frame to store
     :param table_name: The name of the table in the DB
+    :param index_columns: List of columns to index (the key columns)
     :return: Nothing. Side effect in the DB
     """
+    shadow_name = create_shadow_table_name(table_name)
 
-    # We ovewrite the content and do not create an index
-    data_frame.to_sql(table_name,
+    # We ovewrite the content of the shadow table (the data frame index is
+    # not stored)
+    data_frame.to_sql(shadow_name,
                       engine,
                       if_exists='replace',
                       index=False)
 
+    create_indexes(shadow_name, index_columns)
+
+    with transaction.atomic():
+        swap_table(shadow_name, table_name)
+
     return
 
 
+def create_indexes(table_name, column_names):
+    """
+    Create an index for each of the given columns of a table
+    :param table_name: The name of the table in the DB
+    :param column_names: List of column names (or None)
+    :return: Nothing. Side effect in the DB
+    """
+    if not column_names:
+        return
+
+    cursor = connection.cursor()
+    for cname in column_names:
+        cursor.execute('CREATE INDEX ON "{0}" ("{1}")'.format(table_name,
+                                                             cname))
+
+
+def set_table_profile(table_name, profile):
+    """
+    Store the profile of the columns of a table (a dictionary) as the comment
+    of the table, so that it is removed together with the table.
+    :param table_name: The name of the table in the DB
+    :param profile: Dictionary that can be serialized to JSON
+    :return: Nothing. Side effect in the DB
+    """
+    cursor = connection.cursor()
+    cursor.execute('COMMENT ON TABLE "{0}" IS %s'.format(table_name),
+                   [json.dumps(profile)])
+
+
+def get_table_profile(table_name):
+    """
+    Get the profile stored with set_table_profile
+    :param table_name: The name of the table in the DB
+    :return: Dictionary or None if the table has no profile
+    """
+    if not is_table_in_db(table_name):
+        return None
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')",
+                   ['"{0}"'.format(table_name)])
+    description = cursor.fetchone()[0]
+    if not description:
+        return None
+
+    return json.loads(description)
+
+
+def get_upload_profile(pk):
+    """
+    Get the profile of the columns in the upload table of the workflow
+    :param pk: Primary key of the workflow
+    :return: Dictionary with keys nrows and columns (or None)
+    """
+    return get_table_profile(create_upload_table_name(pk))
+
+
 def delete_table(pk):
     """Delete the table representing the workflow with the given PK. Due to
     the dual use of the database, the command has to be executed directly on
@@ -205,6 +380,8 @@ def delete_table(pk):
         cursor = connection.cursor()
         cursor.execute('DROP TABLE "{0}";'.format(create_table_name(pk)))
         connection.commit()
+        table_registry.table_changed(create_table_name(pk))
+        increase_data_version(pk)
     except Exception:
         logger.error(
             'Error while dropping table {0}'.format(create_table_name(pk))
@@ -219,6 +396,493 @@ def delete_upload_table(pk):
     cursor = connection.cursor()
     cursor.execute('DROP TABLE "{0}"'.format(create_upload_table_name(pk)))
     connection.commit()
+    table_registry.table_changed(create_upload_table_name(pk))
+
+
+def select_expression(sources):
+    """
+    SQL expression selecting a column from one of the tables in a join, or
+    the first non empty value among several of them.
+    :param sources: List of pairs (table alias, column name)
+    :return: String with the SQL expression (names escaped)
+    """
+    items = ['{0}."{1}"'.format(x, fix_pctg_in_name(y)) for x, y in sources]
+    if len(items) == 1:
+        return items[0]
+
+    return 'COALESCE({0})'.format(', '.join(items))
+
+
+def merge_from_clause(pk, dst_key, src_key, how_merge):
+    """
+    FROM clause joining the workflow table (alias dst) with its upload table
+    (alias src) over the given key columns.
+    :param pk: Primary key of the workflow
+    :param dst_key: Key column in the workflow table
+    :param src_key: Key column in the upload table (name in the table)
+    :param how_merge: One of left, right, outer or inner
+    :return: String with the clause (names escaped)
+    """
+    return 'FROM "{0}" AS dst {1} "{2}" AS src ' \
+           'ON dst."{3}" = src."{4}"'.format(create_table_name(pk),
+                                             merge_join_types[how_merge],
+                                             create_upload_table_name(pk),
+                                             fix_pctg_in_name(dst_key),
+                                             fix_pctg_in_name(src_key))
+
+
+def upload_from_clause(pk):
+    """
+    FROM clause selecting the upload table of the workflow (alias src).
+    :param pk: Primary key of the workflow
+    :return: String with the clause
+    """
+    return 'FROM "{0}" AS src'.format(create_upload_table_name(pk))
+
+
+def table_from_clause(pk):
+    """
+    FROM clause selecting the workflow table (alias dst).
+    :param pk: Primary key of the workflow
+    :return: String with the clause
+    """
+    return 'FROM "{0}" AS dst'.format(create_table_name(pk))
+
+
+def get_select_stats(columns, from_clause, categories):
+    """
+    Compute in one pass over the result of a select (without storing it) the
+    number of rows and, for each column, the number of non empty values, the
+    number of distinct values and the number of values that are not within
+    the allowed categories.
+    :param columns: List of pairs (column name, list of sources) as used in
+    select_expression
+    :param from_clause: FROM clause of the select
+    :param categories: Dictionary column name: list of allowed values (only
+    for the columns with categories)
+    :return: Pair (number of rows, list of triplets (non empty, distinct,
+    outside categories) for each column)
+    """
+    aggregates = ['count(*)']
+    params = []
+    for name, _ in columns:
+        sql_name = fix_pctg_in_name(name)
+        aggregates.append('count("{0}")'.format(sql_name))
+        aggregates.append('count(DISTINCT "{0}")'.format(sql_name))
+        if categories.get(name):
+            aggregates.append(
+                'count(*) FILTER (WHERE "{0}" IS NOT NULL '
+                'AND "{0}" <> ALL(%s))'.format(sql_name)
+            )
+            params.append(categories[name])
+        else:
+            aggregates.append('0')
+
+    query = 'SELECT {0} FROM (SELECT {1} {2}) AS result'.format(
+        ', '.join(aggregates),
+        ', '.join(['{0} AS "{1}"'.format(select_expression(y),
+                                         fix_pctg_in_name(x))
+                   for x, y in columns]),
+        from_clause
+    )
+
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+
+    return row[0], [row[x:x + 3] for x in range(1, len(row), 3)]
+
+
+def create_table_from_select(pk, columns, from_clause, index_columns=None):
+    """
+    Create the new content of the workflow table with the result of a select
+    in a shadow table (with its indexes), and replace the workflow table with
+    it. It must be executed inside a transaction so that the swap is atomic.
+    :param pk: Primary key of the workflow
+    :param columns: List of pairs (column name, list of sources) as used in
+    select_expression (in the order of the columns in the new table)
+    :param from_clause: FROM clause of the select
+    :param index_columns: List of columns to index (the key columns)
+    :return: Number of rows in the new table
+    """
+    table_name = create_table_name(pk)
+    shadow_name = create_shadow_table_name(table_name)
+    cursor = connection.cursor()
+    cursor.execute('DROP TABLE IF EXISTS "{0}"'.format(shadow_name))
+    cursor.execute(
+        'CREATE TABLE "{0}" AS SELECT {1} {2}'.format(
+            shadow_name,
+            ', '.join(['{0} AS "{1}"'.format(select_expression(y),
+                                             fix_pctg_in_name(x))
+                       for x, y in columns]),
+            from_clause),
+        []
+    )
+    nrows = cursor.rowcount
+
+    create_indexes(shadow_name, index_columns)
+
+    swap_table(shadow_name, table_name)
+    increase_data_version(pk)
+
+    return nrows
+
+
+def swap_table(shadow_name, table_name):
+    """
+    Replace a table with another one (removing the first one). It must be
+    executed inside a transaction so that the readers either see the old or
+    the new table.
+    :param shadow_name: Table with the new content
+    :param table_name: Table to replace
+    :return: Nothing. Side effect in the DB
+    """
+    cursor = connection.cursor()
+    cursor.execute('DROP TABLE IF EXISTS "{0}"'.format(table_name))
+    cursor.execute('ALTER TABLE "{0}" RENAME TO "{1}"'.format(shadow_name,
+                                                              table_name))
+    table_registry.table_changed(table_name)
+
+
+def add_column_to_db(pk, column_name, data_type, initial_value=None):
+    """
+    Add a column at the end of the DB table storing a data frame, with the
+    same value in all the rows (ALTER TABLE ... ADD COLUMN ... DEFAULT). The
+    default is removed afterwards, so the rows inserted later have the
+    column empty.
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :param data_type: OnTask type of the column
+    :param initial_value: Value for all the rows (None for empty)
+    :return: Nothing. Side effect in the DB
+    """
+    table_name = create_table_name(pk)
+    column_name = fix_pctg_in_name(column_name)
+    cursor = connection.cursor()
+    if initial_value is None:
+        cursor.execute('ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(
+            table_name,
+            column_name,
+            sql_datatype_names[data_type]), [])
+        table_registry.table_changed(table_name)
+        increase_data_version(pk)
+        return
+
+    cursor.execute('ALTER TABLE "{0}" ADD COLUMN "{1}" {2} DEFAULT %s'.format(
+        table_name,
+        column_name,
+        sql_datatype_names[data_type]), [initial_value])
+    cursor.execute('ALTER TABLE "{0}" ALTER COLUMN "{1}" DROP DEFAULT'.format(
+        table_name,
+        column_name), [])
+    table_registry.table_changed(table_name)
+    increase_data_version(pk)
+
+
+def clone_column_in_db(pk, column_name, new_name, data_type):
+    """
+    Add a column at the end of the DB table storing a data frame with the
+    same values as another column.
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column to copy
+    :param new_name: Name of the new column
+    :param data_type: OnTask type of the column
+    :return: Nothing. Side effect in the DB
+    """
+    add_column_to_db(pk, new_name, data_type)
+    update_column_in_db(pk,
+                        new_name,
+                        '"{0}"'.format(fix_pctg_in_name(column_name)))
+
+
+def update_column_in_db(pk, column_name, expression, params=None):
+    """
+    Assign to a column in all the rows of the DB table storing a data frame
+    the result of a SQL expression over the values in the row.
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :param expression: SQL expression (with the names escaped)
+    :param params: List of values for the parameters in the expression
+    :return: Nothing. Side effect in the DB
+    """
+    cursor = connection.cursor()
+    cursor.execute('UPDATE "{0}" SET "{1}" = {2}'.format(
+        create_table_name(pk),
+        fix_pctg_in_name(column_name),
+        expression), params or [])
+    increase_data_version(pk)
+
+
+def refresh_column_in_db(pk, column_name, expression, params=None,
+                         kv_pair=None):
+    """
+    Recompute the values of a formula column stored in the DB table. Only
+    the rows in which the value changes are written.
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :param expression: SQL expression (with the names escaped)
+    :param params: List of values for the parameters in the expression
+    :param kv_pair: Optional key=value pair to refresh only one row
+    :return: Number of rows changed
+    """
+    query = 'UPDATE "{0}" SET "{1}" = {2} ' \
+            'WHERE "{1}" IS DISTINCT FROM {2}'.format(
+                create_table_name(pk),
+                fix_pctg_in_name(column_name),
+                expression)
+    fields = (params or []) * 2
+    if kv_pair is not None:
+        query += ' AND "{0}" = %s'.format(fix_pctg_in_name(kv_pair[0]))
+        fields.append(kv_pair[1])
+
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    if cursor.rowcount:
+        increase_data_version(pk)
+
+    return cursor.rowcount
+
+
+def rename_column_in_db(pk, old_name, new_name):
+    """
+    Rename a column of the DB table storing a data frame
+    :param pk: Workflow primary key to obtain table name
+    :param old_name: Current column name
+    :param new_name: New column name
+    :return: Nothing. Side effect in the DB
+    """
+    cursor = connection.cursor()
+    cursor.execute('ALTER TABLE "{0}" RENAME COLUMN "{1}" TO "{2}"'.format(
+        create_table_name(pk),
+        old_name,
+        new_name))
+    table_registry.table_changed(create_table_name(pk))
+    increase_data_version(pk)
+
+
+def formula_column_expression(operation, column_names):
+    """
+    SQL expression combining the values of several columns in a row with the
+    same semantics as the pandas operations over the rows (axis=1) offered
+    for the formula columns: the empty values are skipped.
+    :param operation: One of sum, prod, max, min, mean, median, std, all, any
+    :param column_names: List of columns to combine
+    :return: String with the expression (names escaped)
+    """
+    names = ['"{0}"'.format(fix_pctg_in_name(x)) for x in column_names]
+    values = 'unnest(ARRAY[{0}]::DOUBLE PRECISION[]) AS v'.format(
+        ', '.join(names))
+
+    if operation == 'sum':
+        return ' + '.join(['COALESCE({0}, 0)'.format(x) for x in names])
+    elif operation == 'prod':
+        return ' * '.join(['COALESCE({0}, 1)'.format(x) for x in names])
+    elif operation == 'max':
+        return 'GREATEST({0})'.format(', '.join(names))
+    elif operation == 'min':
+        return 'LEAST({0})'.format(', '.join(names))
+    elif operation == 'mean':
+        return '(SELECT avg(v) FROM {0})'.format(values)
+    elif operation == 'median':
+        return '(SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY v) ' \
+               'FROM {0})'.format(values)
+    elif operation == 'std':
+        return '(SELECT stddev_samp(v) FROM {0})'.format(values)
+    elif operation == 'all':
+        return ' AND '.join(['COALESCE({0}, TRUE)'.format(x) for x in names])
+    elif operation == 'any':
+        return ' OR '.join(['COALESCE({0}, FALSE)'.format(x) for x in names])
+
+    raise Exception('Operand ' + operation + ' not implemented')
+
+
+def is_column_unique(pk, column_name):
+    """
+    Check if the values of a column in the DB table are unique (at most one
+    row has the column empty, as in pandas unique)
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :return: Boolean
+    """
+    source, params = get_table_source(pk)
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT count(*), count("{1}"), count(DISTINCT "{1}") '
+        'FROM {0}'.format(source, fix_pctg_in_name(column_name)), params)
+    nrows, non_empty, distinct = cursor.fetchone()
+
+    return nrows - non_empty <= 1 and distinct == non_empty
+
+
+def are_column_values_within(pk, column_name, values):
+    """
+    Check if all the non empty values of a column in the DB table are in the
+    given list
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :param values: List of allowed values
+    :return: Boolean
+    """
+    source, params = get_table_source(pk)
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT NOT EXISTS (SELECT 1 FROM {0} WHERE "{1}" IS NOT NULL '
+        'AND "{1}" <> ALL(%s))'.format(source, fix_pctg_in_name(column_name)),
+        params + [values])
+
+    return cursor.fetchone()[0]
+
+
+def update_from_upload(pk, dst_key, src_key, columns):
+    """
+    Copy to the workflow table the values in the upload table that are
+    different from the current ones, in the rows with the same key. There is
+    one UPDATE per column, and only the rows where the column changes are
+    written.
+    :param pk: Primary key of the workflow
+    :param dst_key: Key column in the workflow table
+    :param src_key: Key column in the upload table (name in the table)
+    :param columns: List of pairs (name in the workflow table, name in the
+    upload table) of the columns to update
+    :return: OrderedDict column name: number of cells changed
+    """
+    result = OrderedDict()
+    cursor = connection.cursor()
+    for dst_name, src_name in columns:
+        cursor.execute(
+            'UPDATE "{0}" AS dst SET "{2}" = src."{3}" FROM "{1}" AS src '
+            'WHERE dst."{4}" = src."{5}" '
+            'AND dst."{2}" IS DISTINCT FROM src."{3}"'.format(
+                create_table_name(pk),
+                create_upload_table_name(pk),
+                dst_name,
+                src_name,
+                dst_key,
+                src_key)
+        )
+        result[dst_name] = cursor.rowcount
+
+    if any(result.values()):
+        increase_data_version(pk)
+
+    return result
+
+
+def insert_from_upload(pk, dst_key, src_key, columns):
+    """
+    Insert in the workflow table the rows of the upload table with a key that
+    is not in the workflow table. The remaining columns are left empty. The
+    rows with no value in the key are not inserted (the key must be unique).
+    :param pk: Primary key of the workflow
+    :param dst_key: Key column in the workflow table
+    :param src_key: Key column in the upload table (name in the table)
+    :param columns: List of pairs (name in the workflow table, name in the
+    upload table) of the columns to copy (besides the key)
+    :return: Number of rows inserted
+    """
+    columns = [(dst_key, src_key)] + list(columns)
+    cursor = connection.cursor()
+    cursor.execute(
+        'INSERT INTO "{0}" ({2}) SELECT {3} FROM "{1}" AS src '
+        'WHERE src."{5}" IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "{0}" '
+        'AS dst WHERE dst."{4}" = src."{5}")'.format(
+            create_table_name(pk),
+            create_upload_table_name(pk),
+            ', '.join(['"{0}"'.format(x) for x, _ in columns]),
+            ', '.join(['src."{0}"'.format(y) for _, y in columns]),
+            dst_key,
+            src_key)
+    )
+    if cursor.rowcount:
+        increase_data_version(pk)
+
+    return cursor.rowcount
+
+
+def upsert_rows(pk, key_name, column_names, rows):
+    """
+    Update the rows of the workflow table with the given values, matching
+    them by the key column, and insert the rows with a key that is not in the
+    table (the columns not given are left empty). The rows are sent in one
+    JSON parameter and converted to the types of the table by the DB
+    (json_populate_recordset), so there is one UPDATE and one INSERT no
+    matter the number of rows. Only the rows that change are written. The
+    table is locked against concurrent upserts until the end of the
+    transaction (the key columns have no unique index).
+    :param pk: Primary key of the workflow
+    :param key_name: Key column
+    :param column_names: Columns with values (including the key)
+    :param rows: String with the JSON list of objects column name: value
+    :return: Pair (number of rows updated, number of rows inserted)
+    """
+    table_name = create_table_name(pk)
+    source = 'json_populate_recordset(NULL::"{0}", CAST(%s AS json)) ' \
+             'AS src'.format(table_name)
+    key_name = fix_pctg_in_name(key_name)
+    column_names = [fix_pctg_in_name(x) for x in column_names]
+    set_names = [x for x in column_names if x != key_name]
+
+    cursor = connection.cursor()
+    cursor.execute(
+        'LOCK TABLE "{0}" IN SHARE ROW EXCLUSIVE MODE'.format(table_name)
+    )
+
+    rows_updated = 0
+    if set_names:
+        cursor.execute(
+            'UPDATE "{0}" AS dst SET {1} FROM {2} '
+            'WHERE dst."{3}" = src."{3}" '
+            'AND ({4}) IS DISTINCT FROM ({5})'.format(
+                table_name,
+                ', '.join(['"{0}" = src."{0}"'.format(x) for x in set_names]),
+                source,
+                key_name,
+                ', '.join(['dst."{0}"'.format(x) for x in set_names]),
+                ', '.join(['src."{0}"'.format(x) for x in set_names])),
+            [rows]
+        )
+        rows_updated = cursor.rowcount
+
+    cursor.execute(
+        'INSERT INTO "{0}" ({1}) SELECT {2} FROM {3} '
+        'WHERE NOT EXISTS (SELECT 1 FROM "{0}" AS dst '
+        'WHERE dst."{4}" = src."{4}")'.format(
+            table_name,
+            ', '.join(['"{0}"'.format(x) for x in column_names]),
+            ', '.join(['src."{0}"'.format(x) for x in column_names]),
+            source,
+            key_name),
+        [rows]
+    )
+    rows_inserted = cursor.rowcount
+
+    if rows_updated or rows_inserted:
+        increase_data_version(pk)
+
+    return rows_updated, rows_inserted
+
+
+def drop_table(table_name):
+    """
+    Drop a table (if it exists). Unlike delete_table, it can be executed
+    inside a transaction.
+    :param table_name: The name of the table in the DB
+    :return: Nothing. Side effect in the DB
+    """
+    cursor = connection.cursor()
+    cursor.execute('DROP TABLE IF EXISTS "{0}"'.format(table_name))
+    table_registry.table_changed(table_name)
+
+
+def get_upload_table_pks():
+    """
+    :return: List of the primary keys of the workflows with an upload table
+    """
+    prefix = upload_table_prefix.format('')
+    cursor = connection.cursor()
+    return [int(x.name[len(prefix):])
+            for x in connection.introspection.get_table_list(cursor)
+            if x.name.startswith(prefix) and x.name[len(prefix):].isdigit()]
 
 
 def df_column_types_rename(df):
@@ -243,9 +907,11 @@ def df_drop_column(pk, column_name):
     )
     cursor = connection.cursor()
     cursor.execute(query)
+    table_registry.table_changed(create_table_name(pk))
+    increase_data_version(pk)
 
 
-def get_table_data(pk, cond_filter, column_names=None):
+def get_table_data(pk, cond_filter, column_names=None, key_range=None):
     """
     Execute a select query in the database with an optional filter obtained
     from the jquery QueryBuilder.
@@ -253,24 +919,38 @@ def get_table_data(pk, cond_filter, column_names=None):
     :param pk: Primary key of the workflow storing the data
     :param cond_filter: Condition object to filter the data (or None)
     :param column_names: optional list of columns to select
+    :param key_range: optional triplet (column name, first, last) to select
+           only the rows with values in the column from first (included) to
+           last (excluded, or no upper bound if last is None)
     :return: ([list of column names], QuerySet with the data rows)
     """
 
     # Create the query
+    source, fields = get_table_source(pk)
     if column_names:
         safe_column_names = [fix_pctg_in_name(x) for x in column_names]
-        query = 'SELECT "{0}" from "{1}"'.format(
+        query = 'SELECT "{0}" from {1}'.format(
             '", "'.join(safe_column_names),
-            create_table_name(pk)
+            source
         )
     else:
-        query = 'SELECT * from "{0}"'.format(create_table_name(pk))
+        query = 'SELECT * from {0}'.format(source)
 
     # See if the action has a filter or not
-    fields = []
     if cond_filter is not None:
-        cond_filter, fields = evaluate_node_sql(cond_filter.formula)
+        cond_filter, filter_fields = evaluate_node_sql(cond_filter.formula)
         query += ' WHERE ' + cond_filter
+        fields = fields + filter_fields
+
+    # Restrict the rows to the given range of the key column
+    if key_range is not None:
+        key_name, first, last = key_range
+        query += ' AND ' if cond_filter is not None else ' WHERE '
+        query += '"{0}" >= %s'.format(fix_pctg_in_name(key_name))
+        fields = fields + [first]
+        if last is not None:
+            query += ' AND "{0}" < %s'.format(fix_pctg_in_name(key_name))
+            fields = fields + [last]
 
     # Execute the query
     cursor = connection.cursor()
@@ -280,6 +960,59 @@ def get_table_data(pk, cond_filter, column_names=None):
     return cursor.fetchall()
 
 
+def get_key_ranges(pk, key_name, cond_filter, range_size):
+    """
+    Split the distinct values of the given key column (in the rows of the
+    table with an optional filter) in consecutive ranges with at most
+    range_size rows (unless a single value appears in more rows). The ranges
+    are half-open, [first, next first), so each value is only in one of them,
+    and the last one has no upper bound. The rows with no value in the
+    column are not in any range and are counted separately.
+
+    :param pk: Primary key of the workflow storing the data
+    :param key_name: Name of the key column used to split the rows
+    :param cond_filter: Condition object to filter the data (or None)
+    :param range_size: Maximum number of rows in each range
+    :return: Pair (list of triplets (first key, first key of the next range
+             or None, number of rows), number of rows with a NULL key)
+    """
+    source, fields = get_table_source(pk)
+    query = 'SELECT "{0}" AS key, count(*) AS n FROM {1}'.format(
+        fix_pctg_in_name(key_name),
+        source
+    )
+    if cond_filter is not None:
+        cond_filter, filter_fields = evaluate_node_sql(cond_filter.formula)
+        query += ' WHERE ' + cond_filter
+        fields = fields + filter_fields
+    query += ' GROUP BY "{0}"'.format(fix_pctg_in_name(key_name))
+
+    # Number the ranges with the rows accumulated before each value (NULL
+    # sorts last, so it does not change the sum for the other values)
+    query = 'SELECT min(key), CAST(sum(n) AS BIGINT) FROM (' \
+            'SELECT key, n, CASE WHEN key IS NULL THEN -1 ELSE ' \
+            'CAST(sum(n) OVER (ORDER BY key) - n AS BIGINT) / %s END ' \
+            'AS range_idx FROM ({0}) AS keys) AS sub ' \
+            'GROUP BY range_idx ORDER BY range_idx'.format(query)
+    fields = fields + [range_size]
+
+    # Execute the query
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    rows = cursor.fetchall()
+
+    null_rows = 0
+    if rows and rows[0][0] is None:
+        null_rows = rows.pop(0)[1]
+
+    firsts = [x[0] for x in rows]
+    return [(first, last, nrows)
+            for first, last, (_, nrows) in zip(firsts,
+                                               firsts[1:] + [None],
+                                               rows)], \
+        null_rows
+
+
 def execute_select_on_table(pk, fields, values, column_names=None):
     """
     Execute a select query in the database with an optional filter obtained
@@ -301,23 +1034,134 @@ def execute_select_on_table(pk, fields, values, column_names=None):
         query = 'SELECT *'
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(pk))
+    source, params = get_table_source(pk)
+    query += ' FROM ' + source
 
     # See if the action has a filter or not
-    cursor = connection.cursor()
     if fields:
         query += ' WHERE ' + \
                  ' AND '.join(['"{0}" = %s'.format(fix_pctg_in_name(x))
                                for x in fields])
-        cursor.execute(query, values)
-    else:
-        # Execute the query
-        cursor.execute(query)
+        params = params + list(values)
+
+    # Execute the query
+    cursor = connection.cursor()
+    cursor.execute(query, params)
 
     # Get the data
     return cursor.fetchall()
 
 
+def get_select_query(pk,
+                     column_names,
+                     filter_formula=None,
+                     order_by=None,
+                     start=0,
+                     length=None):
+    """
+    SELECT statement over the table of a workflow with the selection of
+    columns, the filter, the order and the range of rows done in the DB.
+
+    :param pk: Primary key of the workflow storing the data
+    :param column_names: List of columns to select
+    :param filter_formula: Formula of a condition to filter the rows (in
+    the QueryBuilder format) or None
+    :param order_by: List of pairs (column name, True if descending) to sort
+    the rows
+    :param start: Number of rows to skip
+    :param length: Maximum number of rows to select (None for all)
+    :return: Pair (SQL text, list of values for its parameters)
+    """
+    source, params = get_table_source(pk)
+    query = 'SELECT {0} FROM {1}'.format(
+        ', '.join(['"{0}"'.format(fix_pctg_in_name(x))
+                   for x in column_names]),
+        source
+    )
+
+    if filter_formula:
+        filter_sql, filter_fields = evaluate_node_sql(filter_formula)
+        if filter_sql:
+            query += ' WHERE ' + filter_sql
+            params = params + filter_fields
+
+    if order_by:
+        query += ' ORDER BY ' + ', '.join(
+            ['"{0}"{1}'.format(fix_pctg_in_name(x), ' DESC' if y else '')
+             for x, y in order_by])
+
+    if length is not None:
+        query += ' LIMIT %s'
+        params = params + [length]
+
+    if start:
+        query += ' OFFSET %s'
+        params = params + [start]
+
+    return query, params
+
+
+def load_selection_from_db(pk,
+                           column_names,
+                           filter_formula=None,
+                           order_by=None,
+                           start=0,
+                           length=None):
+    """
+    Load part of the data frame of the workflow (see get_select_query for
+    the parameters)
+    :return: data frame or None if the table does not exist
+    """
+    if not is_table_in_db(create_table_name(pk)):
+        return None
+
+    query, params = get_select_query(pk,
+                                     column_names,
+                                     filter_formula,
+                                     order_by,
+                                     start,
+                                     length)
+    return pd.read_sql(query, engine, params=params)
+
+
+def get_table_chunks(pk,
+                     column_names,
+                     filter_formula=None,
+                     order_by=None,
+                     start=0,
+                     length=None,
+                     chunk_size=2000):
+    """
+    Read the rows of the table with a server-side cursor, so they are
+    transferred from the DB in chunks and never all at once in memory (see
+    get_select_query for the parameters).
+
+    :param chunk_size: Number of rows in each chunk
+    :return: Generator of lists of tuples with the values of the rows
+    """
+    if not column_names:
+        # Workflow without data
+        return
+
+    query, params = get_select_query(pk,
+                                     column_names,
+                                     filter_formula,
+                                     order_by,
+                                     start,
+                                     length)
+
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
 def get_table_queryset(tablename):
     query = 'SELECT * from "{0}";'.format(tablename)
     try:
@@ -376,6 +1220,7 @@ def update_row(pk, set_fields, set_values, where_fields, where_values):
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, parameters)
+    increase_data_version(pk)
     connection.commit()
 
 
@@ -392,19 +1237,20 @@ def get_table_row_by_key(workflow, cond_filter, kv_pair, column_names=None):
      row has not been found
     """
 
-    # Create the query
-    if column_names:
-        safe_column_names = [fix_pctg_in_name(x) for x in column_names]
-        query = 'SELECT "{0}"'.format('", "'.join(safe_column_names))
-    else:
-        query = 'SELECT *'
+    # Create the query (the columns are always given, as their order in the
+    # table may differ from the one in the workflow)
+    if not column_names:
+        column_names = workflow.get_column_names()
+    safe_column_names = [fix_pctg_in_name(x) for x in column_names]
+    query = 'SELECT "{0}"'.format('", "'.join(safe_column_names))
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(workflow.id))
+    source, fields = get_table_source(workflow.id)
+    query += ' FROM ' + source
 
     # Create the second part of the query setting key=value
     query += ' WHERE ("{0}" = %s)'.format(fix_pctg_in_name(kv_pair[0]))
-    fields = [kv_pair[1]]
+    fields = fields + [kv_pair[1]]
 
     # See if the action has a filter or not
     if cond_filter is not None:
@@ -428,7 +1274,7 @@ def get_table_row_by_key(workflow, cond_filter, kv_pair, column_names=None):
     qs = qs[0]
 
     # ZIP the values to create a dictionary
-    return OrderedDict(zip(workflow.get_column_names(), qs))
+    return OrderedDict(zip(column_names, qs))
 
 def get_column_stats_from_df(df_column):
 
@@ -521,8 +1367,8 @@ def search_table_rows(workflow_id,
         query = 'SELECT *'
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(workflow_id))
-
+    source, fields = get_table_source(workflow_id)
+    query += ' FROM ' + source
 
     # Calculate the first suffix to add to the query
     filter_txt = ''
@@ -555,7 +1401,6 @@ def search_table_rows(workflow_id,
     if filter_txt or cv_tuples:
         query += ' WHERE '
 
-    fields = []
     # If there has been a suffix from the filter, add it.
     if filter_txt and filter_fields:
         query += filter_txt
@@ -605,6 +1450,71 @@ def delete_table_row_by_key(workflow_id, kv_pair):
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, fields)
+    increase_data_version(workflow_id)
+
+
+def aggregate_expression(function, column_name):
+    """
+    SQL expression of an aggregate function over a column
+    :param function: One of the names in aggregate_functions, or pNN for the
+    percentile NN (for example p90)
+    :param column_name: Column name (None only for count, all the rows)
+    :return: String with the SQL expression (name escaped)
+    """
+    if column_name is None:
+        return 'count(*)'
+
+    column = '"{0}"'.format(fix_pctg_in_name(column_name))
+    if function.startswith('p'):
+        return 'percentile_cont({0}) WITHIN GROUP (ORDER BY {1})'.format(
+            int(function[1:]) / 100.0,
+            column)
+
+    if function in ['sum', 'mean']:
+        # The DB returns NUMERIC for the integer columns
+        return 'CAST({0}({1}) AS DOUBLE PRECISION)'.format(
+            aggregate_functions[function],
+            column)
+
+    return '{0}({1})'.format(aggregate_functions[function], column)
+
+
+def get_aggregates(pk, group_by, aggregates, filter_formula=None):
+    """
+    Compute aggregates of the table of a workflow in groups of rows (GROUP
+    BY executed in the DB).
+
+    :param pk: Primary key of the workflow storing the data
+    :param group_by: List of columns to group the rows (empty for one group
+    with all the rows)
+    :param aggregates: List of pairs (function, column name) as in
+    aggregate_expression
+    :param filter_formula: Formula of a condition to select the rows (in
+    the QueryBuilder format) or None
+    :return: List of tuples with the values of the group columns followed by
+    the aggregates, sorted by the group columns
+    """
+    source, params = get_table_source(pk)
+    group_names = ['"{0}"'.format(fix_pctg_in_name(x)) for x in group_by]
+    query = 'SELECT {0} FROM {1}'.format(
+        ', '.join(group_names + [aggregate_expression(x, y)
+                                 for x, y in aggregates]),
+        source
+    )
+
+    if filter_formula:
+        filter_sql, filter_fields = evaluate_node_sql(filter_formula)
+        if filter_sql:
+            query += ' WHERE ' + filter_sql
+            params = params + filter_fields
+
+    if group_names:
+        query += ' GROUP BY {0} ORDER BY {0}'.format(', '.join(group_names))
+
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+
+    return cursor.fetchall()
 
 
 def num_rows(pk, cond_filter=None):
@@ -614,7 +1524,18 @@ def num_rows(pk, cond_filter=None):
     :param cond_filter: Condition element to filter the query
     :return:
     """
-    return num_rows_by_name(create_table_name(pk), cond_filter)
+    if cond_filter is None:
+        return num_rows_by_name(create_table_name(pk))
+
+    # The filter may use formula columns computed when the table is read
+    source, fields = get_table_source(pk)
+    cond_filter, filter_fields = evaluate_node_sql(cond_filter)
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT count(*) FROM {0} WHERE {1}'.format(source,
+                                                               cond_filter),
+                   fields + filter_fields)
+    return cursor.fetchone()[0]
 
 
 def num_rows_by_name(table_name, cond_filter=None):
@@ -638,10 +1559,67 @@ def num_rows_by_name(table_name, cond_filter=None):
     return cursor.fetchone()[0]
 
 
-def check_wf_df(workflow):
+def get_table_column_types(table_name):
+    """
+    Columns of a table and their types obtained from the registry of tables
+    (the data is not read).
+    :param table_name: Table name
+    :return: OrderedDict column name: OnTask data type (None if the SQL type
+    has no translation), empty if the table does not exist
+    """
+    sql_types = dict((y.lower(), x) for x, y in sql_datatype_names.items())
+
+    return OrderedDict(
+        (x, sql_types.get(y))
+        for x, y in table_registry.get_table_columns(table_name).items())
+
+
+def check_wf_df(workflow, deep=False):
     """
     Check the consistency between the information stored in the workflow
-    and the structure of the underlying dataframe
+    and the structure of the underlying dataframe. By default only the
+    metadata of the table is used (the columns and types in the catalog of
+    the DB and the number of rows). The deep check loads the table in a data
+    frame and compares the types detected by pandas (it reads all the data,
+    so it is meant for maintenance tasks).
+
+    :param workflow: Workflow object
+    :param deep: Boolean to load the data frame in the check
+    :return: Boolean stating the result of the check. True: Correct.
+    """
+    if deep:
+        return check_wf_df_deep(workflow)
+
+    table_name = create_table_name(workflow.id)
+    table_types = get_table_column_types(table_name)
+    nrows = num_rows_by_name(table_name) if table_types else 0
+
+    # Check 1: Number of rows and columns
+    wf_cols = workflow.columns.all()
+    if workflow.nrows != nrows:
+        return False
+    if workflow.ncols != len(wf_cols):
+        return False
+
+    # Identical sets of columns (the formula columns computed when the table
+    # is read are not stored)
+    stored_cols = [x for x in wf_cols if not x.is_virtual]
+    if sorted([x.name for x in stored_cols]) != sorted(table_types.keys()):
+        return False
+
+    # Identical data types
+    for col in stored_cols:
+        if col.data_type != table_types[col.name]:
+            return False
+
+    return True
+
+
+def check_wf_df_deep(workflow):
+    """
+    Check the consistency between the information stored in the workflow
+    and the data frame loaded from the DB (including the formula columns
+    computed when the table is read).
 
     :param workflow: Workflow object
     :return: Boolean stating the result of the check. True: Correct.
@@ -665,15 +1643,14 @@ def check_wf_df(workflow):
     if workflow.ncols != dfncols:
         return False
 
-    # Identical sets of columns
+    # Identical sets of columns (the order in the table is not relevant)
     wf_cols = workflow.columns.all()
-    if [x.name for x in wf_cols] != df_col_names:
+    if sorted([x.name for x in wf_cols]) != sorted(df_col_names):
         return False
 
     # Identical data types
-    for n1, n2 in zip(wf_cols, df_col_names):
-        if n1.data_type != pandas_datatype_names[df[n2].dtype.name]:
+    for col in wf_cols:
+        if col.data_type != pandas_datatype_names.get(df[col.name].dtype.name):
             return False
 
     return True
-
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from django.conf import settings
+from django.db import models
+
+UPLOAD_CHUNK_SIZE = getattr(settings, 'DATAOPS_UPLOAD_CHUNK_SIZE', 10000)
+TYPE_INFERENCE_SAMPLE_SIZE = getattr(settings,
+                                     'DATAOPS_TYPE_INFERENCE_SAMPLE_SIZE',
+                                     200)
+UPLOAD_TABLE_EXPIRY = getattr(settings, 'DATAOPS_UPLOAD_TABLE_EXPIRY', 24)
+# Accept the workflows exported by previous versions (the data frame is a
+# pickle, which executes code when read) in the imports of the superusers.
+# It is not a preference on purpose: it can only be enabled in the
+# configuration.
+IMPORT_ALLOW_PICKLE = getattr(settings, 'DATAOPS_IMPORT_ALLOW_PICKLE', False)
+
+if 'siteprefs' in settings.INSTALLED_APPS:
+    # Respect those users who doesn't have siteprefs installed.
+    from siteprefs.toolbox import patch_locals, register_prefs, pref
+
+    patch_locals()  # That's bootstrap.
+
+    register_prefs(
+        pref(UPLOAD_CHUNK_SIZE,
+             verbose_name='Number of rows read and stored at a time when '
+                          'uploading a file',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(TYPE_INFERENCE_SAMPLE_SIZE,
+             verbose_name='Number of values of each column used to detect '
+                          'its type when uploading data',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(UPLOAD_TABLE_EXPIRY,
+             verbose_name='Hours after which the data of an unfinished '
+                          'upload is removed',
+             static=False,
+             field=models.IntegerField(blank=True)),
+    )
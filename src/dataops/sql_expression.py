@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+Translation to SQL of the expressions used to define formula columns (for
+example 0.4 * Quiz + 0.6 * Exam). The expression is parsed with the Python
+ast module and only a small subset of the language is accepted: numbers,
+strings, True/False, column names, the arithmetic, comparison and Boolean
+operators, conditional expressions (a if condition else b) and the
+functions in expression_functions. The types of the columns are checked
+while the expression is translated, so the SQL obtained can be executed
+over the workflow table without errors due to the types.
+"""
+from __future__ import unicode_literals, print_function
+
+import ast
+import io
+import keyword
+import numbers
+import re
+import tokenize
+
+from ontask import fix_pctg_in_name
+
+numeric_types = ['integer', 'double']
+
+# Column names that can be written directly in the expression
+identifier_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Operators with numbers (the addition also concatenates strings)
+arithmetic_operators = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+    ast.Mod: '%%',
+    ast.Pow: '^'
+}
+
+comparison_operators = {
+    ast.Eq: '=',
+    ast.NotEq: '<>',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>='
+}
+
+# Functions that can be used in the expressions: name, SQL function (None if
+# it is translated in a special way) and description
+expression_functions = [
+    ('abs', 'abs', 'abs(x): Absolute value'),
+    ('round', None, 'round(x, n): Value rounded to n decimals (default 0)'),
+    ('min', 'LEAST', 'min(x, y, ...): Minimum of the values'),
+    ('max', 'GREATEST', 'max(x, y, ...): Maximum of the values'),
+    ('col', None, 'col(\'name\'): Column with a name that is not a valid '
+                  'identifier'),
+]
+
+
+def merge_numeric_types(types):
+    """
+    Type of the result of an operation with numbers
+
+    :param types: List of types (integer or double)
+    :return: integer if all of them are integers, double otherwise
+    """
+    if all([x == 'integer' for x in types]):
+        return 'integer'
+
+    return 'double'
+
+
+class ExpressionCompiler(object):
+    """
+    Translate an expression to SQL. The visit method receives a node of the
+    tree created by ast.parse and returns a pair (SQL text, data type). The
+    values of the constants are accumulated in the attribute params (to be
+    given to cursor.execute), and the names of the columns used in the
+    attribute column_names.
+    """
+
+    def __init__(self, column_types):
+        """
+        :param column_types: Dictionary column name: data type
+        """
+        self.column_types = column_types
+        self.params = []
+        self.column_names = []
+
+    def compile(self, text):
+        """
+        Translate the expression
+
+        :param text: String with the expression
+        :return: Pair (SQL text, data type of the result)
+        """
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError:
+            raise ValueError('The expression is not correct')
+
+        return self.visit(tree.body)
+
+    def visit(self, node):
+        method = getattr(self, 'visit_' + node.__class__.__name__, None)
+        if method is None:
+            raise ValueError('Elements of type ' + node.__class__.__name__ +
+                             ' are not allowed in the expression')
+
+        return method(node)
+
+    def constant(self, value):
+        """
+        Translate a constant value (the numbers and strings are given as
+        parameters)
+        """
+        if isinstance(value, bool):
+            return ('TRUE' if value else 'FALSE'), 'boolean'
+
+        if isinstance(value, numbers.Integral):
+            self.params.append(value)
+            return '%s', 'integer'
+
+        if isinstance(value, numbers.Real):
+            self.params.append(value)
+            return 'CAST(%s AS DOUBLE PRECISION)', 'double'
+
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+
+        if isinstance(value, type('')):
+            self.params.append(value)
+            return '%s', 'string'
+
+        raise ValueError('Value ' + repr(value) + ' not allowed in the '
+                                                  'expression')
+
+    def column(self, name):
+        """
+        Translate a column name
+        """
+        if name not in self.column_types:
+            raise ValueError('There is no column with name ' + name)
+
+        if name not in self.column_names:
+            self.column_names.append(name)
+
+        return '"{0}"'.format(fix_pctg_in_name(name)), self.column_types[name]
+
+    def visit_Num(self, node):
+        return self.constant(node.n)
+
+    def visit_Str(self, node):
+        return self.constant(node.s)
+
+    def visit_NameConstant(self, node):
+        return self.constant(node.value)
+
+    def visit_Constant(self, node):
+        return self.constant(node.value)
+
+    def visit_Name(self, node):
+        # In Python 2 True and False are names
+        if node.id in ['True', 'False']:
+            return self.constant(node.id == 'True')
+
+        return self.column(node.id)
+
+    def visit_BinOp(self, node):
+        left, left_type = self.visit(node.left)
+        right, right_type = self.visit(node.right)
+        operator = arithmetic_operators.get(node.op.__class__)
+        if operator is None:
+            raise ValueError('Operator not allowed in the expression')
+
+        # Concatenation of strings
+        if operator == '+' and left_type == 'string' and \
+                right_type == 'string':
+            return '({0} || {1})'.format(left, right), 'string'
+
+        if left_type not in numeric_types or right_type not in numeric_types:
+            raise ValueError('Arithmetic operators require numbers')
+
+        if operator == '/':
+            # Division by zero gives an empty value
+            return '({0} / NULLIF(CAST({1} AS DOUBLE PRECISION), 0))'.format(
+                left, right), 'double'
+
+        if operator == '^':
+            return 'power({0}, {1})'.format(left, right), 'double'
+
+        if operator == '%%':
+            if left_type != 'integer' or right_type != 'integer':
+                raise ValueError('The remainder (%) requires integers')
+            return '({0} %% NULLIF({1}, 0))'.format(left, right), 'integer'
+
+        return '({0} {1} {2})'.format(left, operator, right), \
+            merge_numeric_types([left_type, right_type])
+
+    def visit_UnaryOp(self, node):
+        operand, operand_type = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            if operand_type != 'boolean':
+                raise ValueError('The operator not requires a Boolean value')
+            return '(NOT {0})'.format(operand), 'boolean'
+
+        if operand_type not in numeric_types:
+            raise ValueError('The sign requires a number')
+
+        if isinstance(node.op, ast.USub):
+            return '(-{0})'.format(operand), operand_type
+
+        if isinstance(node.op, ast.UAdd):
+            return operand, operand_type
+
+        raise ValueError('Operator not allowed in the expression')
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(x) for x in node.values]
+        if any([x[1] != 'boolean' for x in values]):
+            raise ValueError('The operators and/or require Boolean values')
+
+        operator = ' AND ' if isinstance(node.op, ast.And) else ' OR '
+        return '(' + operator.join([x[0] for x in values]) + ')', 'boolean'
+
+    def visit_Compare(self, node):
+        left, left_type = self.visit(node.left)
+        terms = []
+        left_params = []
+        for op, comparator in zip(node.ops, node.comparators):
+            operator = comparison_operators.get(op.__class__)
+            if operator is None:
+                raise ValueError('Comparison not allowed in the expression')
+
+            # In a chain (a < b < c) the middle values appear twice
+            self.params.extend(left_params)
+            nparams = len(self.params)
+            right, right_type = self.visit(comparator)
+            left_params = self.params[nparams:]
+            if left_type != right_type and \
+                    not (left_type in numeric_types and
+                         right_type in numeric_types):
+                raise ValueError('Values of type ' + left_type + ' and ' +
+                                 right_type + ' cannot be compared')
+
+            terms.append('({0} {1} {2})'.format(left, operator, right))
+            left, left_type = right, right_type
+
+        if len(terms) == 1:
+            return terms[0], 'boolean'
+
+        return '(' + ' AND '.join(terms) + ')', 'boolean'
+
+    def visit_IfExp(self, node):
+        test, test_type = self.visit(node.test)
+        if test_type != 'boolean':
+            raise ValueError('The condition must be a Boolean value')
+
+        body, body_type = self.visit(node.body)
+        orelse, orelse_type = self.visit(node.orelse)
+        if body_type == orelse_type:
+            result_type = body_type
+        elif body_type in numeric_types and orelse_type in numeric_types:
+            result_type = 'double'
+        else:
+            raise ValueError('Both values in the conditional expression '
+                             'must have the same type')
+
+        return 'CASE WHEN {0} THEN {1} ELSE {2} END'.format(test,
+                                                           body,
+                                                           orelse), \
+            result_type
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or \
+                getattr(node, 'keywords', None) or \
+                getattr(node, 'starargs', None) or \
+                getattr(node, 'kwargs', None):
+            raise ValueError('Function call not allowed in the expression')
+
+        name = node.func.id
+        function = next((x for x in expression_functions if x[0] == name),
+                        None)
+        if function is None:
+            raise ValueError('Function ' + name + ' not allowed in the '
+                                                  'expression')
+
+        if name == 'col':
+            if len(node.args) != 1:
+                raise ValueError('The function col requires a column name')
+            # The name must be a constant (not a parameter)
+            params = self.params
+            self.params = []
+            _, arg_type = self.visit(node.args[0])
+            arg = self.params[0] if self.params else None
+            self.params = params
+            if arg_type != 'string' or arg is None:
+                raise ValueError('The function col requires a column name')
+            return self.column(arg)
+
+        args = [self.visit(x) for x in node.args]
+        if not args or any([x[1] not in numeric_types for x in args]):
+            raise ValueError('The function ' + name + ' requires numbers')
+
+        if name == 'round':
+            if len(args) > 2 or (len(args) == 2 and args[1][1] != 'integer'):
+                raise ValueError('The function round requires a number and '
+                                 'the number of decimals')
+            return 'CAST(round(CAST({0} AS NUMERIC), {1}) ' \
+                   'AS DOUBLE PRECISION)'.format(
+                       args[0][0],
+                       args[1][0] if len(args) == 2 else '0'), 'double'
+
+        if name == 'abs' and len(args) != 1:
+            raise ValueError('The function abs requires one number')
+
+        return '{0}({1})'.format(function[1],
+                                 ', '.join([x[0] for x in args])), \
+            merge_numeric_types([x[1] for x in args])
+
+
+def compile_expression(text, column_types):
+    """
+    Translate an expression over the columns of a workflow to SQL.
+
+    :param text: String with the expression
+    :param column_types: Dictionary column name: data type
+    :return: Dictionary with keys sql (text with %s for the parameters),
+    params (list of values), data_type (type of the result) and column_names
+    (columns used in the expression). Raises ValueError with a message if
+    the expression is not correct.
+    """
+    compiler = ExpressionCompiler(column_types)
+    sql, data_type = compiler.compile(text)
+
+    return {'sql': sql,
+            'params': compiler.params,
+            'data_type': data_type,
+            'column_names': compiler.column_names}
+
+
+def column_reference(name):
+    """
+    Text to use a column in an expression: its name or col('name') if the
+    name is not a valid identifier.
+
+    :param name: Column name
+    :return: String
+    """
+    if identifier_re.match(name) and not keyword.iskeyword(name) and \
+            name not in ['True', 'False', 'None']:
+        return name
+
+    return 'col(\'{0}\')'.format(name.replace('\\', '\\\\').replace(
+        '\'', '\\\''))
+
+
+def rename_column(text, old_name, new_name):
+    """
+    Change the name of a column in an expression. The rest of the text is
+    kept as it is.
+
+    :param text: String with the expression
+    :param old_name: Current column name
+    :param new_name: New column name
+    :return: The expression with the new name
+    """
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (tokenize.TokenError, SyntaxError):
+        return text
+
+    # Offset of the beginning of each line to locate the tokens in the text
+    offsets = [0]
+    for line in text.splitlines(True):
+        offsets.append(offsets[-1] + len(line))
+
+    # Triplets (start, end, new text) with the changes
+    changes = []
+    for idx, token in enumerate(tokens):
+        if token[0] == tokenize.NAME and token[1] == old_name and \
+                (idx == 0 or tokens[idx - 1][1] != '.'):
+            start, end = token[2], token[3]
+        elif token[0] == tokenize.STRING and idx >= 2 and \
+                tokens[idx - 1][1] == '(' and tokens[idx - 2][1] == 'col' \
+                and tokens[idx + 1][1] == ')':
+            try:
+                value = ast.literal_eval(token[1])
+            except (ValueError, SyntaxError):
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            if value != old_name:
+                continue
+            # The whole call col('name') is replaced
+            start, end = tokens[idx - 2][2], tokens[idx + 1][3]
+        else:
+            continue
+
+        changes.append((offsets[start[0] - 1] + start[1],
+                        offsets[end[0] - 1] + end[1],
+                        column_reference(new_name)))
+
+    for start, end, new_text in reversed(changes):
+        text = text[:start] + new_text + text[end:]
+
+    return text
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to store the data of an uploaded file in the upload (staging)
+table of a workflow one chunk of rows at a time, so that the memory needed
+does not depend on the size of the file.
+"""
+from __future__ import unicode_literals, print_function
+
+import StringIO
+import datetime
+import json
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytz
+from django.conf import settings as ontask_settings
+from django.db import ProgrammingError, connection, transaction
+from openpyxl.utils.exceptions import InvalidFileException
+
+from dataops import settings, table_registry
+from dataops.models import UploadTable
+from dataops.pandas_db import (create_upload_table_name,
+                               drop_table,
+                               get_upload_table_pks,
+                               pandas_datatype_names,
+                               set_table_profile,
+                               sql_datatype_names)
+from dataops.type_inference import TypeInference
+
+# Number of sample values kept in the profile of each column
+profile_sample_size = 5
+
+# Number of hashes kept to estimate the number of distinct values (K minimum
+# values estimator)
+profile_kmv_size = 1024
+
+
+def read_csv_chunks(file_obj, skip_top, skip_bottom):
+    """
+    Read a CSV file by chunks of UPLOAD_CHUNK_SIZE rows.
+
+    :param file_obj: File object to read
+    :param skip_top: Number of lines to skip at the top of the file
+    :param skip_bottom: Number of lines to skip at the bottom of the file
+    :return: Iterator over data frames
+    """
+    chunks = pd.read_csv(file_obj,
+                         index_col=False,
+                         quotechar='"',
+                         skiprows=skip_top,
+                         chunksize=settings.UPLOAD_CHUNK_SIZE)
+
+    if not skip_bottom:
+        return chunks
+
+    return drop_last_rows(chunks, skip_bottom)
+
+
+def read_excel_chunks(file_obj, sheet, skip_top, skip_bottom):
+    """
+    Read a sheet of an Excel file by chunks of UPLOAD_CHUNK_SIZE rows. The
+    xlsx files are read with openpyxl in read only mode (the rows are read
+    from the file as they are needed, and the other sheets are not loaded).
+    The files in the old xls format are read with pandas.
+
+    :param file_obj: File object to read
+    :param sheet: Name of the sheet to read
+    :param skip_top: Number of rows to skip at the top of the sheet
+    :param skip_bottom: Number of rows to skip at the bottom of the sheet
+    :return: Iterator over data frames
+    """
+    try:
+        workbook = openpyxl.load_workbook(file_obj,
+                                          read_only=True,
+                                          data_only=True)
+    except (InvalidFileException, zipfile.BadZipfile):
+        # Not an xlsx file
+        file_obj.seek(0)
+        return iter([pd.read_excel(file_obj,
+                                   sheetname=sheet,
+                                   skiprows=skip_top,
+                                   skip_footer=skip_bottom)])
+
+    if sheet not in workbook.sheetnames:
+        raise Exception('Sheet ' + sheet + ' not found in the file')
+
+    chunks = read_sheet_chunks(workbook[sheet], skip_top)
+    if not skip_bottom:
+        return chunks
+
+    return drop_last_rows(chunks, skip_bottom)
+
+
+def read_sheet_chunks(worksheet, skip_top):
+    """
+    Read the rows of a worksheet into column buffers and produce a data
+    frame every UPLOAD_CHUNK_SIZE rows. The first row (after skipping
+    skip_top rows) contains the column names. Empty rows are ignored.
+
+    :param worksheet: openpyxl read only worksheet
+    :param skip_top: Number of rows to skip at the top
+    :return: Iterator over data frames
+    """
+    column_names = None
+    buffers = None
+    for idx, row in enumerate(worksheet.iter_rows()):
+        if idx < skip_top:
+            continue
+
+        values = [cell.value for cell in row]
+        if all([x is None for x in values]):
+            continue
+
+        if column_names is None:
+            column_names = dedup_column_names([
+                'Unnamed: {0}'.format(cidx) if x is None else
+                '{0}'.format(x).strip()
+                for cidx, x in enumerate(values)])
+            buffers = [[] for _ in column_names]
+            continue
+
+        # Rows may be shorter or longer than the header
+        values = (values + [None] * len(column_names))[:len(column_names)]
+        for buf, value in zip(buffers, values):
+            buf.append(value)
+
+        if len(buffers[0]) == settings.UPLOAD_CHUNK_SIZE:
+            yield buffers_to_data_frame(column_names, buffers)
+            buffers = [[] for _ in column_names]
+
+    if column_names is None:
+        # Empty sheet
+        return
+
+    if buffers[0]:
+        yield buffers_to_data_frame(column_names, buffers)
+
+
+def dedup_column_names(column_names):
+    """
+    Rename the repeated column names as pd.read_csv does: the second
+    occurrence of a is renamed a.1, the third a.2, etc.
+
+    :param column_names: List of column names
+    :return: List of column names without repetitions
+    """
+    counts = {}
+    result = []
+    for cname in column_names:
+        count = counts.get(cname, 0)
+        result.append('{0}.{1}'.format(cname, count) if count else cname)
+        counts[cname] = count + 1
+
+    return result
+
+
+def buffers_to_data_frame(column_names, buffers):
+    """
+    Create a data frame with the values in the column buffers. The type of
+    each column is inferred by pandas (empty cells are NaN/NaT).
+
+    :param column_names: List of column names
+    :param buffers: List of lists with the values of each column
+    :return: Pandas data frame
+    """
+    columns = OrderedDict()
+    for cname, buf in zip(column_names, buffers):
+        if all([x is None for x in buf]):
+            columns[cname] = pd.Series(buf, dtype=float)
+        else:
+            columns[cname] = pd.Series(buf)
+
+    return pd.DataFrame(columns)
+
+
+def drop_last_rows(chunks, nrows):
+    """
+    Drop the last rows of a sequence of data frames (pandas does not support
+    skipfooter when reading by chunks). The last nrows rows are kept in
+    memory until the following chunk arrives.
+
+    :param chunks: Iterator over data frames
+    :param nrows: Number of rows to drop at the end
+    :return: Iterator over data frames
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        carry = chunk.iloc[-nrows:]
+        chunk = chunk.iloc[:-nrows]
+        if not chunk.empty:
+            yield chunk
+
+
+def merge_data_types(current, new):
+    """
+    Data type able to store the values of two chunks of a column
+
+    :param current: Data type of the column so far
+    :param new: Data type of the new chunk
+    :return: Resulting data type
+    """
+    if current == new:
+        return current
+
+    if set([current, new]) == set(['integer', 'double']):
+        return 'double'
+
+    return 'string'
+
+
+class StagingTableWriter(object):
+    """
+    Store a sequence of data frames (chunks of the same file) in the upload
+    table of a workflow. The column types are obtained from the first chunk
+    and verified with each new chunk (widening the column in the table if
+    needed), the uniqueness of each column is tracked with 64-bit hashes of
+    its values, and the rows are sent to the database with COPY.
+    """
+
+    def __init__(self, pk):
+        self.table_name = create_upload_table_name(pk)
+        self.column_names = None
+        self.column_types = None
+        self.nrows = 0
+        # Hashes of the values seen in each column (None when a repeated
+        # value has been found)
+        self.hashes = None
+        # Profile of the columns: number of empty values, smallest hashes
+        # of the non empty values (to estimate the number of distinct
+        # values) and some sample values
+        self.nulls = None
+        self.min_hashes = None
+        self.samples = None
+        # Detection of the datetime columns
+        self.inference = TypeInference()
+
+    def write(self, data_frame):
+        """
+        Verify the types of a chunk and append its rows to the table
+
+        :param data_frame: Data frame with the next chunk of rows
+        :return: Nothing. The rows are stored in the table
+        """
+        data_frame = self.clean_chunk(data_frame)
+
+        if self.column_names is None:
+            self.create_table(data_frame)
+        elif list(data_frame.columns) != self.column_names:
+            raise Exception('Inconsistent column names in the file')
+        else:
+            data_frame = self.verify_types(data_frame)
+
+        self.update_profile(data_frame)
+        self.copy_rows(data_frame)
+        self.nrows += data_frame.shape[0]
+
+    def clean_chunk(self, data_frame):
+        """
+        Strip the white space from the string columns and convert the
+        datetime columns (detected with a sample of the first chunk, and
+        with the same format in the following ones)
+
+        :param data_frame: Data frame with a chunk of rows
+        :return: Data frame with the same rows
+        """
+        if self.column_names is None:
+            return self.inference.detect(data_frame)
+
+        return self.inference.convert(data_frame)
+
+    def create_table(self, data_frame):
+        """
+        Create the table with the columns and types of the first chunk
+        (replacing any previous upload table)
+
+        :param data_frame: First chunk of rows
+        :return: Nothing
+        """
+        self.column_names = list(data_frame.columns)
+        self.column_types = [pandas_datatype_names[data_frame[x].dtype.name]
+                             for x in self.column_names]
+        self.hashes = [np.array([], dtype=np.uint64)
+                       for _ in self.column_names]
+        self.nulls = [0] * len(self.column_names)
+        self.min_hashes = [np.array([], dtype=np.uint64)
+                           for _ in self.column_names]
+        self.samples = [
+            json.loads(data_frame[x].dropna().drop_duplicates().head(
+                profile_sample_size
+            ).to_json(orient='values', date_format='iso'))
+            for x in self.column_names]
+
+        cursor = connection.cursor()
+        cursor.execute('DROP TABLE IF EXISTS "{0}"'.format(self.table_name))
+        # The table is not written to the WAL (it is temporary and can be
+        # uploaded again if lost)
+        cursor.execute('CREATE UNLOGGED TABLE "{0}" ({1})'.format(
+            self.table_name,
+            ', '.join(['"{0}" {1}'.format(x, sql_datatype_names[y])
+                       for x, y in zip(self.column_names,
+                                       self.column_types)])
+        ))
+        table_registry.table_changed(self.table_name)
+
+    def verify_types(self, data_frame):
+        """
+        Check that the values in the chunk are compatible with the types of
+        the columns in the table (datetime columns were converted in
+        clean_chunk). The columns in the table are altered when the chunk
+        requires a wider type (integer to double, or anything to string).
+
+        :param data_frame: Chunk of rows
+        :return: Data frame with the converted columns
+        """
+        for idx, cname in enumerate(self.column_names):
+            current = self.column_types[idx]
+            column = data_frame[cname]
+
+            # A chunk with only empty values is compatible with any type
+            if column.isnull().all():
+                continue
+
+            new_type = merge_data_types(
+                current,
+                pandas_datatype_names[data_frame[cname].dtype.name])
+            if new_type != current:
+                self.alter_column(idx, new_type)
+
+            if new_type == 'string' and \
+                    data_frame[cname].dtype.name != 'object':
+                data_frame[cname] = \
+                    data_frame[cname].astype(str).where(column.notnull())
+
+        return data_frame
+
+    def alter_column(self, idx, new_type):
+        """
+        Change the type of a column in the table
+
+        :param idx: Index of the column
+        :param new_type: New data type
+        :return: Nothing
+        """
+        cname = self.column_names[idx]
+        cursor = connection.cursor()
+        cursor.execute(
+            'ALTER TABLE "{0}" ALTER COLUMN "{1}" TYPE {2} '
+            'USING "{1}"::{2}'.format(self.table_name,
+                                      cname,
+                                      sql_datatype_names[new_type])
+        )
+        table_registry.table_changed(self.table_name)
+        self.column_types[idx] = new_type
+
+    def update_profile(self, data_frame):
+        """
+        Update the profile of the columns with the values in the chunk:
+        the hashes of the values are added to those seen for each column
+        (discarding the columns with repeated values), the empty values are
+        counted, and the smallest hashes are kept to estimate the number of
+        distinct values.
+
+        :param data_frame: Chunk of rows
+        :return: Nothing
+        """
+        for idx, cname in enumerate(self.column_names):
+            column = data_frame[cname]
+            not_null = column.notnull().values
+            self.nulls[idx] += int(len(column) - not_null.sum())
+
+            hashes = pd.util.hash_pandas_object(column, index=False).values
+
+            # K minimum values of the hashes of the non empty values
+            self.min_hashes[idx] = np.union1d(
+                self.min_hashes[idx],
+                hashes[not_null])[:profile_kmv_size]
+
+            seen = self.hashes[idx]
+            if seen is None:
+                # Column already has repeated values
+                continue
+
+            new = np.sort(hashes)
+            # Repeated values within the chunk or with the previous ones
+            if (new[1:] == new[:-1]).any() or \
+                    np.in1d(new, seen, assume_unique=True).any():
+                self.hashes[idx] = None
+                continue
+
+            self.hashes[idx] = np.concatenate((seen, new))
+
+    def distinct_estimate(self, idx):
+        """
+        Estimate the number of distinct non empty values in a column from
+        the K smallest hashes (exact if there are less than K values)
+
+        :param idx: Index of the column
+        :return: Integer
+        """
+        min_hashes = self.min_hashes[idx]
+        if len(min_hashes) < profile_kmv_size:
+            return len(min_hashes)
+
+        return int(round((profile_kmv_size - 1) /
+                         (float(min_hashes[-1]) / 2 ** 64)))
+
+    def profile(self):
+        """
+        :return: Dictionary with the number of rows and, for each column,
+        its name, type, uniqueness, number of empty values, estimated number
+        of distinct values and sample values.
+        """
+        columns = []
+        for idx, cname in enumerate(self.column_names):
+            is_unique = self.hashes[idx] is not None
+            columns.append({
+                'name': cname,
+                'type': self.column_types[idx],
+                'is_unique': is_unique,
+                'nulls': self.nulls[idx],
+                'distinct': self.nrows if is_unique
+                else self.distinct_estimate(idx),
+                'samples': self.samples[idx]
+            })
+
+        return {'nrows': self.nrows, 'columns': columns}
+
+    def copy_rows(self, data_frame):
+        """
+        Send the rows of the chunk to the table using COPY
+
+        :param data_frame: Chunk of rows
+        :return: Nothing
+        """
+        buf = StringIO.StringIO()
+        data_frame.to_csv(buf, header=False, index=False, encoding='utf-8')
+        buf.seek(0)
+
+        cursor = connection.cursor()
+        cursor.copy_expert(
+            'COPY "{0}" ({1}) FROM STDIN WITH (FORMAT csv)'.format(
+                self.table_name,
+                ', '.join(['"{0}"'.format(x) for x in self.column_names])),
+            buf
+        )
+
+    def column_info(self):
+        """
+        :return: List with three lists: column names, column types and
+        booleans stating if the column has unique values.
+        """
+        return [self.column_names,
+                self.column_types,
+                [x is not None for x in self.hashes]]
+
+
+def store_upload_chunks(chunks, pk):
+    """
+    Store a sequence of data frames (chunks of an uploaded file) in the
+    upload table of the workflow. Either all the rows are stored or the
+    table is not modified.
+
+    :param chunks: Iterator over data frames with the same columns
+    :param pk: Primary key of the workflow
+    :return: List with three lists: column names, column types and booleans
+    stating if the column has unique values. The complete profile of the
+    columns is stored as the comment of the table (see get_upload_profile)
+    """
+    writer = StagingTableWriter(pk)
+    with transaction.atomic():
+        for chunk in chunks:
+            writer.write(chunk)
+
+        if writer.column_names is None:
+            raise Exception('The file has no data')
+
+        # Keep the profile with the table
+        set_table_profile(writer.table_name, writer.profile())
+
+        # Register the table so that it is removed if the upload is abandoned
+        UploadTable.objects.update_or_create(
+            workflow_id=pk,
+            defaults={'created': datetime.datetime.now(
+                pytz.timezone(ontask_settings.TIME_ZONE)
+            )}
+        )
+
+    return writer.column_info()
+
+
+def drop_stale_upload_tables(before):
+    """
+    Drop the upload tables of the abandoned uploads: those created before
+    the given time and those that are not in the registry. The registry
+    entries of the tables that no longer exist are removed as well.
+
+    :param before: Datetime. Upload tables created before are dropped.
+    :return: List of primary keys of the workflows whose table was dropped
+    """
+    pks = get_upload_table_pks()
+
+    dropped = []
+    for pk in pks:
+        table_name = create_upload_table_name(pk)
+        with transaction.atomic():
+            # An upload in progress holds an exclusive lock on its table
+            # (created in its transaction) until it commits and registers
+            # the table, so the table is locked first and only then the
+            # registry is read (in the same order as in store_upload_chunks)
+            try:
+                with transaction.atomic():
+                    connection.cursor().execute(
+                        'LOCK TABLE "{0}" IN ACCESS EXCLUSIVE MODE'.format(
+                            table_name
+                        )
+                    )
+            except ProgrammingError:
+                # The table was removed in the meantime
+                continue
+
+            entry = UploadTable.objects.select_for_update().filter(
+                workflow_id=pk
+            ).first()
+            if entry is not None and entry.created >= before:
+                continue
+
+            drop_table(table_name)
+            if entry is not None:
+                entry.delete()
+
+        dropped.append(pk)
+
+    # Old entries of the tables removed at the end of the upload
+    UploadTable.objects.filter(created__lt=before).exclude(
+        workflow_id__in=pks
+    ).delete()
+
+    return dropped
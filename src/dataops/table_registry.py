@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the tables in the DB storing the data of the workflows and of
+their uploads, with the name and type of their columns. The catalog of the
+DB is read only the first time a table is used in a process, and the result
+is kept in memory. The operations creating, dropping or altering a table
+call table_changed, which removes the table from the registry of this
+process and changes the version of the table in the shared cache, so the
+rest of the processes read the catalog again the next time they use it.
+"""
+from __future__ import unicode_literals, print_function
+
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+# Key in the cache with the version of all the tables (changed when the
+# tables are modified outside of pandas_db, for example with pg_restore)
+all_tables_key = 'ontask_table_registry'
+
+# Prefix of the keys in the cache with the version of each table
+table_key_prefix = 'ontask_table_registry_'
+
+# Tables in the registry of this process: table name: (version, columns)
+_tables = {}
+
+
+def new_version(key):
+    """
+    Store a new version in the cache
+    :param key: Key in the cache
+    :return: The new version
+    """
+    version = uuid.uuid4().hex
+    cache.set(key, version, None)
+    return version
+
+
+def get_version(table_name):
+    """
+    Version of a table in the shared cache (created if it is not there, for
+    example because the cache was cleared).
+    :param table_name: Table name
+    :return: Pair of strings
+    """
+    table_key = table_key_prefix + table_name
+    versions = cache.get_many([all_tables_key, table_key])
+
+    return (versions.get(all_tables_key) or new_version(all_tables_key),
+            versions.get(table_key) or new_version(table_key))
+
+
+def read_table_columns(table_name):
+    """
+    Columns of a table in the catalog of the DB
+    :param table_name: Table name
+    :return: OrderedDict column name: SQL data type (as in
+    information_schema), empty if the table does not exist
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT column_name, data_type FROM information_schema.columns '
+        'WHERE table_schema = current_schema() AND table_name = %s '
+        'ORDER BY ordinal_position', [table_name])
+
+    return OrderedDict(cursor.fetchall())
+
+
+def get_table_columns(table_name):
+    """
+    Columns of a table (from the registry if it is up to date)
+    :param table_name: Table name
+    :return: OrderedDict column name: SQL data type (as in
+    information_schema), empty if the table does not exist. It must not be
+    modified.
+    """
+    version = get_version(table_name)
+    entry = _tables.get(table_name)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    columns = read_table_columns(table_name)
+
+    # What is read inside a transaction is not kept, as it could include
+    # changes that are later rolled back
+    if not connection.in_atomic_block:
+        _tables[table_name] = (version, columns)
+
+    return columns
+
+
+def table_exists(table_name):
+    """
+    :param table_name: Table name
+    :return: Boolean stating if the table is in the DB
+    """
+    return bool(get_table_columns(table_name))
+
+
+def table_changed(table_name):
+    """
+    Notify that a table was created, dropped or altered. If this happens in
+    a transaction, the other processes are notified again when it is
+    committed (before that they still see the previous table).
+    :param table_name: Table name
+    :return: Nothing
+    """
+    _tables.pop(table_name, None)
+    new_version(table_key_prefix + table_name)
+
+    if connection.in_atomic_block:
+        transaction.on_commit(
+            lambda: new_version(table_key_prefix + table_name)
+        )
+
+
+def all_tables_changed():
+    """
+    Notify that any table may have changed (the registry is emptied in all
+    the processes)
+    :return: Nothing
+    """
+    _tables.clear()
+    new_version(all_tables_key)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import mock
+import pandas as pd
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+
+import test
+from dataops import pandas_db, staging, table_registry
+from dataops.models import UploadTable
+from workflow.models import Workflow
+
+
+class DataopsTableBase(test.OntaskTransactionTestCase):
+    fixtures = ['simple_table']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'table',
+        'fixtures',
+        'simple_table_df.sql'
+    )
+
+    def setUp(self):
+        super(DataopsTableBase, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+        self.workflow = Workflow.objects.get(name='wflow1')
+        self.table_name = pandas_db.create_table_name(self.workflow.id)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsTableBase, self).tearDown()
+
+    def wait_for_lock(self, thread):
+        """
+        Wait until the thread is blocked waiting for a lock in the DB (or it
+        finishes)
+        :param thread: Thread executing a query
+        :return: Nothing
+        """
+        cursor = connection.cursor()
+        for _ in range(600):
+            cursor.execute('SELECT count(*) FROM pg_locks WHERE NOT granted')
+            if cursor.fetchone()[0] or not thread.is_alive():
+                return
+            time.sleep(0.05)
+
+
+class StoreTable(DataopsTableBase):
+    new_df = pd.DataFrame({'sid': [4, 5],
+                           'email': ['student4@bogus.com',
+                                     'student5@bogus.com']})
+
+    def test_store_table(self):
+        pandas_db.store_table(self.new_df, self.table_name, ['sid'])
+
+        df = pandas_db.load_table(self.table_name)
+        self.assertEqual(set(df.columns), set(['sid', 'email']))
+        self.assertEqual(sorted(df['sid']), [4, 5])
+        self.assertFalse(pandas_db.is_table_in_db(
+            pandas_db.create_shadow_table_name(self.table_name)
+        ))
+
+    def test_store_table_failed_swap(self):
+        old_df = pandas_db.load_table(self.table_name)
+
+        # The swap fails after the old table is dropped
+        with mock.patch('dataops.table_registry.table_changed',
+                        side_effect=Exception('Swap interrupted')):
+            self.assertRaises(Exception,
+                              pandas_db.store_table,
+                              self.new_df,
+                              self.table_name,
+                              ['sid'])
+
+        df = pandas_db.load_table(self.table_name)
+        self.assertEqual(list(df.columns), list(old_df.columns))
+        self.assertEqual(sorted(df['sid']), sorted(old_df['sid']))
+
+    def test_store_table_concurrent_read(self):
+        result = {}
+        readers = []
+        table_changed = table_registry.table_changed
+
+        def read_table():
+            try:
+                cursor = connection.cursor()
+                cursor.execute(
+                    'SELECT count(*) FROM "{0}"'.format(self.table_name)
+                )
+                result['nrows'] = cursor.fetchone()[0]
+            except Exception as e:
+                result['error'] = e
+            finally:
+                connection.close()
+
+        def swapped(table_name):
+            # Read the table from another connection before the swap is
+            # committed
+            reader = threading.Thread(target=read_table)
+            reader.start()
+            readers.append(reader)
+            self.wait_for_lock(reader)
+            table_changed(table_name)
+
+        with mock.patch('dataops.table_registry.table_changed',
+                        side_effect=swapped):
+            pandas_db.store_table(self.new_df, self.table_name, ['sid'])
+
+        for reader in readers:
+            reader.join()
+
+        # The reader waited for the swap and found the new table
+        self.assertEqual(len(readers), 1)
+        self.assertNotIn('error', result)
+        self.assertEqual(result['nrows'], 2)
+
+
+class DropStaleUploadTables(DataopsTableBase):
+    upload_df = pd.DataFrame({'sid': [1, 2],
+                              'email': ['student1@bogus.com',
+                                        'student2@bogus.com']})
+
+    def setUp(self):
+        super(DropStaleUploadTables, self).setUp()
+        self.upload_table = pandas_db.create_upload_table_name(
+            self.workflow.id
+        )
+        self.now = datetime.datetime.now(pytz.timezone(settings.TIME_ZONE))
+
+        # Upload abandoned one day ago
+        staging.store_upload_chunks(iter([self.upload_df]), self.workflow.id)
+        UploadTable.objects.filter(workflow=self.workflow).update(
+            created=self.now - datetime.timedelta(days=1)
+        )
+
+    def test_drop_stale_table(self):
+        self.assertEqual(staging.drop_stale_upload_tables(self.now),
+                         [self.workflow.id])
+        self.assertFalse(pandas_db.is_table_in_db(self.upload_table))
+        self.assertFalse(UploadTable.objects.exists())
+
+    def test_cleanup_during_upload(self):
+        written = threading.Event()
+        release = threading.Event()
+        result = {}
+
+        def chunks():
+            yield self.upload_df
+            # The table is replaced, but the upload is not committed
+            written.set()
+            release.wait(30)
+
+        def upload():
+            try:
+                staging.store_upload_chunks(chunks(), self.workflow.id)
+            finally:
+                connection.close()
+
+        def cleanup():
+            try:
+                result['dropped'] = staging.drop_stale_upload_tables(before)
+            finally:
+                connection.close()
+
+        uploader = threading.Thread(target=upload)
+        uploader.start()
+        try:
+            self.assertTrue(written.wait(30))
+            before = datetime.datetime.now(
+                pytz.timezone(settings.TIME_ZONE)
+            )
+
+            cleaner = threading.Thread(target=cleanup)
+            cleaner.start()
+            self.wait_for_lock(cleaner)
+
+            # The cleanup waits for the upload to finish
+            self.assertTrue(cleaner.is_alive())
+        finally:
+            release.set()
+            uploader.join()
+
+        cleaner.join()
+
+        # The new upload table is kept
+        self.assertEqual(result['dropped'], [])
+        self.assertTrue(pandas_db.is_table_in_db(self.upload_table))
+        self.assertTrue(UploadTable.objects.filter(
+            workflow=self.workflow,
+            created__gte=before
+        ).exists())
+
+
+class TableRegistry(DataopsTableBase):
+
+    def test_rename_column(self):
+        old_columns = OrderedDict(
+            table_registry.get_table_columns(self.table_name)
+        )
+        self.assertIn('sid', old_columns)
+
+        with transaction.atomic():
+            pandas_db.rename_column_in_db(self.workflow.id, 'sid', 'sid2')
+
+            # Another process reads the table before the commit (it still
+            # finds the old column) with the version current at that time
+            table_registry._tables[self.table_name] = (
+                table_registry.get_version(self.table_name),
+                old_columns
+            )
+
+        columns = table_registry.get_table_columns(self.table_name)
+        self.assertIn('sid2', columns)
+        self.assertNotIn('sid', columns)
+        self.assertEqual(len(columns), len(old_columns))
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import pandas as pd
 from django.test import TestCase
 
-from dataops import formula_evaluation
+from dataops import (formula_evaluation,
+                     ops,
+                     pandas_db,
+                     sql_expression,
+                     staging,
+                     type_inference)
 
 
 class HasVariableTest(TestCase):
@@ -63,3 +69,194 @@ class HasVariableTest(TestCase):
                 self.formula1, {'UOS_Code_a': 'df', 'ANOTHER': 'v2'}
             )
         )
+
+
+class StagingTest(TestCase):
+
+    def test_drop_last_rows(self):
+
+        chunks = [pd.DataFrame({'a': range(x, x + 3)}) for x in [0, 3, 6]]
+
+        result = pd.concat(list(staging.drop_last_rows(iter(chunks), 4)))
+
+        self.assertEqual(list(result['a']), [0, 1, 2, 3, 4])
+
+    def test_buffers_to_data_frame(self):
+
+        df = staging.buffers_to_data_frame(
+            ['a', 'b', 'c'],
+            [[1, 2, None], ['x', None, 'z'], [None, None, None]])
+
+        self.assertEqual(list(df.columns), ['a', 'b', 'c'])
+        self.assertEqual(df['a'].dtype.name, 'float64')
+        self.assertEqual(df['b'].dtype.name, 'object')
+        self.assertEqual(df['c'].dtype.name, 'float64')
+
+    def test_dedup_column_names(self):
+
+        self.assertEqual(
+            staging.dedup_column_names(['a', 'b', 'a', 'a', 'c']),
+            ['a', 'b', 'a.1', 'a.2', 'c'])
+
+    def test_merge_data_types(self):
+
+        self.assertEqual(staging.merge_data_types('integer', 'integer'),
+                         'integer')
+        self.assertEqual(staging.merge_data_types('integer', 'double'),
+                         'double')
+        self.assertEqual(staging.merge_data_types('datetime', 'integer'),
+                         'string')
+
+
+class UploadMergeTest(TestCase):
+
+    merge_info = {
+        'initial_column_names': ['sid', 'email', 'Score'],
+        'rename_column_names': ['sid', 'email', 'Score'],
+        'autorename_column_names': ['sid', 'email', 'Score_1'],
+        'column_types': ['integer', 'string', 'double'],
+        'src_is_key_column': [True, True, False],
+        'columns_to_upload': [True, False, True]
+    }
+
+    def test_get_upload_columns(self):
+
+        self.assertEqual(ops.get_upload_columns(self.merge_info),
+                         [('sid', 'sid', 'integer', True),
+                          ('Score', 'Score_1', 'double', False)])
+
+    def test_select_expression(self):
+
+        self.assertEqual(pandas_db.select_expression([('src', 'a%')]),
+                         'src."a%%"')
+        self.assertEqual(
+            pandas_db.select_expression([('dst', 'sid'), ('src', 'sid')]),
+            'COALESCE(dst."sid", src."sid")')
+
+    def test_merge_from_clause(self):
+
+        self.assertEqual(
+            pandas_db.merge_from_clause(3, 'sid', 'id', 'outer'),
+            'FROM "__ONTASK_WORKFLOW_TABLE_3" AS dst FULL OUTER JOIN '
+            '"__ONTASK_WORKFLOW_TABLE_UPLOAD_3" AS src '
+            'ON dst."sid" = src."id"')
+
+
+class ColumnOperationsTest(TestCase):
+
+    def test_formula_column_expression(self):
+
+        self.assertEqual(
+            pandas_db.formula_column_expression('sum', ['a', 'b%']),
+            'COALESCE("a", 0) + COALESCE("b%%", 0)')
+        self.assertEqual(
+            pandas_db.formula_column_expression('max', ['a', 'b']),
+            'GREATEST("a", "b")')
+        self.assertEqual(
+            pandas_db.formula_column_expression('mean', ['a', 'b']),
+            '(SELECT avg(v) FROM '
+            'unnest(ARRAY["a", "b"]::DOUBLE PRECISION[]) AS v)')
+        self.assertRaises(Exception,
+                          pandas_db.formula_column_expression,
+                          'cumsum',
+                          ['a'])
+
+
+class SQLExpressionTest(TestCase):
+
+    column_types = {'Quiz': 'integer',
+                    'Exam': 'double',
+                    'Passed': 'boolean',
+                    'Final mark': 'double'}
+
+    def test_arithmetic(self):
+
+        result = sql_expression.compile_expression('0.4 * Quiz + 0.6 * Exam',
+                                                   self.column_types)
+
+        self.assertEqual(result['sql'],
+                         '((CAST(%s AS DOUBLE PRECISION) * "Quiz") + '
+                         '(CAST(%s AS DOUBLE PRECISION) * "Exam"))')
+        self.assertEqual(result['params'], [0.4, 0.6])
+        self.assertEqual(result['data_type'], 'double')
+        self.assertEqual(result['column_names'], ['Quiz', 'Exam'])
+
+    def test_conditional(self):
+
+        result = sql_expression.compile_expression(
+            'col("Final mark") if Passed and 0 < Quiz < 10 else 0',
+            self.column_types)
+
+        self.assertEqual(result['sql'],
+                         'CASE WHEN ("Passed" AND ((%s < "Quiz") AND '
+                         '("Quiz" < %s))) THEN "Final mark" ELSE %s END')
+        self.assertEqual(result['params'], [0, 10, 0])
+        self.assertEqual(result['data_type'], 'double')
+
+    def test_incorrect(self):
+
+        for text in ['Quiz +', 'Quiz + Passed', 'Unknown * 2',
+                     '__import__("os")', 'Quiz.real', 'Exam % 2']:
+            self.assertRaises(ValueError,
+                              sql_expression.compile_expression,
+                              text,
+                              self.column_types)
+
+    def test_rename_column(self):
+
+        self.assertEqual(
+            sql_expression.rename_column('0.4 * Quiz + col("Quiz") > 2',
+                                         'Quiz',
+                                         'First quiz'),
+            '0.4 * col(\'First quiz\') + col(\'First quiz\') > 2')
+
+        self.assertEqual(
+            sql_expression.rename_column('col("Final mark") * Quizzes',
+                                         'Final mark',
+                                         'Mark'),
+            'Mark * Quizzes')
+
+
+class TypeInferenceTest(TestCase):
+
+    def test_stratified_sample(self):
+
+        sample = type_inference.stratified_sample(pd.Series(range(100)), 5)
+
+        self.assertEqual(list(sample), [0, 24, 49, 74, 99])
+
+    def test_detect_datetime_format(self):
+
+        fmt, matches = type_inference.detect_datetime_format(
+            pd.Series(['2017-10-12 09:30:00', '2017-10-13 10:00:00']))
+        self.assertEqual(fmt, '%Y-%m-%d %H:%M:%S')
+        self.assertEqual(matches, 2)
+
+        fmt, matches = type_inference.detect_datetime_format(
+            pd.Series(['Good work', 'Needs to improve the structure']))
+        self.assertEqual(matches, 0)
+
+    def test_detect_datetime_columns(self):
+
+        df = pd.DataFrame({'date': [' 12/10/2017', '31/10/2017 '],
+                           'text': ['one', 'two'],
+                           'number': [1, 2]})
+
+        df, report = type_inference.detect_datetime_columns(df)
+
+        self.assertEqual(df['date'].dtype.name, 'datetime64[ns]')
+        self.assertEqual(report['date']['format'], '%d/%m/%Y')
+        self.assertEqual(report['text']['type'], 'string')
+        self.assertEqual(report['number']['type'], 'integer')
+
+    def test_detect_datetime_columns_failed(self):
+
+        # The sample (first and last values) has dates, but not the rest
+        inference = type_inference.TypeInference(sample_size=2)
+        df = inference.detect(pd.DataFrame(
+            {'date': ['12/10/2017', '13/10/2017', 'soon', '31/10/2017']}))
+
+        self.assertEqual(df['date'].dtype.name, 'object')
+        self.assertEqual(inference.report['date']['type'], 'string')
+        self.assertEqual(inference.report['date']['failed'], 1)
+        self.assertEqual(inference.report['date']['confidence'], 0.75)
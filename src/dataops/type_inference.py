@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Detection of the datetime columns in the data frames received in the
+uploads and the API. The string columns are probed with a sample of their
+values, the format detected is cached per column, and then it is applied to
+the whole column with an explicit format.
+"""
+from __future__ import unicode_literals, print_function
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dataops import settings
+from dataops.pandas_db import pandas_datatype_names
+
+# Formats tried (in this order) with the values in the sample
+datetime_formats = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%Y-%m-%dT%H:%M:%S.%fZ',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%Y/%m/%d %H:%M:%S',
+    '%Y/%m/%d',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y',
+    '%d-%m-%Y %H:%M:%S',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d %b %Y',
+    '%d %B %Y',
+    '%b %d, %Y',
+    '%B %d, %Y',
+]
+
+# Values longer than this are not considered datetimes
+max_datetime_length = 40
+
+
+def stratified_sample(series, size):
+    """
+    Select a sample of the non empty values of a column: the column is
+    divided in size consecutive blocks of the same length and one value is
+    taken from each of them, so that the sample covers the beginning, middle
+    and end of the data.
+
+    :param series: Pandas series
+    :param size: Maximum number of values in the sample
+    :return: Pandas series with the sample
+    """
+    values = series.dropna()
+    if len(values) <= size:
+        return values
+
+    return values.iloc[np.linspace(0, len(values) - 1, size).astype(int)]
+
+
+def may_be_datetime(sample):
+    """
+    Quick check to discard the columns with free text: all the values must
+    be short and contain at least one digit.
+
+    :param sample: Pandas series with strings
+    :return: Boolean
+    """
+    lengths = sample.str.len()
+    if lengths.isnull().any() or (lengths > max_datetime_length).any():
+        # Values that are not strings or too long
+        return False
+
+    return bool(sample.str.contains(r'\d').all())
+
+
+def detect_datetime_format(sample):
+    """
+    Find the datetime format of the values in the sample.
+
+    :param sample: Pandas series with strings (no empty values)
+    :return: Pair (format, number of values in the sample that match). The
+    format is None when the values are parsed without an explicit format, and
+    the pair is (None, 0) if the values are not datetimes.
+    """
+    if sample.empty or not may_be_datetime(sample):
+        return None, 0
+
+    for fmt in datetime_formats:
+        parsed = pd.to_datetime(sample, format=fmt, errors='coerce')
+        if parsed.notnull().all():
+            return fmt, len(sample)
+
+    # Last resort, let pandas parse the values (only the sample)
+    try:
+        pd.to_datetime(sample, infer_datetime_format=True)
+    except (ValueError, TypeError, OverflowError):
+        return None, 0
+
+    return None, len(sample)
+
+
+class TypeInference(object):
+    """
+    Detect and convert the datetime columns of a sequence of data frames
+    with the same columns (for example, the chunks of a file). The formats
+    are detected with a sample of the first data frame and are used to
+    convert the following ones. The attribute report contains, for each
+    column, a dictionary with:
+
+    - type: OnTask data type of the column
+    - format: datetime format detected (None if not explicit)
+    - sample_size: number of values probed
+    - sample_matches: number of values in the sample that are datetimes
+    - confidence: fraction of the sample consistent with the type
+    - failed: number of values that could not be converted
+    """
+
+    def __init__(self, sample_size=None):
+        self.sample_size = sample_size or \
+            settings.TYPE_INFERENCE_SAMPLE_SIZE
+        # Datetime format for each column detected as datetime
+        self.formats = {}
+        self.report = OrderedDict()
+
+    def detect(self, data_frame):
+        """
+        Strip the white space of the string columns, detect the datetime
+        columns in a sample and convert them.
+
+        :param data_frame: Pandas data frame
+        :return: The data frame with the datetime columns converted
+        """
+        for cname in list(data_frame.columns):
+            column = data_frame[cname]
+            if column.dtype.name != 'object':
+                self.report[cname] = {
+                    'type': pandas_datatype_names.get(column.dtype.name,
+                                                      column.dtype.name),
+                    'format': None,
+                    'sample_size': 0,
+                    'sample_matches': 0,
+                    'confidence': 1.0,
+                    'failed': 0
+                }
+                continue
+
+            # Column is a string!
+            column = column.str.strip()
+            data_frame[cname] = column
+
+            sample = stratified_sample(column, self.sample_size)
+            fmt, matches = detect_datetime_format(sample)
+            self.report[cname] = {
+                'type': 'string',
+                'format': fmt,
+                'sample_size': len(sample),
+                'sample_matches': matches,
+                'confidence': 1.0,
+                'failed': 0
+            }
+
+            if not matches:
+                continue
+
+            self.formats[cname] = fmt
+            self.convert_column(data_frame, cname)
+
+        return data_frame
+
+    def convert(self, data_frame):
+        """
+        Strip the white space of the string columns and convert those
+        detected as datetimes in a previous call to detect.
+
+        :param data_frame: Pandas data frame with the same columns
+        :return: The data frame with the datetime columns converted
+        """
+        for cname in list(data_frame.columns):
+            if data_frame[cname].dtype.name != 'object':
+                continue
+
+            data_frame[cname] = data_frame[cname].str.strip()
+            if cname in self.formats:
+                self.convert_column(data_frame, cname)
+
+        return data_frame
+
+    def convert_column(self, data_frame, cname):
+        """
+        Convert a column to datetime with the format cached for it. If some
+        of the values cannot be converted, the column is left unchanged and
+        is no longer considered a datetime.
+
+        :param data_frame: Pandas data frame
+        :param cname: Column name
+        :return: Boolean stating if the column was converted
+        """
+        column = data_frame[cname]
+        fmt = self.formats[cname]
+        if fmt:
+            series = pd.to_datetime(column, format=fmt, errors='coerce')
+        else:
+            series = pd.to_datetime(column,
+                                    infer_datetime_format=True,
+                                    errors='coerce')
+
+        failed = int((series.isnull() & column.notnull()).sum())
+        info = self.report[cname]
+        if failed:
+            # Not a datetime column
+            self.formats.pop(cname)
+            info['type'] = 'string'
+            info['failed'] += failed
+            info['confidence'] = \
+                1 - float(failed) / column.notnull().sum()
+            return False
+
+        data_frame[cname] = series
+        info['type'] = 'datetime'
+        info['confidence'] = float(info['sample_matches']) / \
+            max(info['sample_size'], 1)
+        return True
+
+
+def detect_datetime_columns(data_frame):
+    """
+    Strip the white space in the string columns of the data frame and
+    convert those that contain datetimes.
+
+    :param data_frame: Pandas data frame
+    :return: Pair (data frame, report per column)
+    """
+    inference = TypeInference()
+    data_frame = inference.detect(data_frame)
+    return data_frame, inference.report
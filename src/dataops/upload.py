@@ -83,13 +83,22 @@ def upload_s2(request):
     load_fields = [f for f in form if f.name.startswith('upload_')]
     newname_fields = [f for f in form if f.name.startswith('new_name_')]
 
+    # Information about the values in each column computed when the data
+    # was uploaded (the data itself is not loaded)
+    profile = pandas_db.get_upload_profile(workflow.id)
+    if profile:
+        col_profiles = profile['columns']
+    else:
+        col_profiles = [{}] * len(initial_columns)
+
     # Create one of the context elements for the form. Pack the lists so that
     # they can be iterated in the template
     df_info = [list(i) for i in zip(load_fields,
                                     initial_columns,
                                     newname_fields,
                                     column_types,
-                                    src_is_key_column)]
+                                    src_is_key_column,
+                                    col_profiles)]
 
     # Process the initial loading of the form and return
     if request.method != 'POST':
@@ -130,30 +139,13 @@ def upload_s2(request):
     # Update the dictionary with the session information
     request.session['upload_data'] = upload_data
 
-    # Load the existing DF or None if it doesn't exist
-    existing_df = pandas_db.load_from_db(workflow.id)
-
-    if existing_df is not None:
+    if ops.workflow_id_has_table(workflow.id):
         # This is a merge operation, so move to Step 3
         return redirect('dataops:upload_s3')
 
-    # This is an upload operation (not a merge) save the uploaded dataframe in
-    # the DB and finish.
-
-    # Get the uploaded data_frame
-    try:
-        data_frame = ops.load_upload_from_db(workflow.id)
-    except Exception:
-        return render(
-            request,
-            'error.html',
-            {'message': 'Exception while retrieving the data frame'})
-
-    # Update the data frame
-    status = ops.perform_dataframe_upload_merge(workflow.id,
-                                                existing_df,
-                                                data_frame,
-                                                upload_data)
+    # This is an upload operation (not a merge) save the uploaded data in
+    # the DB and finish (the data is copied within the DB).
+    status = ops.perform_upload_merge(workflow.id, upload_data)
 
     if status:
         # Something went wrong. Flag it and reload
@@ -421,20 +413,13 @@ def upload_s4(request):
     if request.method == 'POST':
         # We are processing a POST request
 
-        # Get the dataframes to merge
-        try:
-            dst_df = pandas_db.load_from_db(workflow.id)
-            src_df = ops.load_upload_from_db(workflow.id)
-        except Exception:
-            return render(request,
-                          'error.html',
-                          {'message': 'Exception while loading data frame'})
-
-        # Performing the merge
-        status = ops.perform_dataframe_upload_merge(workflow.id,
-                                                    dst_df,
-                                                    src_df,
-                                                    upload_data)
+        # Performing the merge (within the DB)
+        changes = None
+        if upload_data['how_merge'] == 'update':
+            status, changes = ops.perform_upload_update(workflow.id,
+                                                        upload_data)
+        else:
+            status = ops.perform_upload_merge(workflow.id, upload_data)
 
         # Nuke the temporary table
         pandas_db.delete_upload_table(workflow.id)
@@ -458,16 +443,19 @@ def upload_s4(request):
             return redirect(reverse('dataops:list'))
 
         # Log the event
+        log_payload = {'id': workflow.id,
+                       'name': workflow.name,
+                       'num_rows': workflow.nrows,
+                       'num_cols': workflow.ncols,
+                       'column_names': col_info[0],
+                       'column_types': col_info[1],
+                       'column_unique': col_info[2]}
+        if changes:
+            log_payload['changes'] = changes
         logs.ops.put(request.user,
                      'workflow_data_merge',
                      workflow,
-                     {'id': workflow.id,
-                      'name': workflow.name,
-                      'num_rows': workflow.nrows,
-                      'num_cols': workflow.ncols,
-                      'column_names': col_info[0],
-                      'column_types': col_info[1],
-                      'column_unique': col_info[2]})
+                     log_payload)
 
         # Remove the csvupload from the session object
         request.session.pop('upload_data', None)
@@ -553,7 +541,12 @@ def upload_s4(request):
     upload_data['override_columns_names'] = list(override_columns_names)
     request.session['upload_data'] = upload_data
 
+    # Number of rows in the uploaded data (from its profile)
+    profile = pandas_db.get_upload_profile(workflow.id)
+
     return render(request, 'dataops/upload_s4.html',
                   {'prev_step': reverse('dataops:upload_s3'),
                    'info': info,
+                   'dst_nrows': workflow.nrows,
+                   'src_nrows': profile['nrows'] if profile else None,
                    'next_name': 'Finish'})
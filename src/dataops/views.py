@@ -61,7 +61,8 @@ def row_update(request):
     # Get the rows from the table
     rows = pandas_db.execute_select_on_table(workflow.id,
                                              [update_key],
-                                             [update_val])
+                                             [update_val],
+                                             workflow.get_column_names())
 
     # This method can only be invoked through a POST operation
     if request.method == 'GET':
@@ -96,6 +97,10 @@ def row_update(request):
     unique_value = None
     log_payload = []
     for idx, col in enumerate(columns):
+        # The values of the formula columns are computed
+        if col.formula:
+            continue
+
         value = row_form.cleaned_data[field_prefix + '%s' % idx]
         set_fields.append(col.name)
         set_values.append(value)
@@ -115,6 +120,11 @@ def row_update(request):
                          [unique_field],
                          [unique_value])
 
+    # Refresh the formula columns using the values changed in this row
+    ops.refresh_formula_columns(workflow,
+                                set_fields,
+                                (unique_field, unique_value))
+
     # Log the event
     logs.ops.put(request.user,
                  'tablerow_update',
@@ -3,11 +3,17 @@ from __future__ import unicode_literals, print_function
 
 from django.contrib import admin
 
-from .models import Log
+from .models import Log, LogArchive
 
 
 class LogAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'created', 'name', 'workflow', 'payload')
 
 
+class LogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_from', 'created_to', 'nrows',
+                    'filename', 'archived')
+
+
 admin.site.register(Log, LogAdmin)
+admin.site.register(LogArchive, LogArchiveAdmin)
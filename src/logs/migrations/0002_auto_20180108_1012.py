@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-08 10:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0001_initial'),
+    ]
+
+    operations = [
+        # The text payload is cast in place. Empty payloads are not valid
+        # JSON, so they are normalised first.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    [
+                        "UPDATE logs_log SET payload = '{}' "
+                        "WHERE payload = ''",
+                        'ALTER TABLE logs_log ALTER COLUMN payload '
+                        'TYPE jsonb USING payload::jsonb',
+                    ],
+                    reverse_sql=[
+                        'ALTER TABLE logs_log ALTER COLUMN payload '
+                        'TYPE varchar(65536) USING payload::text',
+                    ],
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='log',
+                    name='payload',
+                    field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['workflow', '-created'], name='logs_log_wflow_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['payload'], name='logs_log_payload_gin_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-09 09:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0002_auto_20180108_1012'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='log',
+            name='logs_log_wflow_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['workflow', '-created', '-id'], name='logs_log_wflow_created_idx'),
+        ),
+    ]
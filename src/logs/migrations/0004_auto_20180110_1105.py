@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-10 11:05
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def month_range(first, last):
+    """
+    Generator of the first day of every month between first and last
+    (both included)
+    """
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_log_table(apps, schema_editor):
+    """
+    Turn logs_log into a table partitioned by month on the column created
+    (requires PostgreSQL 11 or later). The existing rows are copied to the
+    monthly partitions and the indexes are created on the partitioned table.
+    """
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    execute = schema_editor.execute
+
+    execute('ALTER TABLE logs_log RENAME TO logs_log_unpartitioned')
+    execute('DROP INDEX logs_log_wflow_created_idx')
+    execute('DROP INDEX logs_log_payload_gin_idx')
+    execute('CREATE TABLE logs_log '
+            '(LIKE logs_log_unpartitioned INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (created)')
+    execute('CREATE TABLE logs_log_default PARTITION OF logs_log DEFAULT')
+
+    # One partition per month from the oldest log to the next month
+    cursor = schema_editor.connection.cursor()
+    cursor.execute('SELECT min(created) FROM logs_log_unpartitioned')
+    first = cursor.fetchone()[0]
+    today = datetime.date.today()
+    first = first.date() if first else today
+    last = (today.replace(day=1) + datetime.timedelta(days=32))
+    for month in month_range(first, last):
+        following = (month + datetime.timedelta(days=32)).replace(day=1)
+        execute('CREATE TABLE logs_log_p{0:%Y%m} PARTITION OF logs_log '
+                'FOR VALUES FROM (%s) TO (%s)'.format(month),
+                [month.isoformat(), following.isoformat()])
+
+    execute('INSERT INTO logs_log SELECT * FROM logs_log_unpartitioned')
+    execute('ALTER SEQUENCE logs_log_id_seq OWNED BY logs_log.id')
+    execute('DROP TABLE logs_log_unpartitioned')
+
+    # The partition key must be part of the primary key
+    execute('ALTER TABLE logs_log ADD PRIMARY KEY (id, created)')
+    execute('ALTER TABLE logs_log ADD CONSTRAINT logs_log_user_id_fk '
+            'FOREIGN KEY (user_id) REFERENCES "{0}" (id) '
+            'DEFERRABLE INITIALLY DEFERRED'.format(user_table))
+    execute('ALTER TABLE logs_log ADD CONSTRAINT logs_log_workflow_id_fk '
+            'FOREIGN KEY (workflow_id) REFERENCES workflow_workflow (id) '
+            'DEFERRABLE INITIALLY DEFERRED')
+    execute('CREATE INDEX logs_log_user_id_idx ON logs_log (user_id)')
+    execute('CREATE INDEX logs_log_wflow_created_idx '
+            'ON logs_log (workflow_id, created DESC, id DESC)')
+    execute('CREATE INDEX logs_log_payload_gin_idx '
+            'ON logs_log USING gin (payload)')
+
+
+def unpartition_log_table(apps, schema_editor):
+    """
+    Copy the content of the partitions back to a regular table
+    """
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    execute = schema_editor.execute
+
+    execute('ALTER TABLE logs_log RENAME TO logs_log_partitioned')
+    execute('DROP INDEX logs_log_wflow_created_idx')
+    execute('DROP INDEX logs_log_payload_gin_idx')
+    execute('CREATE TABLE logs_log '
+            '(LIKE logs_log_partitioned INCLUDING DEFAULTS)')
+    execute('INSERT INTO logs_log SELECT * FROM logs_log_partitioned')
+    execute('ALTER SEQUENCE logs_log_id_seq OWNED BY logs_log.id')
+    execute('DROP TABLE logs_log_partitioned CASCADE')
+
+    execute('ALTER TABLE logs_log ADD PRIMARY KEY (id)')
+    execute('ALTER TABLE logs_log ADD CONSTRAINT logs_log_user_id_fk '
+            'FOREIGN KEY (user_id) REFERENCES "{0}" (id) '
+            'DEFERRABLE INITIALLY DEFERRED'.format(user_table))
+    execute('ALTER TABLE logs_log ADD CONSTRAINT logs_log_workflow_id_fk '
+            'FOREIGN KEY (workflow_id) REFERENCES workflow_workflow (id) '
+            'DEFERRABLE INITIALLY DEFERRED')
+    execute('CREATE INDEX logs_log_user_id_idx ON logs_log (user_id)')
+    execute('CREATE INDEX logs_log_wflow_created_idx '
+            'ON logs_log (workflow_id, created DESC, id DESC)')
+    execute('CREATE INDEX logs_log_payload_gin_idx '
+            'ON logs_log USING gin (payload)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0003_auto_20180109_0930'),
+        ('workflow', '0013_auto_20171209_0809'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, verbose_name='Partition name')),
+                ('filename', models.CharField(max_length=2048, verbose_name='Archive file')),
+                ('created_from', models.DateTimeField()),
+                ('created_to', models.DateTimeField()),
+                ('id_min', models.IntegerField(default=0)),
+                ('id_max', models.IntegerField(default=0)),
+                ('nrows', models.IntegerField(default=0, verbose_name='Number of logs')),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('created_from',),
+            },
+        ),
+        migrations.RunPython(partition_log_table, unpartition_log_table),
+    ]
@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
-import json
-
-from django.db import models
 from django.conf import settings
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models
 
 from workflow.models import Workflow
 
@@ -33,31 +33,28 @@ class Log(models.Model):
                                  blank=False)
 
     # JSON element with additional information
-    payload = models.CharField(max_length=65536,
-                               default='',
-                               null=False,
-                               blank=False)
+    payload = JSONField(default=dict,
+                        blank=True,
+                        null=False)
 
     def get_payload(self):
         """
-        Function to access the payload information. If using a DB that
-        supports JSON this function should be rewritten (to be transparent).
+        Function to access the payload information.
         :return: The JSON structure with the payload
         """
 
-        if self.payload == '':
+        if not self.payload:
             return {}
 
-        return json.loads(self.payload)
+        return self.payload
 
     def set_payload(self, payload):
         """
-        Save the payload structure as text. If using a DB that supports JSON,
-        this function should be rewritten.
+        Save the payload structure (stored natively as JSONB)
         :return: Nothing.
         """
 
-        self.payload = json.dumps(payload)
+        self.payload = payload
 
     def __unicode__(self):
         return '%s %s %s %s' % (self.user,
@@ -68,3 +65,52 @@ class Log(models.Model):
     @property
     def log_useremail(self):
         return self.user.email
+
+    class Meta:
+        # The logs page traverses the events of one workflow from the most
+        # recent one (using created, id as the pagination key), and searches
+        # the payload by key or containment.
+        indexes = [
+            models.Index(fields=['workflow', '-created', '-id'],
+                         name='logs_log_wflow_created_idx'),
+            GinIndex(fields=['payload'], name='logs_log_payload_gin_idx'),
+        ]
+
+
+class LogArchive(models.Model):
+    """
+    Monthly partition of the log table that has been detached and written
+    to a gzipped file with one JSON object per line. The record is the index
+    used to locate the file containing a given log.
+    """
+
+    # Name of the partition that was archived
+    name = models.CharField(max_length=256,
+                            unique=True,
+                            verbose_name='Partition name')
+
+    # Path to the gzipped JSON lines file
+    filename = models.CharField(max_length=2048,
+                                verbose_name='Archive file')
+
+    # Range of creation times covered by the partition
+    created_from = models.DateTimeField(null=False, blank=False)
+
+    created_to = models.DateTimeField(null=False, blank=False)
+
+    # Range of log ids stored in the file
+    id_min = models.IntegerField(default=0, null=False)
+
+    id_max = models.IntegerField(default=0, null=False)
+
+    nrows = models.IntegerField(default=0,
+                                null=False,
+                                verbose_name='Number of logs')
+
+    archived = models.DateTimeField(auto_now_add=True, null=False)
+
+    def __unicode__(self):
+        return '%s %s' % (self.name, self.filename)
+
+    class Meta:
+        ordering = ('created_from',)
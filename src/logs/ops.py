@@ -1,7 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
-from .models import Log
+import datetime
+import gzip
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import settings
+from .models import Log, LogArchive
+
+# Name of the monthly partitions of the log table (logs_log_pYYYYMM)
+partition_prefix = 'logs_log_p'
 
 log_types = {
     'workflow_create': 'Workflow created',
@@ -61,3 +75,230 @@ def put(user, name, workflow, payload):
     event.workflow = workflow
     event.set_payload(payload)
     event.save()
+
+
+def planner_row_estimate(query_set):
+    """
+    Ask the PostgreSQL planner for the number of rows that the query set
+    would return (without executing it).
+
+    :param query_set: Query set over the logs
+    :return: Integer with the estimated number of rows
+    """
+    sql, params = query_set.query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_logs(query_set):
+    """
+    Number of logs in the query set. If the planner estimates more rows
+    than COUNT_ESTIMATE_THRESHOLD, the estimate is returned instead of
+    running the exact count.
+
+    :param query_set: Query set over the logs
+    :return: Integer with the (exact or estimated) number of rows
+    """
+    threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    if threshold:
+        estimate = planner_row_estimate(query_set)
+        if estimate > threshold:
+            return estimate
+
+    return query_set.count()
+
+
+def next_month(month):
+    """
+    :param month: Date
+    :return: Date with the first day of the following month
+    """
+    return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def month_start(month):
+    """
+    :param month: Date
+    :return: Aware datetime at the start of the month (partitions use UTC)
+    """
+    return timezone.make_aware(
+        datetime.datetime(month.year, month.month, 1),
+        timezone.utc
+    )
+
+
+def get_log_partitions():
+    """
+    Get the monthly partitions currently attached to the log table
+
+    :return: List of pairs (partition name, first day of the month) sorted
+    by month
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'logs_log'::regclass"
+    )
+    result = []
+    for (name,) in cursor.fetchall():
+        if not name.startswith(partition_prefix):
+            # Skip the default partition
+            continue
+        month = datetime.datetime.strptime(name[len(partition_prefix):],
+                                           '%Y%m').date()
+        result.append((name, month))
+
+    return sorted(result, key=lambda x: x[1])
+
+
+def create_log_partition(month):
+    """
+    Create the partition of the log table for the given month (if it does
+    not exist). The logs for that month that were stored in the default
+    partition (because the partition did not exist) are moved to it.
+
+    :param month: Date within the month
+    :return: Name of the partition
+    """
+    month = month.replace(day=1)
+    name = '{0}{1:%Y%m}'.format(partition_prefix, month)
+    bounds = [month.isoformat(), next_month(month).isoformat()]
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute('SELECT to_regclass(%s)', [name])
+        if cursor.fetchone()[0]:
+            # Partition already exists
+            return name
+
+        # Create the table, move the rows from the default partition and
+        # attach it to the log table
+        cursor.execute(
+            'CREATE TABLE "{0}" (LIKE logs_log INCLUDING DEFAULTS)'.format(
+                name
+            )
+        )
+        cursor.execute(
+            'WITH moved AS (DELETE FROM logs_log_default '
+            'WHERE created >= %s AND created < %s RETURNING *) '
+            'INSERT INTO "{0}" SELECT * FROM moved'.format(name),
+            bounds
+        )
+        cursor.execute(
+            'ALTER TABLE logs_log ATTACH PARTITION "{0}" '
+            'FOR VALUES FROM (%s) TO (%s)'.format(name),
+            bounds
+        )
+
+    return name
+
+
+def archive_log_partition(name, month, archive_dir):
+    """
+    Write the content of a partition of the log table to a gzipped file with
+    one JSON object per line, and then detach and drop the partition and
+    record the file in LogArchive. The file is written while the partition
+    is still attached (no new logs are stored in the partition of a past
+    month), so the log table is only locked by the final transaction, which
+    is short. If something fails, the partition remains attached and the
+    file is removed.
+
+    :param name: Name of the partition
+    :param month: First day of the month stored in the partition
+    :param archive_dir: Folder where the file is written
+    :return: LogArchive object
+    """
+    filename = os.path.join(archive_dir, name + '.jsonl.gz')
+
+    try:
+        # Traverse the partition with a server side cursor (it needs a
+        # transaction, which only holds a shared lock on the partition)
+        with transaction.atomic():
+            rows = connection.chunked_cursor()
+            rows.execute(
+                'SELECT p.id, p.created, p.name, p.user_id, u.email, '
+                'p.workflow_id, p.payload '
+                'FROM "{0}" p LEFT JOIN "{1}" u ON u.id = p.user_id '
+                'ORDER BY p.id'.format(name, get_user_model()._meta.db_table)
+            )
+
+            nrows = 0
+            id_min = None
+            id_max = None
+            zfile = gzip.open(filename, 'wb')
+            try:
+                for row in rows:
+                    zfile.write((json.dumps({
+                        'id': row[0],
+                        'created': row[1].isoformat(),
+                        'name': row[2],
+                        'user': row[3],
+                        'user_email': row[4],
+                        'workflow': row[5],
+                        'payload': row[6],
+                    }) + '\n').encode('utf-8'))
+                    nrows += 1
+                    if id_min is None:
+                        id_min = row[0]
+                    id_max = row[0]
+            finally:
+                zfile.close()
+                rows.close()
+
+        # Detach and drop the partition once the file is complete
+        with transaction.atomic():
+            archive = LogArchive.objects.create(
+                name=name,
+                filename=filename,
+                created_from=month_start(month),
+                created_to=month_start(next_month(month)),
+                id_min=id_min or 0,
+                id_max=id_max or 0,
+                nrows=nrows
+            )
+
+            cursor = connection.cursor()
+            cursor.execute(
+                'ALTER TABLE logs_log DETACH PARTITION "{0}"'.format(name)
+            )
+            cursor.execute('DROP TABLE "{0}"'.format(name))
+    except Exception:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+
+    return archive
+
+
+def get_archived_log(pk):
+    """
+    Search for a log that has been archived
+
+    :param pk: Log id
+    :return: Log object (not stored in the DB) or None if not found
+    """
+    pk = int(pk)
+    for archive in LogArchive.objects.filter(id_min__lte=pk, id_max__gte=pk):
+        zfile = gzip.open(archive.filename, 'rb')
+        try:
+            for line in zfile:
+                item = json.loads(line.decode('utf-8'))
+                if item['id'] != pk:
+                    continue
+
+                return Log(id=item['id'],
+                           created=parse_datetime(item['created']),
+                           name=item['name'],
+                           user_id=item['user'],
+                           workflow_id=item['workflow'],
+                           payload=item['payload'])
+        finally:
+            zfile.close()
+
+    return None
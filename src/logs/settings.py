@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import os
+
 from django.conf import settings
 from django.db import models
 
 MAX_LIST_SIZE = getattr(settings, 'LOGS_MAX_LIST_SIZE', 200)
+COUNT_ESTIMATE_THRESHOLD = getattr(settings,
+                                   'LOGS_COUNT_ESTIMATE_THRESHOLD',
+                                   100000)
+RETENTION_MONTHS = getattr(settings, 'LOGS_RETENTION_MONTHS', 12)
+ARCHIVE_DIR = getattr(settings,
+                      'LOGS_ARCHIVE_DIR',
+                      os.path.join(settings.BASE_DIR(), '..', 'logs_archive'))
 
 if 'siteprefs' in settings.INSTALLED_APPS:
     # Respect those users who doesn't have siteprefs installed.
@@ -17,4 +26,17 @@ if 'siteprefs' in settings.INSTALLED_APPS:
              verbose_name='Maximum number of logs shown to the user',
              static=False,
              field=models.IntegerField(blank=True)),
+
+        pref(COUNT_ESTIMATE_THRESHOLD,
+             verbose_name='Number of logs above which the planner estimate '
+                          'is shown instead of the exact count (0 to '
+                          'always count)',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(RETENTION_MONTHS,
+             verbose_name='Number of months the logs are kept in the '
+                          'database before being archived',
+             static=False,
+             field=models.IntegerField(blank=True)),
     )
@@ -3,4 +3,24 @@ from __future__ import unicode_literals, print_function
 
 from django.test import TestCase
 
-# Create your tests here.
+from logs.views import payload_filter
+
+
+class PayloadFilterTest(TestCase):
+
+    def test_key_search(self):
+        # Searched as a key or as text anywhere in the payload
+        q = payload_filter(' subject ')
+        self.assertEqual(q.connector, 'OR')
+        self.assertEqual(q.children,
+                         [('payload__has_key', 'subject'),
+                          ('payload_text__contains', ' subject ')])
+
+    def test_containment_search(self):
+        q = payload_filter('name: wflow1')
+        self.assertEqual(q.children,
+                         [('payload__contains', {'name': 'wflow1'})])
+
+        # Values with a JSON type are matched with that type
+        q = payload_filter('id:1')
+        self.assertEqual(q.children, [('payload__contains', {'id': 1})])
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import hashlib
 import json
 
 import pytz
 from django.conf import settings as ontask_settings
 from django.contrib.auth.decorators import user_passes_test
-from django.db.models import F, Q
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db.models import F, Q, TextField
+from django.db.models.functions import Cast
+from django.http import JsonResponse, Http404
 from django.shortcuts import redirect, reverse, render
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
@@ -16,7 +19,69 @@ from django.views.decorators.http import require_http_methods
 from ontask.permissions import is_instructor
 from workflow.ops import get_workflow
 from .models import Log
-from .ops import log_types
+from .ops import log_types, count_logs, get_archived_log
+
+# Seconds during which the number of logs shown in the table is reused
+count_cache_timeout = 60
+
+
+def payload_filter(search_value):
+    """
+    Translate the search string into a lookup over the payload. A string of
+    the form key:value is searched as the containment of the pair
+    {key: value}, and any other string is searched as a key in the payload
+    (both answered by the GIN index) or as text anywhere in the payload, as
+    in the previous free text search. The text search uses the field
+    payload_text, so the query set must be annotated with it (see
+    annotate_payload_text).
+
+    :param search_value: String typed in the search box
+    :return: Q object with the payload lookup
+    """
+    key, sep, value = search_value.partition(':')
+    if not sep:
+        return Q(payload__has_key=search_value.strip()) | \
+            Q(payload_text__contains=search_value)
+
+    # Numbers and booleans are matched with their JSON type
+    value = value.strip()
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+
+    return Q(payload__contains={key.strip(): value})
+
+
+def annotate_payload_text(query_set):
+    """
+    :param query_set: Query set over the logs
+    :return: Query set with the payload as text in the field payload_text
+    """
+    return query_set.annotate(payload_text=Cast('payload', TextField()))
+
+
+def cached_count(workflow_id, search_value, query_set):
+    """
+    Number of logs in the query set (exact or estimated, see count_logs),
+    kept in the cache for count_cache_timeout seconds so that the draws of
+    the table while the user moves through the pages do not count again.
+
+    :param workflow_id: Workflow id
+    :param search_value: String used to search the logs (or None)
+    :param query_set: Query set over the logs
+    :return: Integer with the number of rows
+    """
+    key = 'logs_count_{0}_{1}'.format(
+        workflow_id,
+        hashlib.md5((search_value or '').encode('utf-8')).hexdigest()
+    )
+    result = cache.get(key)
+    if result is None:
+        result = count_logs(query_set)
+        cache.set(key, result, count_cache_timeout)
+
+    return result
 
 
 @user_passes_test(is_instructor)
@@ -56,29 +121,47 @@ def show_ss(request):
     # Get the column information from the request and the rest of values.
     search_value = request.POST.get('search[value]', None)
 
-    # Get the logs
+    # Get the logs (uses the index on workflow, created, id)
     qs = Log.objects.filter(
         workflow__id=workflow.id
     )
-    recordsTotal = qs.count()
+    recordsTotal = cached_count(workflow.id, None, qs)
+    recordsFiltered = recordsTotal
 
     if search_value:
-        # Refine the log
-        qs = qs.filter(
+        # Refine the log. Each log has a single user, so no duplicates.
+        qs = annotate_payload_text(qs).filter(
             Q(user__email__contains=search_value) |
             Q(name__contains=search_value) |
-            Q(payload__contains=search_value),
-            workflow__id=workflow.id,
-        ).distinct()
-
-    # Order and select values
-    qs = qs.order_by(F('created').desc()).values_list(
-        'id', 'created', 'user__email', 'name'
-    )
-    recordsFiltered = qs.count()
+            payload_filter(search_value)
+        )
+        recordsFiltered = cached_count(workflow.id, search_value, qs)
+
+    # Order by the pagination key (the id breaks the ties in created)
+    qs = qs.order_by(F('created').desc(), F('id').desc())
+
+    # The page is selected with the key of the row preceding it (keyset
+    # pagination). That key is obtained reading only the pagination key
+    # (an index only scan of the workflow, created, id index when there is
+    # no search), so the rows before the page are never fetched.
+    boundary = []
+    if start > 0:
+        boundary = list(qs.values_list('created', 'id')[start - 1:start])
+    if start > 0 and not boundary:
+        # The page is beyond the last log
+        page = []
+    else:
+        if boundary:
+            created, log_id = boundary[0]
+            qs = qs.filter(created__lte=created).filter(
+                Q(created__lt=created) | Q(id__lt=log_id)
+            )
+        page = list(
+            qs.values_list('id', 'created', 'user__email', 'name')[:length]
+        )
 
     final_qs = []
-    for item in qs[start:start + length]:
+    for item in page:
         row = [
             item[1].astimezone(pytz.timezone(ontask_settings.TIME_ZONE)),
             item[2],
@@ -106,18 +189,23 @@ def show_ss(request):
 
 @user_passes_test(is_instructor)
 def view_log_list(request, pk):
-    # Get the log item
-    log_item = Log.objects.get(pk=pk)
+    # Get the log item (from the table or from the archived partitions)
+    try:
+        log_item = Log.objects.get(pk=pk)
+    except Log.DoesNotExist:
+        log_item = get_archived_log(pk)
+        if log_item is None:
+            raise Http404
     data = dict()
 
-    context = log_item.get_payload()
+    # Copy the payload so that the additional keys do not modify it
+    context = dict(log_item.get_payload())
 
     # Add the name of the object, the workflow and the type
     context['log_type'] = log_item.name
     context['op_name'] = log_types[log_item.name]
     context['workflow'] = log_item.workflow
-    # TODO: Change the model to include directly a JSON object, not this.
-    context['json_pretty'] = json.dumps(json.loads(log_item.payload),
+    context['json_pretty'] = json.dumps(log_item.get_payload(),
                                         sort_keys=True,
                                         indent=4)
 
@@ -2,13 +2,19 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
-from models import ScheduledEmailAction
+from models import ScheduledEmailAction, ScheduledEmailShard
 
 
 class ScheduledEmailActionAdmin(admin.ModelAdmin):
     list_display = ('user', 'type', 'created', 'execute',
                     'status', 'action', 'subject', 'email_column',
                     'send_confirmation', 'track_read', 'add_column',
-                    'message')
+                    'message', 'nrows_total', 'nrows_done')
 
-admin.site.register(ScheduledEmailAction, ScheduledEmailActionAdmin)
\ No newline at end of file
+
+class ScheduledEmailShardAdmin(admin.ModelAdmin):
+    list_display = ('scheduled_action', 'position', 'key_from', 'key_to',
+                    'nrows', 'status', 'claimed', 'heartbeat', 'message')
+
+admin.site.register(ScheduledEmailAction, ScheduledEmailActionAdmin)
+admin.site.register(ScheduledEmailShard, ScheduledEmailShardAdmin)
\ No newline at end of file
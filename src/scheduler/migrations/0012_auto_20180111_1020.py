@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-11 10:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0011_scheduledemailaction_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledemailaction',
+            name='nrows_done',
+            field=models.IntegerField(default=0, verbose_name='Number of rows processed'),
+        ),
+        migrations.AddField(
+            model_name='scheduledemailaction',
+            name='nrows_total',
+            field=models.IntegerField(default=0, verbose_name='Number of rows to process'),
+        ),
+        migrations.AddField(
+            model_name='scheduledemailaction',
+            name='track_column',
+            field=models.CharField(blank=True, default='', max_length=512),
+        ),
+        migrations.CreateModel(
+            name='ScheduledEmailShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('key_from', models.TextField()),
+                ('key_to', models.TextField()),
+                ('nrows', models.IntegerField(default=0)),
+                ('status', models.IntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done'), (3, 'done_error')], default=0, verbose_name='Execution Status')),
+                ('claimed', models.DateTimeField(blank=True, null=True)),
+                ('message', models.TextField(blank=True, verbose_name='Execution message')),
+                ('scheduled_action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='scheduler.ScheduledEmailAction')),
+            ],
+            options={
+                'ordering': ('scheduled_action', 'position'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='scheduledemailshard',
+            unique_together=set([('scheduled_action', 'position')]),
+        ),
+    ]
@@ -117,3 +117,97 @@ class ScheduledEmailAction(ScheduledAction):
         verbose_name='Add a column with the number of email reads tracked',
         null=False,
         blank=False)
+
+    # Name of the column counting the email reads (if add_column is set)
+    track_column = models.CharField(
+        max_length=512,
+        default='',
+        blank=True,
+        null=False
+    )
+
+    # Progress of the execution (rows processed out of the total)
+    nrows_total = models.IntegerField(
+        default=0,
+        verbose_name='Number of rows to process',
+        null=False,
+        blank=False)
+
+    nrows_done = models.IntegerField(
+        default=0,
+        verbose_name='Number of rows processed',
+        null=False,
+        blank=False)
+
+    # Token of the last claim of the action, and time when the worker
+    # preparing its execution was last known to be alive
+    owner = models.CharField(max_length=32,
+                             default='',
+                             blank=True,
+                             null=False)
+
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    def progress(self):
+        """
+        :return: String with the number of rows processed and the total
+        """
+        return '{0} / {1}'.format(self.nrows_done, self.nrows_total)
+
+
+class ScheduledEmailShard(models.Model):
+    """
+    Range of rows of a scheduled email action (consecutive values of the
+    email column) that is rendered and sent as a unit. The shards of an
+    action are executed in parallel by the scheduler workers, and their
+    status is the checkpoint used to resume an interrupted execution.
+    """
+    scheduled_action = models.ForeignKey(ScheduledEmailAction,
+                                         db_index=True,
+                                         on_delete=models.CASCADE,
+                                         null=False,
+                                         blank=False,
+                                         related_name='shards')
+
+    # Position of the shard within the action
+    position = models.IntegerField(null=False, blank=False)
+
+    # First value of the email column in the shard, and first value of the
+    # next shard (not included, and empty in the last shard)
+    key_from = models.TextField(null=False, blank=False)
+
+    key_to = models.TextField(null=True, blank=True)
+
+    # Number of rows in the shard
+    nrows = models.IntegerField(default=0, null=False, blank=False)
+
+    # Status of the shard (same values as in the scheduled actions)
+    status = models.IntegerField(verbose_name="Execution Status",
+                                 choices=[(0, 'pending'),
+                                          (1, 'running'),
+                                          (2, 'done'),
+                                          (3, 'done_error')],
+                                 default=0,
+                                 null=False,
+                                 blank=False)
+
+    # Time when a worker claimed the shard
+    claimed = models.DateTimeField(null=True, blank=True)
+
+    # Token of the last claim of the shard, and time when the worker
+    # executing it was last known to be alive
+    owner = models.CharField(max_length=32,
+                             default='',
+                             blank=True,
+                             null=False)
+
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    # Status message to capture a message resulting from the execution
+    message = models.TextField(null=False,
+                               blank=True,
+                               verbose_name='Execution message')
+
+    class Meta:
+        unique_together = ('scheduled_action', 'position')
+        ordering = ('scheduled_action', 'position')
@@ -1,4 +1,414 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import datetime
+import logging
+import threading
+import uuid
 
+import pytz
+from django.conf import settings as ontask_settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+import logs.ops
+from action.models import Condition
+from action.ops import (get_track_column_name,
+                        add_track_column,
+                        create_messages,
+                        deliver_messages,
+                        log_messages,
+                        notify_messages_sent)
+from dataops import pandas_db
+from scheduler import settings
+from scheduler.models import ScheduledEmailAction, ScheduledEmailShard
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Thread that, while a worker executes a claimed action or shard, stores
+    every HEARTBEAT seconds the current time in its heartbeat field (only
+    if the claim is still the one given). The claims without a heartbeat in
+    the last SHARD_TIMEOUT minutes are considered abandoned. Used as a
+    context manager around the execution.
+    """
+
+    def __init__(self, model, pk, owner):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.model = model
+        self.pk = pk
+        self.owner = owner
+        self.finished = threading.Event()
+
+    def run(self):
+        try:
+            while not self.finished.wait(settings.HEARTBEAT):
+                self.model.objects.filter(
+                    pk=self.pk,
+                    owner=self.owner
+                ).update(heartbeat=datetime.datetime.now(
+                    pytz.timezone(ontask_settings.TIME_ZONE)
+                ))
+        finally:
+            # The connection is specific to this thread
+            connection.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finished.set()
+        self.join()
+
+
+def claim_email_actions(before, limit=None):
+    """
+    Select the pending email actions due before the given time and flag them
+    as running in a single transaction. The rows are locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so several processes (in the same or
+    in different nodes) polling at the same time obtain disjoint sets of
+    actions and no action is executed twice. The running actions with no
+    shards and no heartbeat in the last SHARD_TIMEOUT minutes (the worker
+    preparing them died) are claimed again.
+
+    :param before: Datetime. Actions with an execution time before this one
+    are claimed.
+    :param limit: Maximum number of actions to claim (None for all)
+    :return: List of pairs (id, owner) of the claimed actions (now with
+    status running), where owner is the token of the claim
+    """
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
+    expired = now - datetime.timedelta(minutes=settings.SHARD_TIMEOUT)
+    owner = uuid.uuid4().hex
+
+    with transaction.atomic():
+        # The actions with shards are excluded with a subquery (not a join)
+        # because the rows of an outer join cannot be locked.
+        s_items = ScheduledEmailAction.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            Q(status=0) |  # Pending
+            (Q(status=1) &  # Running and abandoned
+             (Q(heartbeat__lt=expired) | Q(heartbeat__isnull=True)) &
+             ~Q(id__in=ScheduledEmailShard.objects.values(
+                 'scheduled_action_id'
+             ))),
+            type='email_send',
+            deleted=False,
+            execute__lt=before
+        ).order_by('execute')
+
+        if limit is not None:
+            s_items = s_items[:limit]
+
+        ids = list(s_items.values_list('id', flat=True))
+        if ids:
+            ScheduledEmailAction.objects.filter(id__in=ids).update(
+                status=1,  # Running
+                owner=owner,
+                heartbeat=now
+            )
+
+    return [(x, owner) for x in ids]
+
+
+def claim_email_shards(limit=None):
+    """
+    Select the shards of the running email actions that are pending (or
+    that are running but had no heartbeat in the last SHARD_TIMEOUT
+    minutes, because the worker executing them died) and flag them as
+    running. The rows are locked with SELECT ... FOR UPDATE SKIP LOCKED as
+    in claim_email_actions.
+
+    :param limit: Maximum number of shards to claim (None for all)
+    :return: List of pairs (id, owner) of the claimed shards, where owner is
+    the token of the claim
+    """
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
+    expired = now - datetime.timedelta(minutes=settings.SHARD_TIMEOUT)
+    owner = uuid.uuid4().hex
+
+    with transaction.atomic():
+        # The actions are selected with a subquery (not a join) so that only
+        # the rows of the shards are locked.
+        shards = ScheduledEmailShard.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            Q(status=0) |
+            (Q(status=1) &
+             (Q(heartbeat__lt=expired) | Q(heartbeat__isnull=True))),
+            scheduled_action__in=ScheduledEmailAction.objects.filter(
+                status=1,  # Running
+                deleted=False
+            ).values('id')
+        ).order_by('scheduled_action_id', 'position')
+
+        if limit is not None:
+            shards = shards[:limit]
+
+        ids = list(shards.values_list('id', flat=True))
+        if ids:
+            ScheduledEmailShard.objects.filter(id__in=ids).update(
+                status=1,  # Running
+                claimed=now,
+                owner=owner,
+                heartbeat=now
+            )
+
+    return [(x, owner) for x in ids]
+
+
+def create_email_shards(item, owner):
+    """
+    Split the rows of the table selected by the action in ranges of
+    consecutive values of the email column with at most SHARD_SIZE rows,
+    and create a shard for each of them. If the action adds a column to
+    track the email reads, it is created now so that it exists before any
+    email is read (or reused if a previous execution created it).
+
+    :param item: ScheduledEmailAction being executed
+    :param owner: Token of the claim of the action
+    :return: Number of shards created (None if the action was claimed again
+    by another worker)
+    """
+    workflow = item.action.workflow
+
+    try:
+        cond_filter = Condition.objects.get(action__id=item.action.id,
+                                            is_filter=True)
+    except ObjectDoesNotExist:
+        cond_filter = None
+
+    key_ranges, null_rows = pandas_db.get_key_ranges(workflow.id,
+                                                     item.email_column.name,
+                                                     cond_filter,
+                                                     settings.SHARD_SIZE)
+    if null_rows:
+        raise Exception('The column with email addresses has {0} empty '
+                        'values.'.format(null_rows))
+
+    with transaction.atomic():
+        # Modify the workflow and create the shards only if the claim is
+        # still ours (the lock is kept until all of it is committed)
+        locked = ScheduledEmailAction.objects.select_for_update().get(
+            pk=item.id
+        )
+        if locked.owner != owner or locked.status != 1 or \
+                locked.shards.exists():
+            return None
+
+        if item.add_column and \
+                item.track_column not in workflow.get_column_names():
+            if not item.track_column:
+                item.track_column = get_track_column_name(workflow)
+                item.save(update_fields=['track_column'])
+            add_track_column(workflow, item.track_column)
+
+        ScheduledEmailShard.objects.bulk_create([
+            ScheduledEmailShard(
+                scheduled_action=item,
+                position=idx,
+                key_from='{0}'.format(first),
+                key_to='{0}'.format(last) if last is not None else None,
+                nrows=nrows)
+            for idx, (first, last, nrows) in enumerate(key_ranges)
+        ])
+
+        item.nrows_total = sum([x[2] for x in key_ranges])
+        item.nrows_done = 0
+        item.save(update_fields=['nrows_total', 'nrows_done'])
+
+    return len(key_ranges)
+
+
+def execute_email_action(item_id, owner):
+    """
+    Start the execution of a scheduled email action previously claimed with
+    claim_email_actions. The rows are split in shards that are later claimed
+    (with claim_email_shards) and executed (with execute_email_shard) by the
+    workers. If the action was already split (the execution was interrupted)
+    the existing shards are kept, so the emails are not sent twice.
+
+    :param item_id: Id of the ScheduledEmailAction to execute
+    :param owner: Token of the claim of the action
+    :return: Status of the action
+    """
+    item = ScheduledEmailAction.objects.select_related(
+        'user',
+        'action__workflow',
+        'email_column'
+    ).get(pk=item_id)
+
+    if item.owner != owner:
+        # Claimed again by another worker
+        return item.status
+
+    if item.shards.exists():
+        # Resuming a previous execution
+        logger.info('Resuming execution of task ' + str(item.id))
+        return item.status
+
+    # Log the event
+    logs.ops.put(item.user,
+                 'schedule_email_execute',
+                 item.action.workflow,
+                 {'action': item.action.name,
+                  'action_id': item.action.id,
+                  'execute': item.execute.isoformat(),
+                  'subject': item.subject,
+                  'email_column': item.email_column.name,
+                  'send_confirmation': item.send_confirmation,
+                  'track_read': item.track_read,
+                  'add_column': item.add_column})
+
+    try:
+        with Heartbeat(ScheduledEmailAction, item.id, owner):
+            nshards = create_email_shards(item, owner)
+    except Exception as e:
+        item.message = 'Error while preparing the execution. ' \
+                       'Exception message: ' + str(e)
+        logger.error(item.message)
+        item.status = 3  # Done with error
+        ScheduledEmailAction.objects.filter(pk=item.id, owner=owner).update(
+            status=item.status,
+            message=item.message
+        )
+        return item.status
+
+    if nshards is None:
+        logger.info('Task {0} was claimed by another worker'.format(item.id))
+        return item.status
+
+    if nshards == 0:
+        # No rows to process, the action is done.
+        return finish_email_action(item.id)
+
+    return item.status
+
+
+def execute_email_shard(shard_id, owner):
+    """
+    Render and send the emails of one shard of a scheduled email action,
+    record the result in the shard (the checkpoint) and the progress in the
+    action, and finish the action if this is the last shard. The result is
+    only recorded if the shard was not claimed again by another worker in
+    the meantime (the progress is not counted twice).
+
+    :param shard_id: Id of the ScheduledEmailShard claimed by this worker
+    :param owner: Token of the claim of the shard
+    :return: Status of the shard (2 done, 3 done with error)
+    """
+    shard = ScheduledEmailShard.objects.select_related(
+        'scheduled_action__user',
+        'scheduled_action__action__workflow',
+        'scheduled_action__email_column'
+    ).get(pk=shard_id)
+    item = shard.scheduled_action
+
+    if shard.owner != owner or shard.status != 1:
+        # Claimed again by another worker
+        return shard.status
+
+    msg = ''
+    try:
+        with Heartbeat(ScheduledEmailShard, shard.id, owner):
+            result = create_messages(item.user,
+                                     item.action,
+                                     item.subject,
+                                     item.email_column.name,
+                                     item.user.email,
+                                     item.track_read,
+                                     item.track_column,
+                                     (shard.key_from, shard.key_to))
+            if isinstance(result, list):
+                msgs = result
+                result = deliver_messages(msgs)
+                if not result:
+                    # Log the events (one per email)
+                    log_messages(item.user, item.action, msgs)
+
+        # If the result has some sort of message, push it to the log
+        if result:
+            msg = 'Incorrect execution message: ' + str(result)
+            logger.error(msg)
+    except Exception as e:
+        msg = 'Error while executing send_messages. Exception message: ' \
+              + str(e)
+        logger.error(msg)
+        shard.status = 3  # Done with error
+    else:
+        shard.status = 2  # Done.
+
+    # Checkpoint (only if the claim is still ours)
+    with transaction.atomic():
+        updated = ScheduledEmailShard.objects.filter(
+            pk=shard.id,
+            status=1,
+            owner=owner
+        ).update(status=shard.status, message=msg)
+        if updated:
+            ScheduledEmailAction.objects.filter(pk=item.id).update(
+                nrows_done=F('nrows_done') + shard.nrows
+            )
+
+    if not updated:
+        logger.error('Shard {0} was claimed by another worker'.format(
+            shard.id))
+        return shard.status
+
+    finish_email_action(item.id)
+
+    return shard.status
+
+
+def finish_email_action(item_id):
+    """
+    If all the shards of the action are finished, record the sending of the
+    messages, send the confirmation email and store the final status and
+    message of the action. The action row is locked so that only one of the
+    workers finishing the last shards completes it.
+
+    :param item_id: Id of the ScheduledEmailAction
+    :return: Status of the action
+    """
+    with transaction.atomic():
+        item = ScheduledEmailAction.objects.select_for_update().get(
+            pk=item_id
+        )
+
+        if item.status != 1 or \
+                item.shards.exclude(status__in=[2, 3]).exists():
+            # Finished by someone else or shards pending
+            return item.status
+
+        shards = list(item.shards.all())
+        msgs = [x.message for x in shards if x.message]
+        num_messages = sum([x.nrows for x in shards
+                            if x.status == 2 and not x.message])
+
+        result = notify_messages_sent(item.user,
+                                      item.action,
+                                      item.subject,
+                                      num_messages,
+                                      item.send_confirmation)
+        if result:
+            msgs.append('Incorrect execution message: ' + str(result))
+            logger.error(msgs[-1])
+
+        if any([x.status == 3 for x in shards]):
+            item.status = 3  # Done with error
+        else:
+            logger.info('Finished execution of task ' + str(item.id))
+            item.status = 2  # Done.
+
+        # Store the resulting message in the record
+        item.message = '\n'.join(msgs)
+        item.save(update_fields=['status', 'message'])
+
+    return item.status
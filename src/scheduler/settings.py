@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from django.conf import settings
+from django.db import models
+
+WORKERS = getattr(settings, 'SCHEDULER_WORKERS', 2)
+POLL_INTERVAL = getattr(settings, 'SCHEDULER_POLL_INTERVAL', 30)
+SHARD_SIZE = getattr(settings, 'SCHEDULER_SHARD_SIZE', 500)
+SHARD_TIMEOUT = getattr(settings, 'SCHEDULER_SHARD_TIMEOUT', 60)
+HEARTBEAT = getattr(settings, 'SCHEDULER_HEARTBEAT', 60)
+
+if 'siteprefs' in settings.INSTALLED_APPS:
+    # Respect those users who doesn't have siteprefs installed.
+    from siteprefs.toolbox import patch_locals, register_prefs, pref
+
+    patch_locals()  # That's bootstrap.
+
+    register_prefs(
+        pref(WORKERS,
+             verbose_name='Number of worker processes executing scheduled '
+                          'actions in the scheduler daemon',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(POLL_INTERVAL,
+             verbose_name='Seconds between two checks for due actions in '
+                          'the scheduler daemon',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(SHARD_SIZE,
+             verbose_name='Maximum number of emails sent by a worker as '
+                          'part of the same shard of a scheduled action',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(SHARD_TIMEOUT,
+             verbose_name='Minutes without news from the worker executing '
+                          'a shard after which it is executed again by '
+                          'another worker',
+             static=False,
+             field=models.IntegerField(blank=True)),
+
+        pref(HEARTBEAT,
+             verbose_name='Seconds between two signals of the workers '
+                          'showing that they are still executing a shard',
+             static=False,
+             field=models.IntegerField(blank=True)),
+    )
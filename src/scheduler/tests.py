@@ -1,6 +1,211 @@
 # -*- coding: utf-8 -*-
-from __future__ import unicode_literals
+from __future__ import unicode_literals, print_function
 
-from django.test import TestCase
+import datetime
+import os
+import threading
 
-# Create your tests here.
+import mock
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+
+import test
+from action.models import Action
+from dataops import pandas_db
+from scheduler import ops, settings as scheduler_settings
+from scheduler.models import ScheduledEmailAction, ScheduledEmailShard
+
+
+class ScheduledEmailBase(test.OntaskTransactionTestCase):
+    fixtures = ['simple_email_action']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'action',
+        'fixtures',
+        'simple_email_action_df.sql'
+    )
+
+    def setUp(self):
+        super(ScheduledEmailBase, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+        self.action = Action.objects.get(name='simple action')
+        self.now = datetime.datetime.now(pytz.timezone(settings.TIME_ZONE))
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(ScheduledEmailBase, self).tearDown()
+
+    def create_scheduled_actions(self, number, **kwargs):
+        """
+        Create pending email actions due ten minutes ago
+        :param number: Number of actions to create
+        :param kwargs: Additional fields of the actions
+        :return: List of ScheduledEmailAction
+        """
+        return [ScheduledEmailAction.objects.create(
+            user=self.action.workflow.user,
+            type='email_send',
+            status=0,
+            execute=self.now - datetime.timedelta(minutes=10),
+            action=self.action,
+            subject='Email subject',
+            email_column=self.action.workflow.columns.get(name='email'),
+            **kwargs) for _ in range(number)]
+
+
+class ClaimEmailActions(ScheduledEmailBase):
+
+    def test_claim_twice(self):
+        items = self.create_scheduled_actions(4)
+
+        first = ops.claim_email_actions(self.now, limit=2)
+        second = ops.claim_email_actions(self.now, limit=2)
+
+        first_ids = set([x for x, _ in first])
+        second_ids = set([x for x, _ in second])
+        self.assertEqual(len(first_ids), 2)
+        self.assertEqual(len(second_ids), 2)
+        self.assertFalse(first_ids & second_ids)
+        self.assertEqual(first_ids | second_ids, set([x.id for x in items]))
+
+        # Each claim has its own owner
+        self.assertEqual(len(set([x for _, x in first + second])), 2)
+        self.assertTrue(all([
+            x.status == 1 for x in ScheduledEmailAction.objects.all()
+        ]))
+
+        # Nothing left to claim
+        self.assertEqual(ops.claim_email_actions(self.now), [])
+
+    def test_claim_skips_locked(self):
+        items = self.create_scheduled_actions(2)
+
+        # Another worker has the first action locked in its claim
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    ScheduledEmailAction.objects.select_for_update().get(
+                        pk=items[0].id
+                    )
+                    locked.set()
+                    release.wait(30)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(30))
+            claimed = ops.claim_email_actions(self.now)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual([x for x, _ in claimed], [items[1].id])
+        self.assertEqual([x for x, _ in ops.claim_email_actions(self.now)],
+                         [items[0].id])
+
+
+class ExecuteEmailShards(ScheduledEmailBase):
+
+    def create_shards(self, **kwargs):
+        """
+        Create and claim a scheduled action, and split it in shards of one
+        row
+        :param kwargs: Additional fields of the action
+        :return: Id of the action
+        """
+        self.create_scheduled_actions(1, **kwargs)
+        [(item_id, owner)] = ops.claim_email_actions(self.now)
+        with mock.patch.object(scheduler_settings, 'SHARD_SIZE', 1):
+            nshards = ops.create_email_shards(
+                ScheduledEmailAction.objects.get(pk=item_id),
+                owner
+            )
+        self.assertEqual(nshards, 3)
+
+        return item_id
+
+    def test_create_shards_after_owner_change(self):
+        self.create_scheduled_actions(1, add_column=True)
+        [(item_id, owner)] = ops.claim_email_actions(self.now)
+        ncols = self.action.workflow.columns.count()
+
+        # The action is claimed again by another worker
+        ScheduledEmailAction.objects.filter(pk=item_id).update(
+            owner='another'
+        )
+
+        item = ScheduledEmailAction.objects.get(pk=item_id)
+        self.assertIsNone(ops.create_email_shards(item, owner))
+        self.assertFalse(item.shards.exists())
+        self.assertEqual(self.action.workflow.columns.count(), ncols)
+
+    def test_resume_after_owner_change(self):
+        item_id = self.create_shards()
+
+        [(shard_id, old_owner)] = ops.claim_email_shards(limit=1)
+
+        # The worker stops sending news and the shard is claimed again
+        ScheduledEmailShard.objects.filter(pk=shard_id).update(
+            heartbeat=self.now - datetime.timedelta(
+                minutes=scheduler_settings.SHARD_TIMEOUT + 1
+            )
+        )
+        [(new_shard_id, new_owner)] = ops.claim_email_shards(limit=1)
+        self.assertEqual(new_shard_id, shard_id)
+        self.assertNotEqual(new_owner, old_owner)
+
+        with mock.patch('scheduler.ops.create_messages', return_value=[]), \
+                mock.patch('scheduler.ops.deliver_messages',
+                           return_value=None), \
+                mock.patch('scheduler.ops.log_messages'):
+            # The previous owner does not execute it
+            self.assertEqual(ops.execute_email_shard(shard_id, old_owner), 1)
+            self.assertEqual(
+                ScheduledEmailAction.objects.get(pk=item_id).nrows_done,
+                0
+            )
+
+            # The new owner executes it and records its progress
+            self.assertEqual(ops.execute_email_shard(shard_id, new_owner), 2)
+
+        item = ScheduledEmailAction.objects.get(pk=item_id)
+        self.assertEqual(item.nrows_done, 1)
+        self.assertEqual(item.status, 1)
+        self.assertEqual(
+            list(item.shards.values_list('status', flat=True)),
+            [2, 0, 0]
+        )
+
+    def test_checkpoint_after_owner_change(self):
+        item_id = self.create_shards()
+
+        [(shard_id, owner)] = ops.claim_email_shards(limit=1)
+
+        def claim_again(*args):
+            # Another worker claims the shard during the execution
+            ScheduledEmailShard.objects.filter(pk=shard_id).update(
+                owner='another'
+            )
+            return []
+
+        with mock.patch('scheduler.ops.create_messages',
+                        side_effect=claim_again), \
+                mock.patch('scheduler.ops.deliver_messages',
+                           return_value=None), \
+                mock.patch('scheduler.ops.log_messages'):
+            ops.execute_email_shard(shard_id, owner)
+
+        # The checkpoint is left to the new owner
+        shard = ScheduledEmailShard.objects.get(pk=shard_id)
+        self.assertEqual(shard.status, 1)
+        self.assertEqual(shard.owner, 'another')
+        self.assertEqual(
+            ScheduledEmailAction.objects.get(pk=item_id).nrows_done,
+            0
+        )
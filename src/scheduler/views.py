@@ -86,6 +86,18 @@ class ScheduleEmailActionTable(tables.Table):
         verbose_name=str('Execution message'),
     )
 
+    progress = tables.Column(
+        attrs={'td': {'class': 'dt-center'}},
+        verbose_name=str('Progress'),
+        orderable=False,
+        empty_values=(),
+    )
+
+    def render_progress(self, record):
+        if not record.nrows_total:
+            return '-'
+        return record.progress()
+
     def render_action(self, record):
         return format_html(
             '<a href="{0}">{1}</a>'.format(
@@ -100,7 +112,7 @@ class ScheduleEmailActionTable(tables.Table):
 
         fields = ('action', 'created', 'execute', 'status', 'subject',
                   'email_column', 'send_confirmation', 'track_read',
-                  'add_column', 'operations', 'message')
+                  'add_column', 'operations', 'message', 'progress')
 
         sequence = ('operations',
                     'action',
@@ -112,7 +124,8 @@ class ScheduleEmailActionTable(tables.Table):
                     'send_confirmation',
                     'track_read',
                     'add_column',
-                    'message')
+                    'message',
+                    'progress')
 
         attrs = {
             'class': 'table display table-bordered',
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Script to maintain the monthly partitions of the log table. It creates
+the partitions for the current and the following month (so that new logs
+never land in the default partition), and archives the partitions older
+than the retention window: they are detached from the table, written to a
+gzipped file with one JSON object per line, recorded in LogArchive and
+dropped. This file is supposed to be executed periodically (for example
+daily) using an application such as crontab or similar."""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import getopt
+import logging
+import os
+import shlex
+import sys
+
+from logs import settings as logs_settings
+from logs.ops import (get_log_partitions,
+                      create_log_partition,
+                      archive_log_partition,
+                      next_month)
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+def archive_logs(retention_months, archive_dir, debug):
+    """
+    Create the upcoming partitions and archive those that are older than
+    the retention window.
+
+    :param retention_months: Number of months to keep in the database
+    :param archive_dir: Folder where the archived partitions are written
+    :param debug: Boolean to show additional messages
+    :return: Number of partitions archived
+    """
+    # Make sure the partitions for this and the next month exist
+    today = datetime.date.today()
+    for month in [today, next_month(today)]:
+        name = create_log_partition(month)
+        if debug:
+            logger.info('Partition ' + name + ' available')
+
+    # First month that is kept in the database
+    limit = today.replace(day=1)
+    for _ in range(retention_months):
+        limit = (limit - datetime.timedelta(days=1)).replace(day=1)
+
+    if not os.path.exists(archive_dir):
+        os.makedirs(archive_dir)
+
+    archived = 0
+    for name, month in get_log_partitions():
+        if month >= limit:
+            break
+
+        archive = archive_log_partition(name, month, archive_dir)
+        logger.info('Archived {0} logs from {1} in {2}'.format(
+            archive.nrows,
+            name,
+            archive.filename)
+        )
+        archived += 1
+
+    return archived
+
+
+def run(*script_args):
+    """
+    Script to create the upcoming partitions of the log table and archive
+    the old ones. Example of its invocation
+
+    python manage.py runscript archive_logs --script-args "-d -r 12"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -r <months> Number of months to keep in the database (default
+               LOGS_RETENTION_MONTHS)
+            -o <folder> Folder to write the archived partitions (default
+               LOGS_ARCHIVE_DIR)
+    :return: Changes reflected in the db
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    retention_months = logs_settings.RETENTION_MONTHS
+    archive_dir = logs_settings.ARCHIVE_DIR
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "dr:o:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        elif optstr == "-r":
+            retention_months = int(value)
+        elif optstr == "-o":
+            archive_dir = value
+
+    if retention_months < 1:
+        print('The retention window must be at least one month.')
+        sys.exit(2)
+
+    if debug:
+        logger.info('Starting execution')
+
+    n_archived = archive_logs(retention_months, archive_dir, debug)
+
+    if debug:
+        logger.info('Finished execution ({0} partitions archived)'.format(
+            n_archived))
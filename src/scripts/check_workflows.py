@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Script to check the consistency between the information stored in the
+workflows and their tables. The complete check loads every table in a data
+frame, so it is meant to be executed only as a maintenance task (the pages
+of the platform use the check over the metadata of the tables)."""
+from __future__ import unicode_literals, print_function
+
+import getopt
+import logging
+import shlex
+import sys
+
+from dataops.pandas_db import check_wf_df
+from workflow.models import Workflow
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+def run(*script_args):
+    """
+    Script to check the workflows. Example of its invocation
+
+    python manage.py runscript check_workflows --script-args "-d -w 3"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -m Check only the metadata of the tables (no data is loaded)
+            -w <id> Check only the workflow with this id
+    :return: Nothing. The inconsistent workflows are printed.
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    deep = True
+    workflow_id = None
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "dmw:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        elif optstr == "-m":
+            deep = False
+        elif optstr == "-w":
+            workflow_id = int(value)
+
+    if debug:
+        logger.info('Starting execution')
+
+    workflows = Workflow.objects.all()
+    if workflow_id is not None:
+        workflows = workflows.filter(pk=workflow_id)
+
+    nerrors = 0
+    for workflow in workflows:
+        if check_wf_df(workflow, deep=deep):
+            continue
+
+        nerrors += 1
+        print('Workflow {0} ({1}) is not consistent with its table'.format(
+            workflow.id,
+            workflow.name))
+
+    if debug:
+        logger.info('Finished execution ({0} inconsistent workflows)'.format(
+            nerrors))
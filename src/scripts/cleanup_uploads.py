@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Script to remove the data of the uploads that were never finished. Each
+upload stores the data in a staging table until the user completes the
+last step. The tables created more than UPLOAD_TABLE_EXPIRY hours ago (and
+those not in the registry of upload tables) are dropped. This file is
+supposed to be executed periodically (for example every hour) using an
+application such as crontab or similar."""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import getopt
+import logging
+import shlex
+import sys
+
+import pytz
+from django.conf import settings as ontask_settings
+
+from dataops import settings as dataops_settings
+from dataops.staging import drop_stale_upload_tables
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+def run(*script_args):
+    """
+    Script to drop the upload tables of the abandoned uploads. Example of its
+    invocation
+
+    python manage.py runscript cleanup_uploads --script-args "-d -e 24"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -e <hours> Age of the upload tables to drop (default
+               DATAOPS_UPLOAD_TABLE_EXPIRY)
+    :return: Changes reflected in the db
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    expiry = dataops_settings.UPLOAD_TABLE_EXPIRY
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "de:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        elif optstr == "-e":
+            expiry = int(value)
+
+    if expiry < 1:
+        print('The expiry time must be at least one hour.')
+        sys.exit(2)
+
+    if debug:
+        logger.info('Starting execution')
+
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
+    dropped = drop_stale_upload_tables(now - datetime.timedelta(hours=expiry))
+
+    for pk in dropped:
+        logger.info('Dropped the upload table of workflow {0}'.format(pk))
+
+    if debug:
+        logger.info('Finished execution ({0} tables dropped)'.format(
+            len(dropped)))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Long running process to execute the operations that have been previously
+scheduled using the web interface. As opposed to scheduler_script (executed
+periodically by crontab), this process starts Django once, polls the database
+for the actions that are due, and executes them in a pool of worker
+processes. Each action is split in shards (ranges of rows) that are sent in
+parallel by the workers. Actions and shards are claimed with SELECT ... FOR
+UPDATE SKIP LOCKED, so several instances of this process can run in
+different nodes without sending the same email twice."""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import getopt
+import logging
+import multiprocessing
+import shlex
+import signal
+import sys
+import time
+
+import pytz
+from django.conf import settings as ontask_settings
+from django.db import connections
+
+from dataops import pandas_db
+from scheduler import settings as scheduler_settings
+from scheduler.ops import (claim_email_actions,
+                           execute_email_action,
+                           claim_email_shards,
+                           execute_email_shard)
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+# Flag set by the signal handler to finish the main loop
+stop_requested = False
+
+
+def request_stop(signum, frame):
+    """
+    Signal handler to finish the daemon once the running actions are done.
+    """
+    global stop_requested
+    stop_requested = True
+
+
+def init_worker():
+    """
+    Initializer of the worker processes. Interruptions are handled by the
+    parent process, which waits for the running actions to finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def release_connections():
+    """
+    Close the connections of this process so that they are not shared with
+    the worker processes forked by the pool. They are re-opened on demand.
+    """
+    connections.close_all()
+    if pandas_db.engine is not None:
+        pandas_db.engine.dispose()
+
+
+def scheduler_loop(workers, poll_interval, debug):
+    """
+    Poll the database for due email actions and execute them in a pool of
+    worker processes until a SIGINT or SIGTERM is received.
+
+    :param workers: Number of worker processes
+    :param poll_interval: Seconds to wait between two polls
+    :param debug: Boolean to show additional messages
+    :return: Number of actions executed
+    """
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    release_connections()
+    pool = multiprocessing.Pool(workers, initializer=init_worker)
+
+    running = []
+    executed = 0
+    while not stop_requested:
+        # Discard the actions that are finished
+        running = [x for x in running if not x.ready()]
+
+        # Wait for a worker to be free
+        free = workers - len(running)
+        if free == 0:
+            time.sleep(1)
+            continue
+
+        # Claim as many shards as free workers, and then actions for the
+        # remaining workers (the shards of the started actions go first)
+        shards = claim_email_shards(free)
+        now = datetime.datetime.now(
+            pytz.timezone(ontask_settings.TIME_ZONE)
+        )
+        items = []
+        if len(shards) < free:
+            items = claim_email_actions(now, free - len(shards))
+        release_connections()
+
+        if shards and debug:
+            logger.info('Claimed shards ' +
+                        ', '.join([str(x) for x, _ in shards]))
+        if items and debug:
+            logger.info('Claimed tasks ' +
+                        ', '.join([str(x) for x, _ in items]))
+
+        for shard_id, owner in shards:
+            running.append(
+                pool.apply_async(execute_email_shard, (shard_id, owner))
+            )
+        for item_id, owner in items:
+            running.append(
+                pool.apply_async(execute_email_action, (item_id, owner))
+            )
+        executed += len(items)
+
+        # Claim again right away if all the workers got something
+        if len(shards) + len(items) == free:
+            continue
+
+        # While some worker is busy, check again shortly (the running
+        # actions create shards that the idle workers can take)
+        time.sleep(1 if running else poll_interval)
+
+    logger.info('Waiting for {0} running tasks to finish'.format(
+        len([x for x in running if not x.ready()])))
+    pool.close()
+    pool.join()
+
+    return executed
+
+
+def run(*script_args):
+    """
+    Script to execute previously scheduled tasks as they become due. Example
+    of its invocation
+
+    python manage.py runscript scheduler_daemon --script-args "-d -w 4"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -w <n> Number of worker processes (default SCHEDULER_WORKERS)
+            -p <seconds> Seconds between two polls (default
+               SCHEDULER_POLL_INTERVAL)
+    :return: Changes reflected in the db
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    workers = scheduler_settings.WORKERS
+    poll_interval = scheduler_settings.POLL_INTERVAL
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "dw:p:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        elif optstr == "-w":
+            workers = int(value)
+        elif optstr == "-p":
+            poll_interval = int(value)
+
+    if workers < 1 or poll_interval < 1:
+        print('The number of workers and poll interval must be positive.')
+        sys.exit(2)
+
+    if debug:
+        logger.info('Starting execution with {0} workers'.format(workers))
+
+    n_executed = scheduler_loop(workers, poll_interval, debug)
+
+    if debug:
+        logger.info('Finished execution ({0} tasks executed)'.format(
+            n_executed))
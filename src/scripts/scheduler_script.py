@@ -17,10 +17,12 @@ import datetime
 import pytz
 from django.conf import settings as ontask_settings
 
-import logs
-from action.ops import send_messages
 from core import settings as core_settings
 from scheduler.models import ScheduledEmailAction
+from scheduler.ops import (claim_email_actions,
+                           execute_email_action,
+                           claim_email_shards,
+                           execute_email_shard)
 
 # Get the logger object
 logger = logging.getLogger(__name__)
@@ -43,23 +45,22 @@ def execute_email_actions(debug):
     # future to reduce latency of execution.
     after = now - datetime.timedelta(minutes=float(minute_step) / 2)
     before = now + datetime.timedelta(minutes=float(minute_step) / 2)
-    # Get all the actions that are with state pending and before the current
-    # date/time
-    s_items = ScheduledEmailAction.objects.filter(
-        type='email_send',
-        status=0,  # Pending
-        execute__lt=before,
-        execute__gt=after
-    )
-    logger.info(str(s_items.count()) + ' actions pending execution')
+    # Claim all the pending actions due before the end of the window. The
+    # claim flags them as running in the database, so overlapping executions
+    # of this script (or the scheduler daemon) do not pick them up again.
+    items = claim_email_actions(before)
+    logger.info(str(len(items)) + ' actions pending execution')
 
     # If the number of tasks to execute is zero, we are done.
-    if s_items.count() == 0:
+    if not items:
         return
 
     # Check if some of the tasks are older than the minute step and flag it
     # as a warning.
-    n_old_items = s_items.filter(execute__lt=after).count()
+    n_old_items = ScheduledEmailAction.objects.filter(
+        id__in=[x for x, _ in items],
+        execute__lt=after
+    ).count()
     if n_old_items != 0:
         logger.warning(
             """{0} tasks pending to execute with a delay longer than
@@ -69,61 +70,25 @@ def execute_email_actions(debug):
             )
         )
 
-    for item in s_items:
+    for item_id, owner in items:
         if debug:
-            logger.info('Starting execution of task ' + str(item.id))
-
-        # Set item to running
-        item.status = 1  # Running
-
-        # Execute an email task that contains:
-        # - action id
-        # - subject
-        # - email column
-        # - send_confirmation
-        # - track_read
-        # - add_column
-        msg = ''
-        try:
-            # Log the event
-            logs.ops.put(item.user,
-                         'schedule_email_execute',
-                         item.action.workflow,
-                         {'action': item.action.name,
-                          'action_id': item.action.id,
-                          'execute': item.execute.isoformat(),
-                          'subject': item.subject,
-                          'email_column': item.email_column.name,
-                          'send_confirmation': item.send_confirmation,
-                          'track_read': item.track_read,
-                          'add_column': item.add_column})
-
-            result = send_messages(item.user,
-                                   item.action,
-                                   item.subject,
-                                   item.email_column.name,
-                                   item.user.email,
-                                   item.send_confirmation,
-                                   item.track_read,
-                                   item.add_column)
-            # If the result has some sort of message, push it to the log
-            if result:
-                msg = 'Incorrect execution message: ' + str(result)
-                logger.error(msg)
-        except Exception as e:
-            msg = 'Error while executing send_messages. Exception message: ' \
-                  + e.message
-            logger.error(msg)
-            item.status = 3  # Done with error
-        else:
-            logger.info('Finished execution of task ' + str(item.id))
-            item.status = 2  # Done.
-
-        # Store the resulting message in the record
-        item.message = msg
-
-        # Save the new status in the DB
-        item.save()
+            logger.info('Starting execution of task ' + str(item_id))
+
+        execute_email_action(item_id, owner)
+
+    # Execute the shards of the actions one at a time (they are claimed one
+    # at a time so that they are not considered abandoned while waiting)
+    while True:
+        shards = claim_email_shards(1)
+        if not shards:
+            break
+
+        shard_id, owner = shards[0]
+        if debug:
+            logger.info('Starting execution of shard ' + str(shard_id))
+
+        execute_email_shard(shard_id, owner)
+
 
 def run(*script_args):
     """
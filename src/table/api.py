@@ -1,21 +1,98 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import copy
+import hashlib
+import json
+
 from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from rest_framework import status
 from rest_framework.exceptions import APIException
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from dataops import pandas_db, ops
+from dataops.formula_evaluation import evaluate_node_sql, get_variables
+from table.parsers import ArrowParser
+from table.renderers import (
+    ArrowRenderer,
+    NDJSONRenderer,
+    stream_table_arrow,
+    stream_table_json,
+    stream_table_ndjson)
 from table.serializers import (
+    DataFrameArrowSerializer,
     DataFramePandasMergeSerializer,
     DataFramePandasSerializer,
     DataFrameJSONSerializer,
     DataFrameJSONMergeSerializer)
 from ontask.permissions import UserIsInstructor
 from workflow.models import Workflow
-from workflow.ops import is_locked, detach_dataframe
+from workflow.ops import is_locked, detach_dataframe, get_workflow_etag
+
+
+def table_etag(request, pk, format=None):
+    """
+    ETag of a representation of the table of a workflow: its data version,
+    and a digest of the format negotiated for the response and the query
+    parameters (columns, filter, order, range, aggregates), so that each
+    representation has its own ETag. The GET requests with a matching
+    If-None-Match header receive a 304 (not modified) response without
+    loading the table.
+    """
+    etag = get_workflow_etag(request, pk)
+    if etag is None:
+        return None
+
+    renderer = getattr(request, 'accepted_renderer', None)
+    representation = [renderer.format if renderer else format,
+                      sorted(request.GET.lists())]
+    return '{0}-{1}'.format(
+        etag,
+        hashlib.md5(json.dumps(representation).encode('utf-8')).hexdigest()
+    )
+
+
+def get_filter(request, workflow):
+    """
+    Condition given in the query parameter filter in JSON, with the format
+    used in the filters of the actions (jQuery QueryBuilder). It is checked
+    (column names, types and translation to SQL) before the query is
+    executed.
+
+    :param request: HTTP request
+    :param workflow: Workflow object
+    :return: Formula of the condition or None if not given
+    """
+    filter_formula = request.query_params.get('filter')
+    if not filter_formula:
+        return None
+
+    try:
+        filter_formula = json.loads(filter_formula)
+    except ValueError:
+        raise APIException('filter must be a condition in JSON')
+    if not isinstance(filter_formula, dict):
+        raise APIException('filter must be a condition in JSON')
+
+    try:
+        filter_variables = get_variables(filter_formula)
+        evaluate_node_sql(copy.deepcopy(filter_formula))
+    except Exception:
+        raise APIException('Incorrect filter')
+
+    column_types = dict(workflow.columns.values_list('name', 'data_type'))
+    wrong_names = [x for x, y in filter_variables if column_types.get(x) != y]
+    if wrong_names:
+        raise APIException('Incorrect columns in the filter: ' +
+                           ', '.join(wrong_names))
+
+    return filter_formula
 
 
 class TableBasicOps(APIView):
@@ -48,6 +125,67 @@ class TableBasicOps(APIView):
 
         return workflow
 
+    def get_query(self, request, workflow, total_order=False):
+        """
+        Selection of the table given in the query parameters of the GET
+        requests, executed in the DB:
+
+        - columns: column to include (repeated for each column, all of them
+          by default)
+        - filter: condition in JSON with the format used in the filters of
+          the actions (jQuery QueryBuilder)
+        - order: column to sort the rows, with the prefix - for descending
+          order (repeated for several columns)
+        - start and length: first row (0 by default) and number of rows (all
+          by default). The rows are also sorted by the key column to have
+          stable ranges.
+
+        :param request: HTTP request
+        :param workflow: Workflow object
+        :param total_order: Sort the rows by the key column even if no range
+        is given (needed to read the selection several times)
+        :return: Dictionary with the parameters of pandas_db.get_table_chunks
+        (column_names, filter_formula, order_by, start and length)
+        """
+        workflow_columns = workflow.get_column_names()
+        column_names = request.query_params.getlist('columns') or \
+            workflow_columns
+
+        filter_formula = get_filter(request, workflow)
+
+        order_by = [(x[1:], True) if x.startswith('-') else (x, False)
+                    for x in request.query_params.getlist('order')]
+
+        wrong_names = [x for x in column_names + [x for x, _ in order_by]
+                       if x not in workflow_columns]
+        if wrong_names:
+            raise APIException('Incorrect column names: ' +
+                               ', '.join(wrong_names))
+
+        try:
+            start = int(request.query_params.get('start', 0))
+            length = request.query_params.get('length')
+            if length is not None:
+                length = int(length)
+        except ValueError:
+            raise APIException('start and length must be integers')
+
+        if start < 0 or (length is not None and length < 0):
+            raise APIException('start and length cannot be negative')
+
+        # Sort the rows by the key column to have stable ranges
+        if total_order or start or length is not None:
+            key_column = workflow.columns.filter(is_key=True).first()
+            if key_column is not None and \
+                    key_column.name not in [x for x, _ in order_by]:
+                order_by.append((key_column.name, False))
+
+        return {'column_names': column_names,
+                'filter_formula': filter_formula,
+                'order_by': order_by,
+                'start': start,
+                'length': length}
+
     def override(self, request, pk, format=None):
         # Try to retrieve the wflow to check for permissions
         self.get_object(pk, user=self.request.user)
@@ -63,12 +201,19 @@ class TableBasicOps(APIView):
                         status=status.HTTP_400_BAD_REQUEST)
 
     # Retrieve
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(condition(etag_func=table_etag))
     def get(self, request, pk, format=None):
         # Try to retrieve the wflow to check for permissions
-        self.get_object(pk, user=self.request.user)
-        serializer = self.serializer_class(
-            {'data_frame': pandas_db.load_from_db(pk)}
-        )
+        workflow = self.get_object(pk, user=self.request.user)
+        if not request.query_params:
+            data_frame = pandas_db.load_from_db(pk)
+        else:
+            data_frame = pandas_db.load_selection_from_db(
+                pk,
+                **self.get_query(request, workflow))
+
+        serializer = self.serializer_class({'data_frame': data_frame})
         return Response(serializer.data)
 
     # Create
@@ -83,6 +228,29 @@ class TableBasicOps(APIView):
     def put(self, request, pk, format=None):
         return self.override(request, pk, format)
 
+    # Partial update
+    def patch(self, request, pk, format=None):
+        # Try to retrieve the wflow to check for permissions
+        workflow = self.get_object(pk, user=self.request.user)
+        if not ops.workflow_has_table(workflow):
+            raise APIException('Patch request requires workflow with a '
+                               'table')
+
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        error, changes = ops.perform_table_upsert(
+            workflow,
+            serializer.validated_data['data_frame'],
+            request.query_params.get('key')
+        )
+        if error:
+            raise APIException(error)
+
+        return Response(changes)
+
     # Delete
     def delete(self, request, pk, format=None):
         wflow = self.get_object(pk, user=self.request.user)
@@ -93,8 +261,14 @@ class TableBasicOps(APIView):
 class TableJSONOps(TableBasicOps):
     """
     get:
-    Get all the data in the table corresponding to the workflow (no matter
-    how big). If the workflow has no data, an empty {} is returned.
+    Get the data in the table corresponding to the workflow. If the workflow
+    has no data, an empty {} is returned. The table is streamed from the DB,
+    either as a JSON object (default) or with format=ndjson (or Accept:
+    application/x-ndjson) as one JSON object per row. Part of the table is
+    selected with the query parameters columns (repeated for each column),
+    filter (condition in JSON as in the action filters), order (column, with
+    the prefix - for descending order, repeated for several columns), start
+    (first row) and length (number of rows).
 
     post:
     Upload a new table to a workflow without. If there is a table already, the
@@ -103,12 +277,41 @@ class TableJSONOps(TableBasicOps):
     put:
     Replace the table currently in the workflow with the one given
 
+    patch:
+    Update the rows of the table with the rows given (matched by the key
+    column in the query parameter key, or the first key column in the data),
+    and insert those with a new key. Only the columns given are modified.
+
     delete:
     Flush the data frame from the workflow. The workflow object remains, just
     the data frame is deleted.
     """
 
     serializer_class = DataFrameJSONSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
+        [NDJSONRenderer]
+
+    # Retrieve
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(condition(etag_func=table_etag))
+    def get(self, request, pk, format=None):
+        # The browsable API receives the serialized data frame
+        if request.accepted_renderer.format == 'api':
+            return super(TableJSONOps, self).get(request, pk, format)
+
+        # Try to retrieve the wflow to check for permissions
+        workflow = self.get_object(pk, user=self.request.user)
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return StreamingHttpResponse(
+                stream_table_ndjson(pk, self.get_query(request, workflow)),
+                content_type=NDJSONRenderer.media_type
+            )
+
+        # The JSON format reads the selection once per column
+        query = self.get_query(request, workflow, total_order=True)
+        return StreamingHttpResponse(stream_table_json(pk, query),
+                                     content_type='application/json')
 
 
 class TablePandasOps(TableBasicOps):
@@ -150,9 +353,10 @@ class TablePandasOps(TableBasicOps):
     These are the methods made available by the API
 
     get:
-    Get all the data in the table corresponding to the workflow (no matter
-    how big) as a Base64 encoded string of the binary data frame. If the
-    workflow has no data, an empty {} is returned.
+    Get the data in the table corresponding to the workflow as a Base64
+    encoded string of the binary data frame. If the workflow has no data, an
+    empty {} is returned. Part of the table is selected with the query
+    parameters columns, filter, order, start and length (as in the JSON API).
 
     post:
     Upload a new table (Base64 encoded of a binary data frame) to a workflow
@@ -162,11 +366,92 @@ class TablePandasOps(TableBasicOps):
     put:
     Replace the table currently in the workflow with the one given Base64
     encoded string of the binary representation of a pandas data frame.
+
+    patch:
+    Update the rows of the table with the rows given (matched by the key
+    column in the query parameter key, or the first key column in the data),
+    and insert those with a new key. Only the columns given are modified.
     """
 
     serializer_class = DataFramePandasSerializer
 
 
+class TableArrowOps(TableBasicOps):
+    """
+    Exchange the table in the Apache Arrow IPC stream format (content type
+    application/vnd.apache.arrow.stream). As with the pandas API, the data
+    types, NaN and NaT are preserved, but the format is binary (no Base64 or
+    JSON) and does not execute code when read (unlike the pickles).
+
+    The code to handle the format in Python is:
+
+    1) From Pandas dataframe to the body of a POST/PUT request:
+
+    import io
+    import pyarrow
+
+    table = pyarrow.Table.from_pandas(data_frame, preserve_index=False)
+    sink = io.BytesIO()
+    writer = pyarrow.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    body = sink.getvalue()
+
+    2) From the body of the GET response to a pandas dataframe
+
+    import pyarrow
+
+    reader = pyarrow.RecordBatchStreamReader(pyarrow.BufferReader(body))
+    data_frame = reader.read_all().to_pandas()
+
+    These are the methods made available by the API
+
+    get:
+    Get the data in the table corresponding to the workflow, streamed from
+    the DB as one record batch per chunk of rows. Part of the table is
+    selected with the query parameters columns, filter, order, start and
+    length (as in the JSON API).
+
+    post:
+    Upload a new table to a workflow without. If there is a table already,
+    the operation will be rejected (consider deleting the table first or use
+    PUT)
+
+    put:
+    Replace the table currently in the workflow with the one given
+
+    patch:
+    Update the rows of the table with the rows given (matched by the key
+    column in the query parameter key, or the first key column in the data),
+    and insert those with a new key. Only the columns given are modified.
+
+    delete:
+    Flush the data frame from the workflow. The workflow object remains, just
+    the data frame is deleted.
+    """
+
+    serializer_class = DataFrameArrowSerializer
+    parser_classes = [ArrowParser]
+    renderer_classes = [ArrowRenderer]
+
+    # Retrieve
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(condition(etag_func=table_etag))
+    def get(self, request, pk, format=None):
+        # Try to retrieve the wflow to check for permissions
+        workflow = self.get_object(pk, user=self.request.user)
+        query = self.get_query(request, workflow)
+
+        column_types = dict(workflow.columns.values_list('name', 'data_type'))
+        return StreamingHttpResponse(
+            stream_table_arrow(pk,
+                               query,
+                               [column_types[x]
+                                for x in query['column_names']]),
+            content_type=ArrowRenderer.media_type
+        )
+
+
 class TableBasicMerge(APIView):
     """
     These are basic merge methods to be invoked by the subclasses
@@ -200,6 +485,8 @@ class TableBasicMerge(APIView):
         return workflow
 
     # Retrieve
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(condition(etag_func=table_etag))
     def get(self, request, pk, format=None):
         # Try to retrieve the wflow to check for permissions
         self.get_object(pk, user=self.request.user)
@@ -380,3 +667,73 @@ class TablePandasMerge(TableBasicMerge):
 
     # To be overwritten by the subclass
     serializer_class = DataFramePandasMergeSerializer
+
+
+class TableAggregate(APIView):
+    """
+    get:
+    Compute aggregates of the table in groups of rows (executed in the DB
+    and kept in the cache until the table changes). The query parameters
+    are group (column to group the rows, repeated for several columns),
+    aggregate (function:column, repeated for several aggregates) and
+    filter (condition in JSON as in the action filters). The functions are
+    count, sum, mean, min, max and pNN for the percentile NN (for example
+    p50 for the median). The aggregate count without a column is the
+    number of rows. The result contains the list of columns (group columns
+    followed by the aggregates) and a list with the values of each group.
+    """
+
+    permission_classes = (UserIsInstructor,)
+
+    def get_object(self, pk, **kwargs):
+        user = kwargs['user']
+        try:
+            if user.is_superuser:
+                workflow = Workflow.objects.get(pk=pk)
+            else:
+                workflow = Workflow.objects.filter(
+                    Q(user=self.request.user) |
+                    Q(shared__id=self.request.user.id)
+                ).distinct().get(id=pk)
+        except Workflow.DoesNotExist:
+            raise APIException('Incorrect object')
+
+        if is_locked(workflow):
+            raise APIException('Workflow is locked by another user')
+
+        return workflow
+
+    # Retrieve
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(condition(etag_func=table_etag))
+    def get(self, request, pk, format=None):
+        # Try to retrieve the wflow to check for permissions
+        workflow = self.get_object(pk, user=self.request.user)
+        if not ops.workflow_has_table(workflow):
+            raise APIException('Aggregate request requires workflow with a '
+                               'table')
+
+        group_by = request.query_params.getlist('group')
+        wrong_names = [x for x in group_by
+                       if x not in workflow.get_column_names()]
+        if wrong_names:
+            raise APIException('Incorrect column names: ' +
+                               ', '.join(wrong_names))
+
+        error, aggregates = ops.parse_aggregates(
+            workflow,
+            request.query_params.getlist('aggregate') or ['count']
+        )
+        if error:
+            raise APIException(error)
+
+        rows = ops.get_table_aggregates(workflow,
+                                        group_by,
+                                        aggregates,
+                                        get_filter(request, workflow))
+
+        return Response({
+            'columns': group_by + [x + ':' + y if y else x
+                                   for x, y in aggregates],
+            'data': [list(x) for x in rows]
+        })
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from table.serializers import arrow_to_df
+
+
+class ArrowParser(BaseParser):
+    """
+    Parser for the bodies with a data frame in the Arrow IPC stream format.
+    The data frame is given to the serializer in the field data_frame.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data_frame = arrow_to_df(stream.read())
+        if data_frame is None:
+            raise ParseError('Unable to read the data frame in Arrow format')
+
+        return {'data_frame': data_frame}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming representations of the table of a workflow for the API. The rows
+are read from the DB with a server-side cursor and written to the response
+as they arrive, so the table is never loaded in memory. Three formats are
+provided:
+
+- JSON with the same shape as DataFrameJSONField:
+  {"data_frame": {column: {row index: value}}}
+
+- NDJSON: one JSON object per row ({column: value}) in each line.
+
+- Arrow IPC stream: binary format with one record batch per chunk of rows
+  that keeps the data types, NaN and NaT (read it with
+  pyarrow.RecordBatchStreamReader(...).read_all().to_pandas()).
+"""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import io
+import json
+import math
+
+import pyarrow as pa
+from django.db import connection, transaction
+from rest_framework.renderers import BaseRenderer
+
+from dataops import pandas_db
+
+# Number of rows fetched from the server-side cursor at a time
+stream_chunk_size = 2000
+
+# Arrow types of the OnTask data types
+arrow_datatypes = {
+    'string': pa.string(),
+    'integer': pa.int64(),
+    'double': pa.float64(),
+    'boolean': pa.bool_(),
+    'datetime': pa.timestamp('us')
+}
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer for the NDJSON format (format=ndjson or Accept:
+    application/x-ndjson). The GET requests with this format stream the
+    table, the rest of the responses are written as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return (json.dumps(data) + '\n').encode('utf-8')
+
+
+class ArrowRenderer(BaseRenderer):
+    """
+    Renderer for the Arrow IPC stream format (format=arrow or Accept:
+    application/vnd.apache.arrow.stream). The GET requests with this format
+    stream the table, the rest of the responses (for example, the errors)
+    are written in JSON.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return json.dumps(data).encode('utf-8')
+
+
+def json_value(value):
+    """
+    JSON text of a value read from the table. Datetimes are written as in
+    pandas to_json with date_format='iso', and NaN as null.
+
+    :param value: Value returned by the cursor
+    :return: String
+    """
+    if isinstance(value, datetime.datetime):
+        return '"{0}.{1:03d}Z"'.format(
+            value.replace(microsecond=0, tzinfo=None).isoformat(),
+            value.microsecond // 1000)
+
+    if isinstance(value, float) and (math.isnan(value) or
+                                     math.isinf(value)):
+        return 'null'
+
+    return json.dumps(value)
+
+
+def stream_table_json(pk, query):
+    """
+    Generator with the table in JSON with the shape of DataFrameJSONField.
+    As the values are grouped by column, the selection is read once per
+    column with a server-side cursor, and the values are written as they
+    arrive. All the reads are done in the same REPEATABLE READ transaction,
+    so they see the same rows, and the order of the rows must be total
+    (for example, ending with the key column) to be the same in all of them.
+
+    :param pk: Workflow primary key
+    :param query: Dictionary with the parameters of get_table_chunks
+    (column_names, filter_formula, order_by, start and length)
+    :return: Generator of byte strings
+    """
+    column_names = query['column_names']
+    start = query.get('start', 0)
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL '
+                               'REPEATABLE READ READ ONLY')
+        yield b'{"data_frame": {'
+        for cidx, cname in enumerate(column_names):
+            yield '{0}{1}: {{'.format(', ' if cidx else '',
+                                      json.dumps(cname)).encode('utf-8')
+            idx = start
+            column_query = dict(query, column_names=[cname])
+            for rows in pandas_db.get_table_chunks(
+                    pk,
+                    chunk_size=stream_chunk_size,
+                    **column_query):
+                yield ''.join(
+                    ['{0}"{1}": {2}'.format(', ' if idx + ridx != start
+                                            else '',
+                                            idx + ridx,
+                                            json_value(row[0]))
+                     for ridx, row in enumerate(rows)]
+                ).encode('utf-8')
+                idx += len(rows)
+            yield b'}'
+        yield b'}}'
+
+
+def stream_table_ndjson(pk, query):
+    """
+    Generator with the table in NDJSON (one object per row)
+
+    :param pk: Workflow primary key
+    :param query: Dictionary with the parameters of get_table_chunks
+    :return: Generator of byte strings (one per chunk of rows)
+    """
+    keys = [json.dumps(x) for x in query['column_names']]
+    for rows in pandas_db.get_table_chunks(pk,
+                                           chunk_size=stream_chunk_size,
+                                           **query):
+        yield ''.join(
+            ['{' + ', '.join([key + ': ' + json_value(value)
+                              for key, value in zip(keys, row)]) + '}\n'
+             for row in rows]
+        ).encode('utf-8')
+
+
+def take_bytes(sink):
+    """
+    Extract the bytes written so far in a BytesIO object and empty it
+    :param sink: BytesIO object
+    :return: Bytes
+    """
+    result = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return result
+
+
+def stream_table_arrow(pk, query, column_types):
+    """
+    Generator with the table in the Arrow IPC stream format (one record
+    batch per chunk of rows read from the DB)
+
+    :param pk: Workflow primary key
+    :param query: Dictionary with the parameters of get_table_chunks
+    :param column_types: OnTask data types of the selected columns
+    :return: Generator of byte strings
+    """
+    column_names = query['column_names']
+    types = [arrow_datatypes[x] for x in column_types]
+    schema = pa.schema([pa.field(x, y) for x, y in zip(column_names, types)])
+
+    sink = io.BytesIO()
+    writer = pa.RecordBatchStreamWriter(sink, schema)
+    for rows in pandas_db.get_table_chunks(pk,
+                                           chunk_size=stream_chunk_size,
+                                           **query):
+        values = list(zip(*rows))
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(list(x), type=y) for x, y in zip(values, types)],
+            column_names
+        ))
+        yield take_bytes(sink)
+
+    writer.close()
+    yield take_bytes(sink)
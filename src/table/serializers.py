@@ -3,9 +3,11 @@ from __future__ import unicode_literals, print_function
 
 import StringIO
 import base64
+import io
 import json
 
 import pandas as pd
+import pyarrow as pa
 from rest_framework import serializers
 
 from action.serializers import ColumnNameSerializer
@@ -39,6 +41,34 @@ def string_to_df(value):
     return result
 
 
+def df_to_arrow(df):
+    """
+    :param df: Pandas dataframe
+    :return: Bytes with the data frame in the Arrow IPC stream format (keeps
+    the data types, NaN and NaT)
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue()
+
+
+def arrow_to_df(value):
+    """
+    :param value: Bytes with a data frame in the Arrow IPC stream format
+    :return: The encoded dataframe (None if it cannot be read)
+    """
+    try:
+        reader = pa.RecordBatchStreamReader(pa.BufferReader(value))
+        result = reader.read_all().to_pandas()
+    except Exception:
+        return None
+
+    return result
+
+
 class DataFrameJSONField(serializers.Field):
     def to_representation(self, instance):
         # GET
@@ -84,6 +114,46 @@ class DataFramePandasSerializer(serializers.Serializer):
     )
 
 
+class DataFrameArrowField(serializers.Field):
+    """
+    Data frame in the Arrow IPC stream format. In JSON it is a Base64 encoded
+    string, and the binary requests to the API (parsed by ArrowParser)
+    provide the data frame directly. The Base64 encoded pickles of the
+    previous versions are only accepted if the serializer context has
+    allow_pickle set (reading a pickle executes code, so this is only for
+    trusted files).
+    """
+
+    def to_representation(self, instance):
+        # GET
+        return base64.b64encode(df_to_arrow(instance))
+
+    def to_internal_value(self, data):
+        if isinstance(data, pd.DataFrame):
+            return data
+
+        try:
+            value = base64.b64decode(data)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError('Unable to create data frame')
+
+        result = arrow_to_df(value)
+        if result is None and self.context.get('allow_pickle', False):
+            result = string_to_df(data)
+
+        if result is None:
+            raise serializers.ValidationError('Unable to create data frame')
+
+        return result
+
+
+class DataFrameArrowSerializer(serializers.Serializer):
+    data_frame = DataFrameArrowField(
+        help_text='Data frame in the Arrow IPC stream format (Base64 '
+                  'encoded if sent within JSON)'
+    )
+
+
 class DataFrameBasicMergeSerializer(serializers.Serializer):
     how = serializers.CharField(
         required=True,
@@ -4,17 +4,79 @@ Implementation of views providing visualisation and stats
 """
 from __future__ import unicode_literals, print_function
 
+import hashlib
+import json
+
+import pandas as pd
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import redirect, render
+from django.utils.html import format_html
+from django.views.decorators.http import condition
 
-from dataops import pandas_db
+from dataops import pandas_db, ops
 from ontask.permissions import is_instructor
 from table.models import View
-from visualizations.plotly import PlotlyBoxPlot, PlotlyColumnHistogram
+from visualizations.plotly import (PlotlyBoxPlot,
+                                   PlotlyColumnHistogram,
+                                   PlotlyGroupedBarChart)
+
+from workflow.models import Column, Workflow
+from workflow.ops import get_workflow, get_workflow_etag
+
+
+def stat_etag(request, pk=None, view_id=None):
+    """
+    ETag of the stat pages: the data version of the workflow in the session,
+    the page (column or view) and a digest of the metadata used to render
+    it, which changes without a new data version (the columns with their
+    categories, used to group the rows, and the columns of the view). It is
+    only computed once the workflow, the column and the view are known to
+    be accessible; otherwise there is no ETag and the view decides what to
+    do.
+    """
+    etag = get_workflow_etag(request)
+    if etag is None:
+        return None
+
+    # Only if the workflow is locked by this session (otherwise get_workflow
+    # decides if it can be accessed)
+    wid = request.session.get('ontask_workflow_id')
+    if not Workflow.objects.filter(
+            id=wid,
+            session_key=request.session.session_key).exists():
+        return None
+
+    metadata = [list(Column.objects.filter(workflow__id=wid).order_by(
+        'id'
+    ).values_list('id', 'name', 'data_type', 'is_key', 'categories'))]
+
+    if pk is not None:
+        if not Column.objects.filter(pk=pk, workflow__id=wid).exists():
+            return None
+        metadata.append(['column', pk])
+
+    if view_id is not None:
+        if not View.objects.filter(pk=view_id, workflow__id=wid).exists():
+            return None
+        view_columns = list(Column.objects.filter(
+            views__id=view_id
+        ).order_by('id').values_list('id', flat=True))
+        metadata.append(['view', view_id, view_columns])
+
+    return '{0}-{1}'.format(
+        etag,
+        hashlib.md5(json.dumps(metadata, default=str).encode('utf-8')
+                    ).hexdigest()
+    )
+
+
+def stat_view_etag(request, pk):
+    """
+    ETag of the stat page of a row in a view (see stat_etag)
+    """
+    return stat_etag(request, view_id=pk)
 
-from workflow.models import Column
-from workflow.ops import get_workflow
 
 def get_column_visualisations(column, data_frame, vis_scripts,
                               id='', single_val=None, context={}):
@@ -64,6 +126,45 @@ def get_column_visualisations(column, data_frame, vis_scripts,
 
     return visualizations
 
+
+def get_grouped_visualisations(workflow, column, vis_scripts):
+    """
+    Given a numeric column, create a bar chart with its mean and median in
+    the groups of rows defined by each of the columns with categories. The
+    aggregates are computed in the DB (and cached until the table changes).
+    :param workflow: Workflow object
+    :param column: Column element to visualize
+    :param vis_scripts: Collection of visualisation scripts needed in HTML
+    :return: List of visualizations
+    """
+    if column.data_type != 'integer' and column.data_type != 'double':
+        return []
+
+    visualizations = []
+    for group_column in workflow.columns.all():
+        if not group_column.categories or group_column == column:
+            continue
+
+        rows = ops.get_table_aggregates(workflow,
+                                        [group_column.name],
+                                        [('mean', column.name),
+                                         ('p50', column.name)])
+        data_frame = pd.DataFrame([list(x[1:]) for x in rows],
+                                  index=[x[0] for x in rows],
+                                  columns=['Mean', 'Median'])
+
+        vis = PlotlyGroupedBarChart(
+            data=data_frame,
+            context={'id': 'barchart-{0}'.format(group_column.id),
+                     'title': format_html('<h4>By {0}</h4>',
+                                          group_column.name)}
+        )
+        vis.get_engine_scripts(vis_scripts)
+        visualizations.append(vis)
+
+    return visualizations
+
+
 def get_row_visualisations(request, view_id=None):
 
     # If there is no workflow object, go back to the index
@@ -91,7 +192,7 @@ def get_row_visualisations(request, view_id=None):
     # If a view is given, filter the columns.
     if view_id:
         try:
-            view = View.objects.get(pk=view_id)
+            view = View.objects.get(pk=view_id, workflow=workflow)
         except ObjectDoesNotExist:
             # View not found. Redirect to workflow detail
             return redirect('workflow:detail', workflow.id)
@@ -99,7 +200,7 @@ def get_row_visualisations(request, view_id=None):
         column_names = [c.name for c in columns_to_view]
     else:
         columns_to_view = workflow.columns.all()
-        column_names = None
+        column_names = [c.name for c in columns_to_view]
 
     # Get the rows from the table
     row = pandas_db.execute_select_on_table(workflow.id,
@@ -144,6 +245,7 @@ def get_row_visualisations(request, view_id=None):
 
 
 @user_passes_test(is_instructor)
+@condition(etag_func=stat_etag)
 def stat_column(request, pk):
     """
     Render the page with stats and visualizations for the given column
@@ -175,6 +277,9 @@ def stat_column(request, pk):
 
     vis_scripts = []
     visualizations = get_column_visualisations(column, df, vis_scripts)
+    visualizations += get_grouped_visualisations(workflow,
+                                                 column,
+                                                 vis_scripts)
 
     return render(request,
                   'table/stat_column.html',
@@ -186,6 +291,7 @@ def stat_column(request, pk):
 
 
 @user_passes_test(is_instructor)
+@condition(etag_func=stat_etag)
 def stat_row(request):
     """
     Render the page with stats and visualizations for a row in the table.
@@ -200,6 +306,7 @@ def stat_row(request):
 
 
 @user_passes_test(is_instructor)
+@condition(etag_func=stat_view_etag)
 def stat_row_view(request, pk):
     """
     Render the page with stats and visualizations for a row in the table and
@@ -74,8 +74,10 @@ class TableApiCreate(TableApiBase):
         response = self.client.get(reverse('table:api_ops',
                                            kwargs={'pk': workflow.id}))
 
-        # Transform the response into a data frame
-        r_df = pd.DataFrame(response.data['data_frame'])
+        # Transform the response (streamed) into a data frame
+        r_df = pd.DataFrame(
+            json.loads(b''.join(response.streaming_content))['data_frame']
+        )
         r_df = ops.detect_datetime_columns(r_df)
 
         # Load the df from the db
@@ -84,6 +86,60 @@ class TableApiCreate(TableApiBase):
         # Compare both elements
         self.compare_tables(r_df, df)
 
+    # Getting part of the table in NDJSON
+    def test_table_JSON_get_ndjson(self):
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.all()[0]
+        key = workflow.columns.filter(is_key=True).first().name
+
+        # Two columns of the first two rows (sorted by the key)
+        response = self.client.get(
+            reverse('table:api_ops', kwargs={'pk': workflow.id}),
+            {'format': 'ndjson',
+             'columns': [key, 'email'],
+             'start': 0,
+             'length': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        rows = [json.loads(x) for x in
+                b''.join(response.streaming_content).decode(
+                    'utf-8').splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(set(rows[0].keys()), {key, 'email'})
+
+        df = pandas_db.load_from_db(workflow.id).sort_values(key)
+        self.assertEqual([x[key] for x in rows], list(df[key][:2]))
+
+        # Rows filtered and sorted in descending order
+        response = self.client.get(
+            reverse('table:api_ops', kwargs={'pk': workflow.id}),
+            {'format': 'ndjson',
+             'columns': ['sid'],
+             'filter': json.dumps({
+                 'condition': 'AND',
+                 'rules': [{'id': 'age',
+                            'field': 'age',
+                            'type': 'double',
+                            'input': 'number',
+                            'operator': 'greater',
+                            'value': '12.05'}],
+                 'valid': True}),
+             'order': '-sid'}
+        )
+        rows = [json.loads(x) for x in
+                b''.join(response.streaming_content).decode(
+                    'utf-8').splitlines()]
+        self.assertEqual(rows, [{'sid': 3}, {'sid': 2}])
+
+        # Incorrect column names are rejected
+        response = self.client.get(
+            reverse('table:api_ops', kwargs={'pk': workflow.id}),
+            {'format': 'ndjson', 'columns': ['bogus']}
+        )
+        self.assertEqual(response.status_code, 500)
+
     # Getting the table attached to the workflow
     def test_table_pandas_get(self):
         # Get the only workflow in the fixture
@@ -102,6 +158,28 @@ class TableApiCreate(TableApiBase):
         # Compare both elements
         self.compare_tables(r_df, df)
 
+    # Getting the table attached to the workflow in Arrow format
+    def test_table_arrow_get(self):
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.all()[0]
+
+        # Get the data through the API
+        response = self.client.get(reverse('table:api_aops',
+                                           kwargs={'pk': workflow.id}))
+        self.assertEqual(response['Content-Type'],
+                         'application/vnd.apache.arrow.stream')
+
+        # Transform the response (streamed) into a data frame
+        r_df = serializers.arrow_to_df(b''.join(response.streaming_content))
+
+        # Load the df from the db
+        df = pandas_db.load_from_db(workflow.id)
+
+        # Compare both elements (including the data types)
+        self.compare_tables(r_df, df)
+        for cname in list(df.columns):
+            self.assertEqual(r_df[cname].dtype, df[cname].dtype)
+
     def test_table_try_JSON_overwrite(self):
         # Upload a table and try to overwrite an existing one (should fail)
 
@@ -197,6 +275,144 @@ class TableApiCreate(TableApiBase):
         workflow = Workflow.objects.get(pk=workflow.id)
         self.assertTrue(pandas_db.check_wf_df(workflow))
 
+    def test_table_arrow_create(self):
+        # Create a second workflow
+        response = self.client.post(reverse('workflow:api_workflows'),
+                                    {'name': test.wflow_name + '2',
+                                     'attributes': {'one': 'two'}},
+                                    format='json')
+
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.get(pk=response.data['id'])
+
+        # Transform new table into a data frame
+        r_df = pd.DataFrame(self.new_table)
+        r_df = ops.detect_datetime_columns(r_df)
+
+        # Upload the table in the body of the request
+        response = self.client.post(
+            reverse('table:api_aops',
+                    kwargs={'pk': workflow.id}),
+            serializers.df_to_arrow(r_df),
+            content_type='application/vnd.apache.arrow.stream')
+        self.assertEqual(response.status_code, 201)
+
+        # Load the df from the db
+        df = pandas_db.load_from_db(workflow.id)
+
+        # Compare both elements
+        self.compare_tables(r_df, df)
+
+        # Refresh wflow (has been updated) and check that the rest of the
+        # information is correct
+        workflow = Workflow.objects.get(pk=workflow.id)
+        self.assertTrue(pandas_db.check_wf_df(workflow))
+
+    def test_table_JSON_get_etag(self):
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.all()[0]
+
+        # The first response includes the version of the data
+        response = self.client.get(reverse('table:api_ops',
+                                           kwargs={'pk': workflow.id}))
+        etag = response['ETag']
+
+        # The table did not change
+        response = self.client.get(reverse('table:api_ops',
+                                           kwargs={'pk': workflow.id}),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept', response['Vary'])
+
+        # Other representations of the same table have their own ETag
+        response = self.client.get(reverse('table:api_ops',
+                                           kwargs={'pk': workflow.id}),
+                                   {'format': 'ndjson'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.get(reverse('table:api_ops',
+                                           kwargs={'pk': workflow.id}),
+                                   {'columns': 'sid'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Upload a new table
+        self.client.put(
+            reverse('table:api_ops',
+                    kwargs={'pk': workflow.id}),
+            {'data_frame': self.new_table},
+            format='json')
+
+        # The table is sent again with a new version
+        response = self.client.get(reverse('table:api_ops',
+                                           kwargs={'pk': workflow.id}),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_table_JSON_patch(self):
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.all()[0]
+        data_version = workflow.data_version
+
+        # One row is updated and another one inserted
+        response = self.client.patch(
+            reverse('table:api_ops', kwargs={'pk': workflow.id}) +
+            '?key=sid',
+            {'data_frame': {'sid': [2, 4],
+                            'name': ['Changed Name', 'New Student']}},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data,
+                         {'rows_updated': 1, 'rows_inserted': 1})
+
+        # Check the values in the table
+        df = pandas_db.load_from_db(workflow.id).set_index('sid')
+        self.assertEqual(df.loc[2, 'name'], 'Changed Name')
+        self.assertEqual(df.loc[4, 'name'], 'New Student')
+        self.assertEqual(df.loc[1, 'name'], 'Carmelo Coton')
+
+        # The workflow information is updated
+        workflow = Workflow.objects.get(pk=workflow.id)
+        self.assertEqual(workflow.nrows, 4)
+        self.assertEqual(workflow.data_version, data_version + 1)
+        self.assertTrue(pandas_db.check_wf_df(workflow))
+
+        # Values of an incorrect type are rejected
+        response = self.client.patch(
+            reverse('table:api_ops', kwargs={'pk': workflow.id}),
+            {'data_frame': {'sid': [1], 'age': ['text']}},
+            format='json')
+        self.assertIn('are not of type double', response.data['detail'])
+
+    def test_table_aggregate(self):
+        # Get the only workflow in the fixture
+        workflow = Workflow.objects.all()[0]
+
+        # Number of rows and mean of a column in two groups
+        response = self.client.get(
+            reverse('table:api_aggregate', kwargs={'pk': workflow.id}),
+            {'group': 'registered',
+             'aggregate': ['count', 'mean:age', 'max:age']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['columns'],
+                         ['registered', 'count', 'mean:age', 'max:age'])
+
+        data = response.data['data']
+        self.assertEqual([x[:2] for x in data], [[False, 1], [True, 2]])
+        self.assertAlmostEqual(data[0][2], 12.1)
+        self.assertAlmostEqual(data[1][2], 12.6)
+        self.assertAlmostEqual(data[1][3], 13.2)
+
+        # Functions that cannot be applied to the column
+        response = self.client.get(
+            reverse('table:api_aggregate', kwargs={'pk': workflow.id}),
+            {'aggregate': 'mean:email'})
+        self.assertIn('requires a numeric column', response.data['detail'])
+
     def test_table_JSON_update(self):
         # Get the only workflow in the fixture
         workflow = Workflow.objects.all()[0]
@@ -26,6 +26,13 @@ urlpatterns = [
     url(r'^(?P<pk>\d+)/pmerge/$', api.TablePandasMerge.as_view(),
         name="api_pmerge"),
 
+    # ARROW
+    url(r'^(?P<pk>\d+)/aops/$', api.TableArrowOps.as_view(), name="api_aops"),
+
+    # AGGREGATES
+    url(r'^(?P<pk>\d+)/aggregate/$', api.TableAggregate.as_view(),
+        name="api_aggregate"),
+
     #
     # Display
     #
@@ -13,6 +13,7 @@ from django.db.models import Q
 from django.http import JsonResponse
 from django.shortcuts import redirect, reverse, render
 from django.template.loader import render_to_string
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
@@ -233,7 +234,12 @@ def render_table_display_data(request, workflow, columns, formula,
         'data': final_qs
     }
 
-    return JsonResponse(data)
+    # The version of the data is included so that the page can detect the
+    # changes (DataTables uses POST, so the responses are not cached)
+    response = JsonResponse(data)
+    response['ETag'] = quote_etag('{0}-{1}'.format(workflow.id,
+                                                   workflow.data_version))
+    return response
 
 
 @user_passes_test(is_instructor)
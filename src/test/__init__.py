@@ -8,7 +8,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import reverse
-from django.test import TestCase, LiveServerTestCase
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITransactionTestCase
 from selenium import webdriver
@@ -83,6 +83,14 @@ class OntaskTestCase(TestCase):
         super(OntaskTestCase, cls).tearDownClass()
 
 
+class OntaskTransactionTestCase(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        # Close the db_engine
+        pandas_db.destroy_db_engine(pandas_db.engine)
+        super(OntaskTransactionTestCase, cls).tearDownClass()
+
+
 class OntaskApiTestCase(APITransactionTestCase):
     @classmethod
     def tearDownClass(cls):
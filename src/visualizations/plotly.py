@@ -6,6 +6,8 @@ from __future__ import unicode_literals, print_function
 
 import json
 
+import pandas as pd
+
 from dataops import pandas_db
 from . import VisHandler
 
@@ -190,6 +192,53 @@ class PlotlyColumnHistogram(PlotlyHandler):
         return self.format_dict['id']
 
 
+class PlotlyGroupedBarChart(PlotlyHandler):
+    """
+    Create a bar chart with aggregates computed in groups of rows. The data
+    frame has one row per group (the index contains the group labels) and
+    one column per aggregate (one series of bars each).
+    """
+
+    def __init__(self, data, *args, **kwargs):
+
+        super(PlotlyGroupedBarChart, self).__init__(data, *args, **kwargs)
+
+        self.format_dict['id'] = 'barchart-id'
+
+        self.layout.update({'barmode': 'group'})
+
+        # Transfer the keys to the formatting dictionary
+        for key, value in kwargs.pop('context', {}).items():
+            self.format_dict[key] = value
+
+        labels = ['{0}'.format(x) for x in self.data.index]
+        data = []
+        for column in self.data.columns:
+            data.append(
+                {'x': labels,
+                 'y': [None if pd.isnull(x) else x
+                       for x in self.data[column].tolist()],
+                 'name': column,
+                 'type': 'bar'}
+            )
+
+        self.format_dict['data'] = json.dumps(data)
+        self.format_dict['layout'] = json.dumps(self.layout)
+
+        self.html_content = ''
+        if self.format_dict.get('title', None):
+            self.html_content = self.format_dict['title']
+
+        self.html_content += self.html_skel.format(**self.format_dict)
+
+    def get_id(self):
+        """
+        Return the name of this handler
+        :return: string with the name
+        """
+        return self.format_dict['id']
+
+
 class PlotlyGauge(PlotlyHandler):
     """
     Create a gauge pointing to a value
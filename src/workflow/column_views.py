@@ -4,7 +4,7 @@ from __future__ import unicode_literals, print_function
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from django.urls import reverse
@@ -20,7 +20,8 @@ from .models import Column
 from .ops import get_workflow, workflow_delete_column, clone_column
 
 # These are the column operands offered through the GUI. They have immediate
-# translations onto Pandas operators over dataframes.
+# translations onto Pandas operators over dataframes (computed in the DB with
+# pandas_db.formula_column_expression).
 # Each tuple has:
 # - Pandas operation name
 # - Textual description
@@ -38,6 +39,9 @@ formula_column_operands = [
      ['boolean']),
     ('any', 'any: True when any element in selected columns is true',
      ['boolean']),
+    ('expression', 'expression: Arithmetic or Boolean expression with the '
+                   'columns',
+     ['integer', 'double', 'boolean', 'string', 'datetime']),
 ]
 
 
@@ -85,17 +89,8 @@ def column_add(request):
     column.is_key = False
     column.save()
 
-    # Update the data frame, which must be stored in the form because
-    # it was loaded when validating it.
-    df = pandas_db.load_from_db(workflow.id)
-
-    # Add the column with the initial value
-    df = ops.data_frame_add_empty_column(df,
-                                         column.name,
-                                         column.data_type,
-                                         column_initial_value)
-    # Store the df to DB
-    ops.store_dataframe_in_db(df, workflow.id)
+    # Add the column with the initial value to the table in the DB
+    ops.add_column_to_workflow(workflow, column, column_initial_value)
 
     # Log the event
     logs.ops.put(request.user,
@@ -136,7 +131,7 @@ def formula_column_add(request):
     form = FormulaColumnAddForm(
         data=request.POST or None,
         operands=formula_column_operands,
-        columns=workflow.columns.all()
+        columns=workflow.columns.filter(is_virtual=False)
     )
 
     # If a GET or incorrect request, render the form again
@@ -169,35 +164,48 @@ def formula_column_add(request):
         )
         return JsonResponse(data)
 
-    # Update the data frame
-    df = pandas_db.load_from_db(workflow.id)
+    # Type of the result of the operation (as in pandas)
+    operation = form.cleaned_data['op_type']
+    if operation == 'expression':
+        column.data_type = form.compiled_expression['data_type']
+        # Keep the expression to compute the column again
+        column.formula = form.cleaned_data['expression']
+    elif operation in ['all', 'any']:
+        column.data_type = 'boolean'
+    elif operation in ['sum', 'prod', 'max', 'min'] and \
+            all([c.data_type == 'integer' for c in form.selected_columns]):
+        column.data_type = 'integer'
+    else:
+        column.data_type = 'double'
 
     try:
-        # Add the column with the appropriate computation
-        operation = form.cleaned_data['op_type']
-        cnames = [c.name for c in form.selected_columns]
-        if operation == 'sum':
-            df[column.name] = df[cnames].sum(axis=1)
-        elif operation == 'prod':
-            df[column.name] = df[cnames].prod(axis=1)
-        elif operation == 'max':
-            df[column.name] = df[cnames].max(axis=1)
-        elif operation == 'min':
-            df[column.name] = df[cnames].min(axis=1)
-        elif operation == 'mean':
-            df[column.name] = df[cnames].mean(axis=1)
-        elif operation == 'median':
-            df[column.name] = df[cnames].median(axis=1)
-        elif operation == 'std':
-            df[column.name] = df[cnames].std(axis=1)
-        elif operation == 'all':
-            df[column.name] = df[cnames].all(axis=1)
-        elif operation == 'any':
-            df[column.name] = df[cnames].any(axis=1)
-        else:
-            raise Exception('Operand ' + operation + ' not implemented')
+        # Add the column with the appropriate computation in the DB (the
+        # virtual columns are computed when the table is read, the table
+        # does not change)
+        with transaction.atomic():
+            if column.is_virtual:
+                pandas_db.increase_data_version(workflow.id)
+            elif operation == 'expression':
+                pandas_db.add_column_to_db(workflow.id,
+                                           column.name,
+                                           column.data_type)
+                pandas_db.update_column_in_db(
+                    workflow.id,
+                    column.name,
+                    form.compiled_expression['sql'],
+                    form.compiled_expression['params'])
+            else:
+                pandas_db.add_column_to_db(workflow.id,
+                                           column.name,
+                                           column.data_type)
+                pandas_db.update_column_in_db(
+                    workflow.id,
+                    column.name,
+                    pandas_db.formula_column_expression(
+                        operation,
+                        [c.name for c in form.selected_columns]))
     except Exception as e:
-        # Something went wrong in pandas, we need to remove the column
+        # Something went wrong in the DB, we need to remove the column
         column.delete()
 
         # Notify in the form
@@ -212,13 +220,9 @@ def formula_column_add(request):
         )
         return JsonResponse(data)
 
-    # Populate the column type
-    column.data_type = \
-        pandas_db.pandas_datatype_names[df[column.name].dtype.name]
+    # Store the column type
     column.save()
-
-    # Store the df to DB
-    ops.store_dataframe_in_db(df, workflow.id)
+    ops.workflow_columns_changed(workflow)
 
     # Log the event
     logs.ops.put(request.user,
@@ -284,17 +288,9 @@ def column_edit(request, pk):
         # no commit as we need to propagate the info to the df
         column = form.save(commit=False)
 
-        # Get the data frame from the form (should be
-        # loaded)
-        df = form.data_frame
-
-        # If there is a new name, rename the data frame columns
+        # If there is a new name, rename the column in the table
         if 'name' in form.changed_data:
-            # Rename the column in the data frame
-            df = ops.rename_df_column(df,
-                                      workflow,
-                                      old_name,
-                                      column.name)
+            ops.rename_column_in_workflow(workflow, old_name, column.name)
 
         # Save the column information
         form.save()
@@ -305,9 +301,6 @@ def column_edit(request, pk):
         # Save the workflow
         workflow.save()
 
-        # And save the DF in the DB
-        ops.store_dataframe_in_db(df, workflow.id)
-
     data['form_is_valid'] = True
     data['html_redirect'] = ''
 
@@ -368,6 +361,20 @@ def column_delete(request, pk):
                                         kwargs={'pk': workflow.id})
         return JsonResponse(data)
 
+    # The columns used in the formula of other columns cannot be deleted
+    formula_columns = [
+        x.name for x in workflow.columns.exclude(formula='').exclude(pk=pk)
+        if column.name in ops.get_formula_column_names(workflow, x)
+    ]
+    if formula_columns:
+        messages.error(request,
+                       'You cannot delete a column used in the formula of '
+                       'column(s) ' + ', '.join(formula_columns))
+        data['form_is_valid'] = True
+        data['html_redirect'] = reverse('workflow:detail',
+                                        kwargs={'pk': workflow.id})
+        return JsonResponse(data)
+
     # Get the name of the column to delete
     context['cname'] = column.name
 
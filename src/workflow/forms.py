@@ -3,13 +3,12 @@ from __future__ import unicode_literals, print_function
 
 import json
 
-import pandas as pd
 from datetimewidget.widgets import DateTimeWidget
 from django import forms
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
 
-from dataops import pandas_db, ops
+from dataops import pandas_db, ops, sql_expression
 from ontask import ontask_prefs, is_legal_name
 from ontask.forms import RestrictedFileField, dateTimeOptions
 from .models import Workflow, Column
@@ -112,7 +111,6 @@ class ColumnBasicForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
 
         self.workflow = kwargs.pop('workflow', None)
-        self.data_frame = None
 
         super(ColumnBasicForm, self).__init__(*args, **kwargs)
 
@@ -122,10 +120,6 @@ class ColumnBasicForm(forms.ModelForm):
     def clean(self):
         data = super(ColumnBasicForm, self).clean()
 
-        # Load the data frame from the DB for various checks and leave it in
-        # the form for future use
-        self.data_frame = pandas_db.load_from_db(self.workflow.id)
-
         # Column name must be a legal variable name
         if 'name' in self.changed_data:
             # Name is legal
@@ -162,12 +156,17 @@ class ColumnBasicForm(forms.ModelForm):
                     )
                     return data
 
-                # Condition 2: The values in the dataframe column must be in
-                # these categories (only if the column is being edited, though
+                # Condition 2: The values in the table column must be in
+                # these categories (only if the column is being edited,
+                # though). The empty values of the type are also allowed.
+                allowed_values = valid_values + \
+                    [x for x in [ops.get_empty_value(data['data_type'])]
+                     if x is not None]
                 if self.instance.name and \
-                        not all([x in valid_values
-                                 for x in self.data_frame[self.instance.name]
-                                 if x and not pd.isnull(x)]):
+                        not pandas_db.are_column_values_within(
+                            self.workflow.id,
+                            self.instance.name,
+                            allowed_values):
                     self.add_error(
                         'raw_categories',
                         'The values in the column are not compatible with ' +
@@ -273,8 +272,8 @@ class ColumnRenameForm(ColumnBasicForm):
 
             # Case 2: False -> True Unique values must be verified
             if not self.instance.is_key and \
-                    not ops.is_unique_column(self.data_frame[
-                                                 self.instance.name]):
+                    not pandas_db.is_column_unique(self.workflow.id,
+                                                   self.instance.name):
                 self.add_error(
                     'is_key',
                     'The column does not have unique values for each row.'
@@ -299,6 +298,23 @@ class FormulaColumnAddForm(forms.ModelForm):
         required=True,
         label='Operation')
 
+    # Expression (for the operation expression)
+    expression = forms.CharField(
+        max_length=1024,
+        strip=True,
+        required=False,
+        label='Expression',
+        help_text='Only for the operation expression. Example: '
+                  '0.4 * Quiz + 0.6 * Exam')
+
+    # Formula columns with an expression may be computed when the table is
+    # read (the values are not stored)
+    is_virtual = forms.BooleanField(
+        required=False,
+        label='Compute when the table is read',
+        help_text='Only for the operation expression. The values are not '
+                  'stored and are always up to date')
+
     def __init__(self, data, *args, **kwargs):
         # Operands for the new derived column
         self.operands = kwargs.pop('operands')
@@ -307,6 +323,9 @@ class FormulaColumnAddForm(forms.ModelForm):
 
         super(FormulaColumnAddForm, self).__init__(data, *args, **kwargs)
 
+        # Result of compiling the expression (if given)
+        self.compiled_expression = None
+
         # Populate the column choices
         self.fields['columns'].choices = [
             (idx, c.name) for idx, c in enumerate(self.wf_columns)
@@ -320,6 +339,31 @@ class FormulaColumnAddForm(forms.ModelForm):
     def clean(self):
         data = super(FormulaColumnAddForm, self).clean()
 
+        if data.get('is_virtual') and data.get('op_type') != 'expression':
+            self.add_error('is_virtual',
+                           'Only the columns with an expression can be '
+                           'computed when the table is read')
+            return data
+
+        # The expression replaces the selection of columns
+        if data.get('op_type') == 'expression':
+            if not data.get('expression'):
+                self.add_error('expression', 'You need to give an expression')
+                return data
+
+            try:
+                self.compiled_expression = sql_expression.compile_expression(
+                    data['expression'],
+                    dict((c.name, c.data_type) for c in self.wf_columns))
+            except ValueError as e:
+                self.add_error('expression', e.message)
+                return data
+
+            self.selected_columns = [
+                c for c in self.wf_columns
+                if c.name in self.compiled_expression['column_names']]
+            return data
+
         # If there are no columns given, return
         column_idx_str = data.get('columns')
         if not column_idx_str:
@@ -355,6 +399,8 @@ class FormulaColumnAddForm(forms.ModelForm):
                   'description_text',
                   'op_type',
                   'columns',
+                  'expression',
+                  'is_virtual',
                   'active_from',
                   'active_to']
 
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-22 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0013_auto_20171209_0809'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='column',
+            name='formula',
+            field=models.TextField(blank=True, default='', verbose_name='Formula'),
+        ),
+        migrations.AddField(
+            model_name='column',
+            name='is_virtual',
+            field=models.BooleanField(default=False, verbose_name='Computed when read'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-23 09:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0014_column_formula'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='data_version',
+            field=models.BigIntegerField(blank=True, default=0, editable=False, verbose_name='Version of the data'),
+        ),
+    ]
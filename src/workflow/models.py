@@ -50,6 +50,14 @@ class Workflow(models.Model):
                                 null=False,
                                 blank=True)
 
+    # Version of the data in the table, increased (with an atomic update) by
+    # every operation modifying it. See pandas_db.increase_data_version
+    data_version = models.BigIntegerField(verbose_name='Version of the data',
+                                          default=0,
+                                          null=False,
+                                          blank=True,
+                                          editable=False)
+
     attributes = JSONField(default=dict,
                            blank=True,
                            null=True)
@@ -104,6 +112,18 @@ class Workflow(models.Model):
 
         return list(self.columns.all().values_list('name', flat=True))
 
+    def get_stored_column_names(self):
+        """
+        Function to access the names of the columns stored in the table (all
+        but the formula columns computed when the table is read).
+
+        :return: List with column names
+        """
+
+        return list(self.columns.filter(is_virtual=False).values_list(
+            'name',
+            flat=True))
+
     def get_column_types(self):
         """
         Function to access the Column types.
@@ -174,6 +194,18 @@ class Workflow(models.Model):
 
         return None
 
+    def save(self, *args, **kwargs):
+        # The data version is only changed by pandas_db.increase_data_version,
+        # so the value in this object (that may be old) is not saved
+        if self.pk is not None and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                x.name for x in self._meta.concrete_fields
+                if not x.primary_key and x.name != 'data_version'
+            ]
+
+        super(Workflow, self).save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -256,6 +288,19 @@ class Column(models.Model):
         default=None
     )
 
+    # Expression to compute the values of the column from other columns of
+    # the workflow (see dataops.sql_expression). Empty for regular columns.
+    formula = models.TextField(default='',
+                               blank=True,
+                               verbose_name='Formula')
+
+    # Boolean stating if the values of a formula column are computed when
+    # the table is read (they are not stored in the table)
+    is_virtual = models.BooleanField(default=False,
+                                     verbose_name='Computed when read',
+                                     null=False,
+                                     blank=False)
+
     def get_categories(self):
         """
         Return the categories and parse datetime if needed.
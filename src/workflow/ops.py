@@ -1,20 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import base64
 import gzip
+import zlib
 
-from io import BytesIO
 from django.contrib.auth import get_user_model
 from django.contrib.sessions.models import Session
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
 
 from action.models import Condition
 from dataops import formula_evaluation, pandas_db, ops
+from dataops import settings as dataops_settings
+from table.renderers import stream_table_arrow
 from .models import Workflow, Column
 from .serializers import (WorkflowExportSerializer, WorkflowImportSerializer)
 from rest_framework import serializers
@@ -77,6 +80,29 @@ def is_locked(workflow):
     return session.expire_date < timezone.now()
 
 
+def get_workflow_etag(request, wid=None):
+    """
+    ETag of the data of the workflow that the user (in the current request)
+    is using, obtained from its data version without loading the workflow.
+    :param request: HTTP request object
+    :param wid: Workflow id. If not given, taken from the request session
+    :return: String or None if the workflow is not accessible
+    """
+    if not wid:
+        wid = request.session.get('ontask_workflow_id')
+        if not wid:
+            return None
+
+    version = Workflow.objects.filter(
+        Q(user=request.user) | Q(shared__id=request.user.id),
+        id=wid
+    ).values_list('data_version', flat=True).first()
+    if version is None:
+        return None
+
+    return '{0}-{1}'.format(wid, version)
+
+
 def get_workflow(request, wid=None, select_related=None, prefetch_related=None):
     """
     Function that gets the workflow that the user (in the current request) is
@@ -215,9 +241,14 @@ def do_import_workflow(user, name, file_item):
     data_in = gzip.GzipFile(fileobj=file_item)
     data = JSONParser().parse(data_in)
     # Serialize content
+    # The data frames pickled by previous versions are only read if enabled
+    # in the configuration and the user is a superuser
     workflow_data = WorkflowImportSerializer(
         data=data,
-        context={'user': user, 'name': name}
+        context={'user': user,
+                 'name': name,
+                 'allow_pickle': dataops_settings.IMPORT_ALLOW_PICKLE and
+                 user.is_superuser}
     )
 
     # If anything went wrong, return the string to show to the form.
@@ -249,34 +280,92 @@ def do_import_workflow(user, name, file_item):
     return None
 
 
-def do_export_workflow(workflow, selected_actions=None):
+def base64_chunks(chunks):
     """
-    Proceed with the workflow export.
-    :param workflow: Workflow record to export be included.
-    :param selected_actions: A subset of actions to export
-    :return: Page that shows a confirmation message and starts the download
+    Encode in Base64 a sequence of byte strings as they arrive (each chunk
+    is encoded up to a multiple of three bytes and the rest is kept for the
+    next one, so the concatenation is the encoding of the whole sequence).
+    :param chunks: Iterable of byte strings
+    :return: Generator of Base64 encoded byte strings
     """
+    remainder = b''
+    for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        remainder = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+
+    if remainder:
+        yield base64.b64encode(remainder)
 
+
+def export_workflow_chunks(workflow, selected_actions=None):
+    """
+    Generator of the JSON representation of the workflow as in
+    WorkflowExportSerializer. The metadata is serialized first, and then the
+    table is read from the DB in chunks and written in the field data_frame
+    (Base64 encoded Arrow IPC stream), so it is never in memory at once.
+    :param workflow: Workflow record to export
+    :param selected_actions: A subset of actions to export
+    :return: Generator of byte strings
+    """
     # Create the context object for the serializer
     context = {'selected_actions': selected_actions}
 
-    # Get the info to send from the serializer
+    # Serialize everything but the data frame
     serializer = WorkflowExportSerializer(workflow, context=context)
-    to_send = JSONRenderer().render(serializer.data)
+    serializer.fields.pop('data_frame')
+    metadata = JSONRenderer().render(serializer.data)
 
-    # Get the in-memory file to compress
-    zbuf = BytesIO()
-    zfile = gzip.GzipFile(mode='wb', compresslevel=6, fileobj=zbuf)
-    zfile.write(to_send)
-    zfile.close()
+    if not ops.workflow_has_table(workflow):
+        yield metadata
+        return
+
+    # Open the data frame field in the JSON object and stream the table
+    yield metadata[:-1] + b', "data_frame": "'
+
+    column_names = workflow.get_column_names()
+    column_types = dict(workflow.columns.values_list('name', 'data_type'))
+    for chunk in base64_chunks(stream_table_arrow(
+            workflow.id,
+            {'column_names': column_names},
+            [column_types[x] for x in column_names])):
+        yield chunk
+
+    yield b'"}'
+
+
+def gzip_chunks(chunks):
+    """
+    Compress in gzip format a sequence of byte strings as they arrive
+    :param chunks: Iterable of byte strings
+    :return: Generator of compressed byte strings
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
 
-    # Attach the compressed value to the response and send
-    compressed_content = zbuf.getvalue()
-    response = HttpResponse(compressed_content)
+
+def do_export_workflow(workflow, selected_actions=None):
+    """
+    Proceed with the workflow export. The file is serialized and compressed
+    while it is sent, so its size does not depend on the memory available.
+    :param workflow: Workflow record to export be included.
+    :param selected_actions: A subset of actions to export
+    :return: Page that shows a confirmation message and starts the download
+    """
+
+    response = StreamingHttpResponse(
+        gzip_chunks(export_workflow_chunks(workflow, selected_actions))
+    )
     response['Content-Encoding'] = 'application/gzip'
     response['Content-Disposition'] = \
         'attachment; filename="ontask_workflow.gz"'
-    response['Content-Length'] = str(len(compressed_content))
 
     return response
 
@@ -292,8 +381,12 @@ def workflow_delete_column(workflow, column, cond_to_delete=None):
     :return: Nothing. Effect reflected in the database
     """
 
-    # Drop the column from the DB table storing the data frame
-    pandas_db.df_drop_column(workflow.id, column.name)
+    # Drop the column from the DB table storing the data frame (the formula
+    # columns computed when the table is read are not stored)
+    if column.is_virtual:
+        pandas_db.increase_data_version(workflow.id)
+    else:
+        pandas_db.df_drop_column(workflow.id, column.name)
 
     # Delete the column
     column.delete()
@@ -354,9 +447,15 @@ def clone_column(column, new_workflow=None, new_name=None):
     # Update
     column.save()
 
-    # Add the column to the table and update it.
-    data_frame = pandas_db.load_from_db(column.workflow.id)
-    data_frame[new_name] = data_frame[old_name]
-    ops.store_dataframe_in_db(data_frame, column.workflow.id)
+    # Add the column to the table copying the values (unless they are
+    # computed when the table is read)
+    if column.is_virtual:
+        pandas_db.increase_data_version(column.workflow.id)
+    else:
+        pandas_db.clone_column_in_db(column.workflow.id,
+                                     old_name,
+                                     column.name,
+                                     column.data_type)
+    ops.workflow_columns_changed(column.workflow)
 
     return column
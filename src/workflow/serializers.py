@@ -6,7 +6,7 @@ from rest_framework.exceptions import APIException
 
 from action.serializers import ActionSerializer
 from dataops import ops, pandas_db
-from table.serializers import DataFramePandasField, ViewSerializer
+from table.serializers import DataFrameArrowField, ViewSerializer
 from .models import Workflow, Column
 
 
@@ -19,7 +19,9 @@ class ColumnSerializer(serializers.ModelSerializer):
             workflow=self.context['workflow'],
             data_type=validated_data['data_type'],
             is_key=validated_data['is_key'],
-            categories=validated_data['categories']
+            categories=validated_data['categories'],
+            formula=validated_data.get('formula', ''),
+            is_virtual=validated_data.get('is_virtual', False)
         )
 
         column_obj.save()
@@ -74,10 +76,12 @@ class WorkflowExportSerializer(serializers.ModelSerializer):
 
     actions = serializers.SerializerMethodField('get_filtered_actions')
 
-    data_frame = DataFramePandasField(
+    # The files exported by previous versions contain a pickle, only read
+    # if allow_pickle is in the context (see do_import_workflow)
+    data_frame = DataFrameArrowField(
         required=False,
-        help_text='This field must be the Base64 encoded '
-                  'result of pandas.to_pickle() function'
+        help_text='This field must be the Base64 encoded data frame in the '
+                  'Arrow IPC stream format'
     )
 
     columns = ColumnSerializer(many=True, required=False)
@@ -175,7 +179,7 @@ class WorkflowExportSerializer(serializers.ModelSerializer):
         #           'query_builder_ops', 'columns', 'data_frame', 'actions')
 
         exclude = ('id', 'user', 'created', 'modified', 'data_frame_table_name',
-                   'session_key', 'shared')
+                   'session_key', 'shared', 'data_version')
 
 
 class WorkflowImportSerializer(WorkflowExportSerializer):
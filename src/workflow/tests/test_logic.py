@@ -41,7 +41,8 @@ class WorkflowImportExport(test.OntaskTestCase):
                          'attachment; filename="ontask_workflow.gz"')
 
         # Process the file
-        data_in = gzip.GzipFile(fileobj=BytesIO(response.content))
+        data_in = gzip.GzipFile(
+            fileobj=BytesIO(b''.join(response.streaming_content)))
         data = JSONParser().parse(data_in)
 
         # Compare the data with the current workflow